@@ -0,0 +1,133 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import os
+import re
+
+from elbepack.pkgstore import PackageStore, file_sha256
+
+
+def uri_to_filename(uri):
+    """Return the file name apt uses in its lists directory for uri
+
+    This follows URItoFileName() of apt.
+
+    >>> uri_to_filename("http://deb.debian.org/debian/dists/bookworm/")
+    'deb.debian.org_debian_dists_bookworm_'
+    >>> uri_to_filename("https://user:pw@example.com:8080/my_repo/./")
+    'example.com:8080_my%5frepo_._'
+    """
+    uri = re.sub(r"^[^:/]*://", "", uri)
+    host, sep, path = uri.partition("/")
+    host = host.rpartition("@")[2]
+
+    quoted = []
+    for c in host + sep + path:
+        if c in '\\|{}[]<>"^~_=!@#$%&*' or ord(c) <= 0x20 or ord(c) >= 0x7f:
+            quoted.append(f"%{ord(c):02x}")
+        else:
+            quoted.append(c)
+
+    return "".join(quoted).replace("/", "_")
+
+
+def list_prefixes(sources):
+    """Return the lists file name prefixes of the entries of a sources.list
+
+    >>> list_prefixes('''
+    ... deb [arch=amd64 trusted=yes] http://deb.debian.org/debian bookworm main
+    ... # deb http://example.com/debian sid main
+    ... deb-src http://example.com/flat ./
+    ... ''')
+    ('deb.debian.org_debian_dists_bookworm_', 'example.com_flat_._')
+    """
+    prefixes = []
+    for line in sources.splitlines():
+        line = re.sub(r"\[[^]]*\]", "", line.split("#", 1)[0]).split()
+        if len(line) < 3 or line[0] not in ("deb", "deb-src"):
+            continue
+
+        uri, suite = line[1], line[2]
+        if not uri.endswith("/"):
+            uri += "/"
+        if suite.endswith("/"):
+            # Flat repository
+            prefix = uri_to_filename(uri + suite)
+        else:
+            prefix = uri_to_filename(f"{uri}dists/{suite}/")
+
+        if prefix not in prefixes:
+            prefixes.append(prefix)
+
+    return tuple(prefixes)
+
+
+def read_sources(sources_files):
+    """Return the concatenated content of the existing sources_files"""
+    sources = []
+    for fname in sources_files:
+        try:
+            with open(fname, "r", encoding="utf-8") as f:
+                sources.append(f.read())
+        except OSError:
+            pass
+    return "\n".join(sources)
+
+
+class ListsCache:
+    """Host wide cache of apt package lists
+
+    Before an update, the lists directory of a project is seeded with
+    the newest cached Release and index files of its sources.  apt
+    then only asks the mirror for changes since the cached Release
+    file, by If-Modified-Since, and skips every index whose hash
+    still matches the new Release file, including by-hash indices.
+
+    After the update, the lists are added to the cache, which is
+    content addressed.  The project keeps hardlinks to the cached
+    files, so projects with the same sources share the data.
+    """
+
+    default_path = "/var/cache/elbe/lists"
+    default_maxsize = 4 * 1024 * 1024 * 1024
+
+    def __init__(self, path=None, maxsize=None):
+        self.store = PackageStore(path or self.default_path,
+                                  maxsize or self.default_maxsize)
+
+    def close(self):
+        self.store.close()
+
+    def seed(self, listsdir, sources):
+        """Place the cached lists for sources into listsdir
+
+        Files already present in listsdir are not touched.  Returns
+        the number of files taken from the cache.
+        """
+        prefixes = list_prefixes(sources)
+        if not prefixes:
+            return 0
+
+        present = set(os.listdir(listsdir))
+        return len(self.store.fetch([
+            (sha256, os.path.join(listsdir, name))
+            for name, sha256 in self.store.newest(prefixes).items()
+            if name not in present]))
+
+    def collect(self, listsdir):
+        """Add the lists in listsdir to the cache"""
+        items = []
+        for name in os.listdir(listsdir):
+            path = os.path.join(listsdir, name)
+            if name == "lock" or os.path.islink(path) or \
+               not os.path.isfile(path):
+                continue
+            items.append((path, file_sha256(path)))
+
+        known = self.store.names(("",))
+        self.store.add(items)
+
+        # Replace copies of already cached files by hardlinks
+        self.store.fetch([(sha256, path) for path, sha256 in items
+                          if sha256 in known])
@@ -6,6 +6,8 @@
 import os
 import logging
 
+from array import array
+
 import apt
 from apt.package import FetchError
 
@@ -47,29 +49,119 @@ def apt_pkg_sha256(pkg):
             return h.split(':')[1]
     return ""
 
+def apt_pkg_hashes(pkg):
+    """Return (md5, sha256) of a package version in a single pass"""
+    md5 = sha256 = ""
+    # pylint: disable=protected-access
+    for h in pkg._records.hashes:
+        h = str(h)
+        if h.startswith("MD5"):
+            md5 = h.split(':')[1]
+        elif h.startswith("SHA256"):
+            sha256 = h.split(':')[1]
+    return md5, sha256
+
 def getdeps(pkg):
     for dd in pkg.dependencies:
         for d in dd:
             yield d.name
 
 
-def getalldeps(c, pkgname):
-    retval = []
-    togo = [pkgname]
+class DependencyGraph:
+    """Dependency closures of the candidates in an apt.Cache
 
-    while togo:
-        pp = togo.pop()
-        pkg = c[pp]
+    The dependencies of a package are looked up once, directly in the
+    apt_pkg cache.  All alternatives of an or-group are followed, a
+    virtual package is resolved to its installed or marked providers.
 
-        for p in getdeps(pkg.candidate):
-            if p in retval:
-                continue
-            if p not in c:
+    Closures are cached per package, candidate version and dependency
+    types.  A closure holds every package reachable through at least
+    one dependency, so a package is only part of its own closure, if
+    it is in a dependency cycle.
+    """
+
+    def __init__(self, cache, deptypes=("PreDepends", "Depends")):
+        # pylint: disable=protected-access
+        self.rawcache = cache._cache
+        self.depcache = cache._depcache
+        self.deptypes = tuple(deptypes)
+        self._edges = {}
+        self._resolved = {}
+        self._closures = {}
+
+    def _resolve(self, rawpkg):
+        """Return the names of the real packages satisfying rawpkg"""
+        name = rawpkg.name
+        ret = self._resolved.get(name)
+        if ret is None:
+            if rawpkg.has_versions:
+                ret = (name,)
+            else:
+                ret = tuple({ver.parent_pkg.name
+                             for _, _, ver in rawpkg.provides_list
+                             if ver.parent_pkg.current_ver or
+                             self.depcache.marked_install(ver.parent_pkg)})
+            self._resolved[name] = ret
+        return ret
+
+    def _node(self, name):
+        """Return (cache key, dependency names) of a package"""
+        rawpkg = self.rawcache[name]
+        if not rawpkg.has_versions:
+            raise KeyError(f"The cache has no package named '{name}'")
+
+        ver = self.depcache.get_candidate_ver(rawpkg)
+        key = (name, ver and ver.ver_str, self.deptypes)
+
+        deps = self._edges.get(key)
+        if deps is None:
+            deps = set()
+            if ver:
+                for deptype in self.deptypes:
+                    for group in ver.depends_list.get(deptype, []):
+                        for dep in group:
+                            deps.update(self._resolve(dep.target_pkg))
+            deps = self._edges[key] = frozenset(deps)
+
+        return key, deps
+
+    def _traverse(self, names):
+        ret = set()
+        togo = []
+        for name in names:
+            togo.extend(self._node(name)[1])
+
+        while togo:
+            name = togo.pop()
+            if name in ret:
                 continue
-            retval.append(p)
-            togo.append(p)
+            ret.add(name)
 
-    return retval
+            key, deps = self._node(name)
+            closure = self._closures.get(key)
+            if closure is not None:
+                # Already closed, no need to walk it again
+                ret |= closure
+            else:
+                togo.extend(deps - ret)
+
+        return frozenset(ret)
+
+    def closure(self, name):
+        """Return the set of all dependencies of a package"""
+        key, _ = self._node(name)
+        ret = self._closures.get(key)
+        if ret is None:
+            ret = self._closures[key] = self._traverse([name])
+        return ret
+
+    def closure_many(self, names):
+        """Return the union of the closures of names in one traversal"""
+        return self._traverse(names)
+
+
+def getalldeps(c, pkgname):
+    return sorted(DependencyGraph(c).closure(pkgname))
 
 
 def pkgstate(pkg):
@@ -103,7 +195,7 @@ def _file_is_same(path, size, sha256):
             return apt_pkg.sha256sum(fobj) == sha256
     return False
 
-def fetch_binary(version, destdir='', progress=None):
+def fetch_binary(version, destdir='', progress=None, store=None):
     # type: (str, AcquireProgress) -> str
     """Fetch the binary version of the package.
 
@@ -125,29 +217,196 @@ def fetch_binary(version, destdir='', progress=None):
 
     Then fixed up to use sha256 and pass pycodestyle.
     """
-    # pylint: disable=protected-access
-    base = os.path.basename(version._records.filename)
-    destfile = os.path.join(destdir, base)
-    # pylint: disable=protected-access
-    if _file_is_same(destfile, version.size, version._records.sha256_hash):
-        logging.debug('Ignoring already existing file: %s', destfile)
-        return os.path.abspath(destfile)
+    ret = fetch_binaries([version], destdir, progress, store)[0]
+    if isinstance(ret, FetchError):
+        # pylint: disable=raising-bad-type
+        raise ret
+    return ret
+
+def fetch_binaries(versions, destdir='', progress=None, store=None):
+    """Fetch the binaries of several package versions in a single run
+
+    All files are queued into one apt_pkg.Acquire, so that apt
+    downloads them in parallel.  Files that already exist with the
+    right sha256 are not fetched again.  If a PackageStore is given,
+    files are taken from it first and downloaded files are added to it.
+
+    Returns a list with the absolute path of the fetched file or the
+    FetchError for every version.
+    """
+    # pylint: disable=too-many-locals
+
+    ret = [None] * len(versions)
+    items = {}
+    wanted = []
     acq = apt_pkg.Acquire(progress or apt.progress.text.AcquireProgress())
-    # pylint: disable=protected-access
-    acqfile = apt_pkg.AcquireFile(acq,
-                                  version.uri,
-                                  "SHA256:" + version._records.sha256_hash,
-                                  version.size,
-                                  base,
-                                  destfile=destfile)
-    acq.run()
 
-    if acqfile.status != acqfile.STAT_DONE:
-        raise FetchError(
-            f"The item {acqfile.destfile} could not be fetched: "
-            f"{acqfile.error_text}")
+    for i, version in enumerate(versions):
+        # pylint: disable=protected-access
+        base = os.path.basename(version._records.filename)
+        destfile = os.path.join(destdir, base)
+        # pylint: disable=protected-access
+        if _file_is_same(destfile, version.size, version._records.sha256_hash):
+            logging.debug('Ignoring already existing file: %s', destfile)
+            ret[i] = os.path.abspath(destfile)
+            continue
+        # pylint: disable=protected-access
+        wanted.append((i, version._records.sha256_hash, destfile))
+
+    stored = set()
+    if store is not None:
+        stored = store.fetch([(sha256, destfile)
+                              for _, sha256, destfile in wanted])
+
+    for i, sha256, destfile in wanted:
+        version = versions[i]
+        if destfile in stored:
+            ret[i] = os.path.abspath(destfile)
+            continue
+        if destfile not in items:
+            items[destfile] = (apt_pkg.AcquireFile(
+                acq,
+                version.uri,
+                "SHA256:" + sha256,
+                version.size,
+                os.path.basename(destfile),
+                destfile=destfile), sha256, [])
+        items[destfile][2].append(i)
+
+    if items:
+        acq.run()
+
+    fetched = []
+
+    for destfile, (acqfile, sha256, idx) in items.items():
+        if acqfile.status != acqfile.STAT_DONE:
+            result = FetchError(
+                f"The item {acqfile.destfile} could not be fetched: "
+                f"{acqfile.error_text}")
+        else:
+            result = os.path.abspath(destfile)
+            fetched.append((result, sha256))
+        for i in idx:
+            ret[i] = result
+
+    if store is not None:
+        store.add(fetched)
+
+    return ret
+
+def fetch_sources(srcpkgs, destdir='', progress=None, store=None):
+    """Fetch many source packages in a single run
 
-    return os.path.abspath(destfile)
+    srcpkgs is a list of (source name, version) tuples.  The source
+    records are scanned once and all files are queued into one
+    apt_pkg.Acquire.  If a PackageStore is given, files are taken from
+    it first and downloaded files are added to it.
+
+    Returns a dict mapping every (name, version) to the absolute path
+    of its .dsc file, or to the ValueError or FetchError that prevented
+    the download.
+    """
+
+    # pylint: disable=too-many-locals
+    # pylint: disable=too-many-branches
+
+    allow_untrusted = apt_pkg.config.find_b("APT::Get::AllowUnauthenticated",
+                                            False)
+
+    ret = {}
+    todo = set(srcpkgs)
+
+    # One pass over all source records
+    found = {}
+    rec = apt_pkg.SourceRecords()
+    while todo and rec.step():
+        key = (rec.package, rec.version)
+        if key not in todo:
+            continue
+        todo.discard(key)
+
+        # We don't allow untrusted package and the package is not
+        # marks as trusted
+        if not (allow_untrusted or rec.index.is_trusted):
+            ret[key] = FetchError(
+                f"Can't fetch source {key[0]}_{key[1]}; "
+                f"Source {rec.index.describe} is not trusted")
+            continue
+
+        found[key] = [(_file, rec.index.archive_uri(_file.path))
+                      for _file in rec.files]
+
+    for key in todo:
+        ret[key] = ValueError(f"No source found for {key[0]}_{key[1]}")
+
+    # Collect all files of the source packages
+    dscs = {}
+    wanted = {}
+    for key, files in found.items():
+        for _file, uri in files:
+            src = os.path.basename(_file.path)
+            dst = os.path.join(destdir, src)
+
+            if not (allow_untrusted or _file.hashes.usable):
+                ret[key] = FetchError(
+                    f"Can't fetch file {dst}. No trusted hash found.")
+                break
+
+            if _file.type == 'dsc':
+                dscs[key] = dst
+
+            sha256 = _file.hashes.find("SHA256")
+            # Source packages may share their orig tarball
+            wanted.setdefault(dst, (_file, src, uri,
+                                    sha256.hashvalue if sha256 else None,
+                                    []))[4].append(key)
+        else:
+            if key not in dscs:
+                ret[key] = ValueError(
+                    f"No source found for {key[0]}_{key[1]}")
+
+    wanted = {dst: item for dst, item in wanted.items()
+              if any(key not in ret for key in item[4])}
+
+    stored = set()
+    if store is not None:
+        stored = store.fetch([(sha256, dst)
+                              for dst, (_, _, _, sha256, _)
+                              in wanted.items() if sha256])
+
+    acq = apt_pkg.Acquire(progress or apt.progress.text.AcquireProgress())
+
+    # acq is accumlating the AcquireFile, the files list only
+    # exists to prevent Python from GC the object .. I guess.
+    # Anyway, if we don't keep the list, We will get an empty
+    # directory
+    files = []
+    for dst, (_file, src, uri, _, _) in wanted.items():
+        if dst in stored:
+            continue
+        files.append(apt_pkg.AcquireFile(acq, uri, _file.hashes, _file.size,
+                                         src, destfile=dst))
+    if files:
+        acq.run()
+
+    failed = set()
+    for item in acq.items:
+        if item.STAT_DONE != item.status:
+            failed.add(item.destfile)
+            for key in wanted[item.destfile][4]:
+                ret[key] = FetchError(
+                    f"Can't fetch item {item.destfile}: {item.error_text}")
+
+    if store is not None:
+        store.add([(dst, sha256)
+                   for dst, (_, _, _, sha256, _) in wanted.items()
+                   if sha256 and dst not in stored | failed])
+
+    for key, dsc in dscs.items():
+        if key not in ret:
+            ret[key] = os.path.abspath(dsc)
+
+    return ret
 
 class PackageBase:
 
@@ -234,3 +493,205 @@ class XMLPackage(PackageBase):
                              node.et.get('prio'), None,
                              INSTALLED, node.et.get('auto') == 'true',
                              None, arch)
+
+
+def append_hashes(hashes, installed, candidate):
+    """Append the hashes of two apt.package.Version to the hash columns
+
+    A missing version has None as its hashes.
+    """
+    imd5, isha256 = apt_pkg_hashes(installed) if installed \
+        else (installed, installed)
+    cmd5, csha256 = apt_pkg_hashes(candidate) if candidate \
+        else (candidate, candidate)
+    for field, value in zip(PackageSnapshot.hash_fields,
+                            (imd5, cmd5, isha256, csha256)):
+        hashes[field].append(value)
+
+
+class SnapshotPackage(PackageBase):
+    """Package of a PackageSnapshot
+
+    The attributes are looked up in the columns of the snapshot, the
+    object itself only holds the snapshot and the row.
+    """
+
+    # pylint: disable=super-init-not-called
+    __slots__ = ("_snap", "_row")
+
+    def __init__(self, snap, row):
+        self._snap = snap
+        self._row = row
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self._snap.value(name, self._row)
+
+    def __reduce__(self):
+        return (SnapshotPackage, (self._snap, self._row))
+
+
+class PackageSnapshot:
+    """Compact list of packages, that is cheap to pickle
+
+    Package names are kept in a plain list.  The other attributes only
+    have a few distinct values, every column is an array of small
+    indices into a table of interned values.  Both version columns
+    share a table, as well as both priority columns.  installed_deb is
+    derived from name, version and architecture.
+
+    The md5 and sha256 columns are optional, because scanning the
+    records for the hashes is expensive.  A snapshot taken with lazy
+    hashes fills them from hash_source on the first access to one of
+    them.  hash_source is not pickled, the RPCAPTCache proxy sets it
+    again on the receiving side.  generation is the state of the cache
+    the snapshot was taken from.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    # column => value table
+    tables = {"installed_version": "version",
+              "candidate_version": "version",
+              "installed_prio": "prio",
+              "candidate_prio": "prio",
+              "state": "state",
+              "is_auto_installed": "auto",
+              "origin": "origin",
+              "architecture": "arch"}
+    hash_fields = ("installed_md5", "candidate_md5",
+                   "installed_sha256", "candidate_sha256")
+
+    def __init__(self, generation=0):
+        self.generation = generation
+        self.names = []
+        self.values = {table: [] for table in set(self.tables.values())}
+        self.columns = {field: array('B') for field in self.tables}
+        self.hashes = None
+        self.lazy_hashes = False
+        self.hash_source = None
+        self._index = {table: {} for table in self.values}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_index"]
+        state["hash_source"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._index = {table: {(type(v), v): i for i, v in enumerate(values)}
+                       for table, values in self.values.items()}
+
+    def _intern(self, field, value):
+        table = self.tables[field]
+        # Keyed by type as well, True and 1 must not be merged
+        key = (type(value), value)
+        idx = self._index[table].get(key)
+        if idx is None:
+            idx = len(self.values[table])
+            self.values[table].append(value)
+            self._index[table][key] = idx
+
+        column = self.columns[field]
+        if idx >= 1 << (8 * column.itemsize):
+            # Widen the column, 'B' -> 'H' -> 'I'
+            column = array('H' if column.typecode == 'B' else 'I', column)
+            self.columns[field] = column
+        column.append(idx)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return SnapshotPackage(self, row)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield SnapshotPackage(self, row)
+
+    def value(self, field, row):
+        if field == "name":
+            return self.names[row]
+        if field in self.tables:
+            return self.values[self.tables[field]][self.columns[field][row]]
+        if field == "installed_deb":
+            iver = self.value("installed_version", row)
+            if not iver:
+                return None
+            return (f"{self.names[row]}_{iver.replace(':', '%3a')}_"
+                    f"{self.value('architecture', row)}.deb")
+        if field in self.hash_fields:
+            if self.hashes is None and self.lazy_hashes:
+                self.load_hashes()
+            # None, if the snapshot was taken without hashes
+            return self.hashes and self.hashes[field][row]
+        raise AttributeError(field)
+
+    @property
+    def has_hashes(self):
+        return self.hashes is not None or self.lazy_hashes
+
+    def load_hashes(self):
+        """Fill in the hash columns from hash_source
+
+        hash_source is called with the names and both version columns
+        and returns the hash columns, so the hashes belong to the
+        versions of the snapshot, even if the cache changed since.
+        """
+        if self.hash_source is None:
+            raise RuntimeError("The package snapshot has no hash source")
+        self.hashes = self.hash_source(
+            self.names,
+            [self.value("installed_version", row) for row in range(len(self))],
+            [self.value("candidate_version", row) for row in range(len(self))])
+
+    def with_lazy_hashes(self, hash_source):
+        """Return a copy of the snapshot, that loads the hashes on demand
+
+        The copy shares the columns with the snapshot.
+        """
+        snap = PackageSnapshot.__new__(PackageSnapshot)
+        snap.__dict__.update(self.__dict__)
+        snap.lazy_hashes = True
+        snap.hash_source = hash_source
+        return snap
+
+    def append(self, pkg):
+        """Append an apt.Package to the snapshot"""
+        if pkg.installed:
+            arch = pkg.installed.architecture
+        elif pkg.candidate:
+            arch = pkg.candidate.architecture
+        else:
+            arch = None
+
+        self.names.append(pkg.name)
+        self._intern("installed_version", pkg.installed and pkg.installed.version)
+        self._intern("candidate_version", pkg.candidate and pkg.candidate.version)
+        self._intern("installed_prio", pkg.installed and pkg.installed.priority)
+        self._intern("candidate_prio", pkg.candidate and pkg.candidate.priority)
+        self._intern("state", pkgstate(pkg))
+        self._intern("is_auto_installed", pkg.is_auto_installed)
+        self._intern("origin", pkgorigin(pkg))
+        self._intern("architecture", arch)
+
+        if self.hashes is not None:
+            self._append_hashes(pkg)
+
+    def _append_hashes(self, pkg):
+        append_hashes(self.hashes, pkg.installed, pkg.candidate)
+
+    @classmethod
+    def from_packages(cls, pkgs, generation=0, hashes=True):
+        snap = cls(generation)
+        if hashes:
+            snap.hashes = {field: [] for field in cls.hash_fields}
+        for pkg in pkgs:
+            snap.append(pkg)
+        return snap
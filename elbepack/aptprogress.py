@@ -69,6 +69,8 @@ class ElbeAcquireProgress (AcquireProgress):
         AcquireProgress.__init__(self)
         self._id = 1
         self.cb = cb
+        # Bytes actually downloaded, without IMS hits and local copies
+        self.downloaded_bytes = 0
 
     def write(self, line):
         line.replace('\f', '')
@@ -98,6 +100,10 @@ class ElbeAcquireProgress (AcquireProgress):
 
         self.write(line)
 
+    def done(self, item):
+        if not item.owner.local:
+            self.downloaded_bytes += item.owner.filesize
+
     @staticmethod
     def pulse(_owner):
         return True
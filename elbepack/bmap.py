@@ -0,0 +1,99 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import hashlib
+import os
+
+from elbepack.copyengine import data_segments
+
+BLOCK_SIZE = 4096
+
+
+def mapped_ranges(fd, size, block_size=BLOCK_SIZE):
+    """Return the (first, last) block numbers of the data in fd
+
+    Data segments are widened to whole blocks, adjacent ranges are
+    merged.
+    """
+    ranges = []
+    for start, end in data_segments(fd, size):
+        first = start // block_size
+        last = (end - 1) // block_size
+        if ranges and ranges[-1][1] + 1 >= first:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], last))
+        else:
+            ranges.append((first, last))
+    return ranges
+
+
+def _range_sha256(fd, first, last, size, block_size):
+    h = hashlib.sha256()
+    pos = first * block_size
+    end = min((last + 1) * block_size, size)
+    while pos < end:
+        buf = os.pread(fd, min(end - pos, 1024 * 1024), pos)
+        if not buf:
+            break
+        h.update(buf)
+        pos += len(buf)
+    return h.hexdigest()
+
+
+def bmap_xml(fd, block_size=BLOCK_SIZE):
+    """Return the block map of the image fd in bmaptool's format 2.0"""
+
+    size = os.fstat(fd).st_size
+    ranges = mapped_ranges(fd, size, block_size)
+    blocks = (size + block_size - 1) // block_size
+    mapped = sum(last - first + 1 for first, last in ranges)
+
+    lines = ['<?xml version="1.0" ?>',
+             '<bmap version="2.0">',
+             f'    <ImageSize> {size} </ImageSize>',
+             f'    <BlockSize> {block_size} </BlockSize>',
+             f'    <BlocksCount> {blocks} </BlocksCount>',
+             f'    <MappedBlocksCount> {mapped} </MappedBlocksCount>',
+             '    <ChecksumType> sha256 </ChecksumType>',
+             '    <BmapFileChecksum> {checksum} </BmapFileChecksum>',
+             '    <BlockMap>']
+
+    for first, last in ranges:
+        chksum = _range_sha256(fd, first, last, size, block_size)
+        blks = str(first) if first == last else f"{first}-{last}"
+        lines.append(f'        <Range chksum="{chksum}"> {blks} </Range>')
+
+    lines += ['    </BlockMap>',
+              '</bmap>',
+              '']
+
+    # The checksum of the bmap file is calculated with zeros in place
+    # of the checksum itself
+    xml = "\n".join(lines)
+    checksum = hashlib.sha256(
+        xml.replace("{checksum}", "0" * 64).encode()).hexdigest()
+    return xml.replace("{checksum}", checksum)
+
+
+def write_bmap(fname, bmapname=None):
+    """Write the block map of the image fname
+
+    The block map lists the blocks of the image, that hold data,
+    with their checksums.  bmaptool uses it to write only these
+    blocks when flashing the image, even a compressed one.
+    Returns the name of the block map file, which is fname.bmap by
+    default.
+    """
+    if bmapname is None:
+        bmapname = fname + ".bmap"
+
+    fd = os.open(fname, os.O_RDONLY)
+    try:
+        xml = bmap_xml(fd)
+    finally:
+        os.close(fd)
+
+    with open(bmapname, "w", encoding="utf-8") as f:
+        f.write(xml)
+
+    return bmapname
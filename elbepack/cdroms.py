@@ -21,20 +21,37 @@ from elbepack.isooptions import get_iso_options
 
 CDROM_SIZE = 640 * 1000 * 1000
 
-# pylint: disable=too-many-arguments
-def add_source_pkg(repo, component, cache, pkg, version, forbid):
-    if pkg in forbid:
-        return
-    pkg_id = f"{pkg}-{version}"
-    try:
-        dsc = cache.download_source(pkg,
-                                    version,
-                                    '/var/cache/elbe/sources')
-        repo.includedsc(dsc, components=component, force=True)
-    except ValueError as e:
-        logging.error("No sources for package '%s': %s", pkg_id, str(e))
-    except FetchError as e:
-        logging.error("Source for package '%s' could not be downloaded: %s", pkg_id, str(e))
+def add_source_pkgs(repo, component, cache, pkg_lst, forbid):
+    pkg_lst = [(pkg, version) for pkg, version in pkg_lst
+               if pkg not in forbid]
+    results = cache.download_sources(pkg_lst, '/var/cache/elbe/sources')
+
+    dscs = {}
+    for pkg, version in pkg_lst:
+        pkg_id = f"{pkg}-{version}"
+        dsc = results[(pkg, version)]
+        if isinstance(dsc, ValueError):
+            logging.error("No sources for package '%s': %s", pkg_id, str(dsc))
+        elif isinstance(dsc, FetchError):
+            logging.error("Source for package '%s' could not be downloaded: %s",
+                          pkg_id, str(dsc))
+        else:
+            dscs[dsc] = pkg_id
+
+    failed = repo.includedsc_many(dscs, components=component, force=True)
+    for dsc, ce in failed.items():
+        logging.error("Source for package '%s' could not be added to repo: %s",
+                      dscs[dsc], ce)
+
+def log_download_error(pkg_id, e):
+    if isinstance(e, FetchError):
+        logging.error("Package '%s' could not be downloaded", pkg_id)
+    elif isinstance(e, KeyError):
+        logging.error(str(e))
+    elif isinstance(e, ValueError):
+        logging.error("No package '%s'", pkg_id)
+    else:
+        logging.error("Package '%s' missing name or version", pkg_id)
 
 def mk_source_cdrom(components, codename,
                     init_codename, target,
@@ -66,10 +83,7 @@ def mk_source_cdrom(components, codename,
                             os.path.join(target, f"srcrepo-{component}"),
                             cdrom_size, mirror)
         repos[component] = repo
-        for pkg, version in pkg_lst:
-            add_source_pkg(repo, component,
-                           cache, pkg, version,
-                           forbiddenPackages)
+        add_source_pkgs(repo, component, cache, pkg_lst, forbiddenPackages)
 
     # elbe fetch_initvm_pkgs has downloaded all sources to
     # /var/cache/elbe/sources
@@ -157,38 +171,46 @@ def mk_binary_cdrom(rfs, arch, codename, init_codename, xml, target):
 
     if xml is not None:
         cache = get_rpcaptcache(rfs, arch)
-        for p in xml.node("debootstrappkgs"):
-            pkg = XMLPackage(p, arch)
+        pkglist = [XMLPackage(p, arch) for p in xml.node("debootstrappkgs")]
+        results = cache.download_binaries(
+            [(pkg.name, pkg.installed_version) for pkg in pkglist],
+            '/var/cache/elbe/binaries/main')
+        debs = {}
+        prio_map = {}
+        for pkg in pkglist:
             pkg_id = f"{pkg.name}-{pkg.installed_version}"
-            try:
-                deb = cache.download_binary(pkg.name,
-                                            '/var/cache/elbe/binaries/main',
-                                            pkg.installed_version)
-                target_repo.includedeb(deb, 'main', prio=pkg.installed_prio)
-            except ValueError:
-                logging.error("No package '%s'", pkg_id)
-            except FetchError:
-                logging.error("Package '%s' could not be downloaded", pkg_id)
-            except TypeError:
-                logging.error("Package '%s' missing name or version", pkg_id)
+            deb = results[(pkg.name, pkg.installed_version)]
+            if isinstance(deb, Exception):
+                log_download_error(pkg_id, deb)
+                continue
+            debs[deb] = pkg_id
+            prio_map[deb] = pkg.installed_prio
+
+        failed = target_repo.include_many(debs, 'main', prio_map)
+        for deb, ce in failed.items():
+            logging.error("Package '%s' could not be added to repo: %s",
+                          debs[deb], ce)
 
     cache = get_rpcaptcache(rfs, arch)
-    pkglist = cache.get_installed_pkgs()
+    pkglist = cache.get_installed_pkgs(hashes=False)
+    results = cache.download_binaries(
+        [(pkg.name, pkg.installed_version) for pkg in pkglist],
+        '/var/cache/elbe/binaries/added')
+    debs = {}
+    prio_map = {}
     for pkg in pkglist:
         pkg_id = f"{pkg.name}-{pkg.installed_version}"
-        try:
-            deb = cache.download_binary(pkg.name,
-                                        '/var/cache/elbe/binaries/added',
-                                        pkg.installed_version)
-            target_repo.includedeb(deb, 'added', pkg.name, prio=pkg.installed_prio, force=True)
-        except KeyError as ke:
-            logging.error(str(ke))
-        except ValueError:
-            logging.error("No package '%s'", pkg_id)
-        except FetchError:
-            logging.error("Package '%s' could not be downloaded", pkg_id)
-        except TypeError:
-            logging.error("Package '%s' missing name or version", pkg_id)
+        deb = results[(pkg.name, pkg.installed_version)]
+        if isinstance(deb, Exception):
+            log_download_error(pkg_id, deb)
+            continue
+        debs[deb] = pkg_id
+        prio_map[deb] = pkg.installed_prio
+
+    failed = target_repo.include_many(debs, 'added', prio_map, force=True)
+    for deb, ce in failed.items():
+        logging.error("Package '%s' could not be added to repo: %s",
+                      debs[deb], ce)
 
     target_repo.finalize()
 
@@ -67,6 +67,14 @@ def run_command(argv):
     oparser.add_option("--matches", dest="matches", default=False,
                        help="Select files based on wildcard expression.")
 
+    oparser.add_option("--search-mode", dest="search_mode",
+                       default="substring",
+                       choices=["prefix", "substring", "glob"],
+                       help="How search_packages matches package names.")
+
+    oparser.add_option("--limit", dest="limit", default=None, type="int",
+                       help="Return at most <limit> packages.")
+
     oparser.add_option("--pbuilder-only", action="store_true",
                        dest="pbuilder_only", default=False,
                        help="Only list/download pbuilder Files")
@@ -4,10 +4,12 @@
 
 import sys
 import logging
+import time
 from optparse import OptionParser
 
 from apt.package import FetchError
 from apt import Cache
+from apt_pkg import size_to_str
 
 from elbepack.elbexml import ElbeXML, ValidationError
 from elbepack.repomanager import CdromInitRepo, CdromSrcRepo
@@ -15,8 +17,61 @@ from elbepack.dump import get_initvm_pkglist
 from elbepack.aptprogress import ElbeAcquireProgress
 from elbepack.filesystem import hostfs
 from elbepack.log import elbe_logging
-from elbepack.shellhelper import do, CommandError
-from elbepack.aptpkgutils import fetch_binary
+from elbepack.shellhelper import do
+from elbepack.aptpkgutils import fetch_binaries, fetch_sources
+from elbepack.pkgstore import PackageStore
+
+
+RETRIES = 3
+BACKOFF = 2
+
+
+class FetchStats:
+    """Downloaded bytes, time and retries of all acquire runs"""
+
+    def __init__(self):
+        self.downloaded = 0
+        self.elapsed = 0.0
+        self.items = 0
+        self.retries = 0
+
+    def report(self):
+        rate = self.downloaded / self.elapsed if self.elapsed else 0
+        logging.info("Fetched %d items, downloaded %sB in %.1fs (%sB/s), "
+                     "%d retries",
+                     self.items, size_to_str(self.downloaded), self.elapsed,
+                     size_to_str(rate), self.retries)
+
+
+def fetch_retry(fetch, keys, stats):
+    """Fetch all keys in one acquire run, retry only the failed ones
+
+    fetch(keys, progress) returns a dict mapping every key to its
+    result or to an exception.  Downloads failing with a FetchError
+    are run again up to RETRIES times, waiting a little longer before
+    every attempt.  Returns the merged results.
+    """
+    results = {}
+    stats.items += len(keys)
+    for attempt in range(RETRIES):
+        if attempt:
+            delay = BACKOFF ** attempt
+            logging.warning("Retrying %d failed downloads in %ds",
+                            len(keys), delay)
+            time.sleep(delay)
+            stats.retries += len(keys)
+
+        progress = ElbeAcquireProgress(cb=None)
+        start = time.monotonic()
+        results.update(fetch(keys, progress))
+        stats.elapsed += time.monotonic() - start
+        stats.downloaded += progress.downloaded_bytes
+
+        keys = [key for key in keys if isinstance(results[key], FetchError)]
+        if not keys:
+            break
+
+    return results
 
 
 def run_command(argv):
@@ -102,40 +157,55 @@ def run_command(argv):
 
         hostfs.mkdir_p(opt.archive)
 
+        pkglist = get_initvm_pkglist()
+        cache = Cache()
+        cache.open()
+        try:
+            store = PackageStore()
+        except OSError as e:
+            logging.warning("Package store not available: %s", e)
+            store = None
+        stats = FetchStats()
+
+        # Installed versions of the initvm packages
+        versions = {}
+        for pkg in pkglist:
+            pkg_id = f"{pkg.name}-{pkg.installed_version}"
+            try:
+                pkgver = cache[pkg.name].installed
+            except KeyError:
+                pkgver = None
+            if pkgver is None:
+                logging.error('No package "%s"', pkg_id)
+                continue
+            versions[pkg_id] = pkgver
+
         if opt.build_bin:
-            pkglist = get_initvm_pkglist()
-            cache = Cache()
-            cache.open()
-            for pkg in pkglist:
-                pkg_id = f"{pkg.name}-{pkg.installed_version}"
-                retry = 1
-                while retry < 3:
-                    try:
-                        p = cache[pkg.name]
-                        pkgver = p.installed
-                        deb = fetch_binary(pkgver,
-                                           opt.archive,
-                                           ElbeAcquireProgress(cb=None))
-                        repo.includedeb(deb, 'main', prio=pkgver.priority)
-                        break
-                    except ValueError:
-                        logging.exception('No package "%s"', pkg_id)
-                        retry = 3
-                    except FetchError:
-                        logging.exception('Package "%s-%s" could not be downloaded',
-                                          pkg.name, pkgver.version)
-                        retry += 1
-                    except TypeError:
-                        logging.exception('Package "%s" missing name or version',
-                                          pkg_id)
-                        retry = 3
-                    except CommandError:
-                        logging.exception('Package "%s-%s" could not be added to repo.',
-                                          pkg.name, pkgver.version)
-                        retry += 1
-                    if retry >= 3:
-                        logging.error('Failed to get binary Package "%s"',
-                                      pkg_id)
+            def fetch_debs(pkg_ids, progress):
+                return dict(zip(pkg_ids,
+                                fetch_binaries([versions[pkg_id]
+                                                for pkg_id in pkg_ids],
+                                               opt.archive, progress, store)))
+
+            results = fetch_retry(fetch_debs, list(versions), stats)
+
+            debs = {}
+            prio_map = {}
+            for pkg_id, deb in results.items():
+                if isinstance(deb, Exception):
+                    logging.error('Failed to get binary Package "%s": %s',
+                                  pkg_id, deb)
+                    continue
+                debs[deb] = pkg_id
+                prio_map[deb] = versions[pkg_id].priority
+
+            # A failing batch is retried item by item by include_many,
+            # so whatever fails here has already been retried.
+            failed = repo.include_many(debs, 'main', prio_map)
+            for deb, ce in failed.items():
+                logging.error('Package "%s" could not be added to repo: %s',
+                              debs[deb], ce)
+                logging.error('Failed to get binary Package "%s"', debs[deb])
 
         repo.finalize()
 
@@ -152,36 +222,28 @@ def run_command(argv):
             opt.build_sources = False
 
         if opt.build_sources:
-            for pkg in pkglist:
-                pkg_id = f"{pkg.name}-{pkg.installed_version}"
-                retry = 1
-                while retry < 3:
-                    try:
-                        p = cache[pkg.name]
-                        pkgver = p.installed
-                        dsc = pkgver.fetch_source(opt.srcarchive,
-                                                  ElbeAcquireProgress(cb=None),
-                                                  unpack=False)
-                        repo.include_init_dsc(dsc, 'initvm')
-                        break
-                    except ValueError:
-                        logging.exception('No package "%s"', pkg_id)
-                        retry = 3
-                    except FetchError:
-                        logging.exception('Package "%s-%s" could not be downloaded',
-                                          pkg.name, pkgver.version)
-                        retry += 1
-                    except TypeError:
-                        logging.exception('Package "%s" missing name or version',
-                                          pkg_id)
-                        retry = 3
-                    except CommandError:
-                        logging.exception('Package "%s-%s" could not be added to repo.',
-                                          pkg.name, pkgver.version)
-                        retry += 1
-                    if retry >= 3:
-                        logging.error('Failed to get source Package "%s"',
-                                      pkg_id)
+            srcpkgs = {(pkgver.source_name, pkgver.source_version)
+                       for pkgver in versions.values()}
+
+            def fetch_dscs(keys, progress):
+                return fetch_sources(keys, opt.srcarchive, progress, store)
+
+            results = fetch_retry(fetch_dscs, sorted(srcpkgs), stats)
+
+            dscs = {}
+            for (name, version), dsc in sorted(results.items()):
+                if isinstance(dsc, Exception):
+                    logging.error('Failed to get source Package "%s-%s": %s',
+                                  name, version, dsc)
+                else:
+                    dscs[dsc] = f"{name}-{version}"
+
+            failed = repo.include_init_dsc_many(dscs, 'initvm')
+            for dsc, ce in failed.items():
+                logging.error('Package "%s" could not be added to repo: %s',
+                              dscs[dsc], ce)
+
+        stats.report()
 
         repo.finalize()
 
@@ -46,7 +46,7 @@ def run_command(argv):
         else:
             f = io.open('licence.txt', "w+", encoding='utf-8')
 
-        pkglist = project.get_rpcaptcache().get_installed_pkgs()
+        pkglist = project.get_rpcaptcache().get_installed_pkgs(hashes=False)
         pkgnames = [p.name for p in pkglist]
 
         project.buildenv.rfs.write_licenses(f, pkgnames, opt.xml)
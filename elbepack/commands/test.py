@@ -187,6 +187,12 @@ class ElbeTestResult(unittest.TestResult):
 
         super().addSubTest(test, subtest, err)
 
+    def addSuccess(self, test):
+        """Called when a test has completed successfully"""
+        if getattr(test, "stdout", None) is not None:
+            self.current_case.stdout = test.stdout
+        super().addSuccess(test)
+
     def addSkip(self, test, reason):
         """Called when a test is skipped."""
         self.current_case.add_skipped_info(message=reason)
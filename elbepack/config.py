@@ -17,6 +17,7 @@ class Config(dict):
         self['pbuilder_jobs'] = "auto"
         self['initvm_domain'] = "initvm"
         self['mirrorsed'] = ""
+        self['aptcache_pool'] = 2
 
         if 'ELBE_SOAPPORT' in os.environ:
             self['soapport'] = os.environ['ELBE_SOAPPORT']
@@ -45,4 +46,7 @@ class Config(dict):
         if 'ELBE_MIRROR_SED' in os.environ:
             self['mirrorsed'] = os.environ['ELBE_MIRROR_SED']
 
+        if 'ELBE_APTCACHE_POOL' in os.environ:
+            self['aptcache_pool'] = int(os.environ['ELBE_APTCACHE_POOL'])
+
 cfg = Config()
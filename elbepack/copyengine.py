@@ -0,0 +1,267 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import errno
+import fcntl
+import os
+import stat
+
+from concurrent.futures import ThreadPoolExecutor
+
+# FICLONE from <linux/fs.h>, _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# Errors returned by the kernel, when a fast path is not available
+# between the two files.  We just fall back to the next slower method.
+_FALLBACK_ERRNOS = (errno.EXDEV, errno.EINVAL, errno.ENOSYS,
+                    errno.EOPNOTSUPP)
+
+_CHUNK_SIZE = 64 * 1024 * 1024
+_BLOCK_SIZE = 4096
+
+
+def data_segments(fd, size, pos=0):
+    """Yield (start, end) of all data segments of fd, skipping holes
+
+    Only the range from pos to size is searched.
+    """
+    while pos < size:
+        try:
+            start = os.lseek(fd, pos, os.SEEK_DATA)
+        except OSError as e:
+            # ENXIO: only a hole is left until the end of the file
+            if e.errno == errno.ENXIO:
+                return
+            # SEEK_DATA not supported; the whole file is data
+            if e.errno in _FALLBACK_ERRNOS:
+                yield pos, size
+                return
+            raise
+        # The next data lies beyond the searched range
+        if start >= size:
+            return
+        end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+        yield start, end
+        pos = end
+
+
+def _copy_range(fsrc, fdst, start, end, shift=0):
+
+    use_cfr = hasattr(os, "copy_file_range")
+
+    while start < end:
+        count = min(end - start, _CHUNK_SIZE)
+        if use_cfr:
+            try:
+                n = os.copy_file_range(fsrc, fdst, count, start,
+                                       start + shift)
+            except OSError as e:
+                if e.errno not in _FALLBACK_ERRNOS:
+                    raise
+                use_cfr = False
+                continue
+        else:
+            buf = os.pread(fsrc, count, start)
+            n = os.pwrite(fdst, buf, start + shift) if buf else 0
+
+        if n == 0:
+            # File shrunk while copying
+            break
+        start += n
+
+
+def copy_data(fsrc, fdst, size):
+    """Copy size bytes between two file descriptors
+
+    The data is reflinked if possible, otherwise copied without the
+    holes of fsrc.
+    """
+    try:
+        fcntl.ioctl(fdst, FICLONE, fsrc)
+        return
+    except OSError as e:
+        if e.errno not in _FALLBACK_ERRNOS:
+            raise
+
+    for start, end in data_segments(fsrc, size):
+        _copy_range(fsrc, fdst, start, end)
+
+    # Trailing holes are not covered by the data segments
+    os.ftruncate(fdst, size)
+
+
+def splice_file(src, dst, offset):
+    """Write the file src into the existing file dst at offset
+
+    Only the data segments of src are copied, so the holes of src
+    leave the data of dst alone.  A sparse dst, that is zero in this
+    range, becomes byte-identical to writing all of src, without
+    allocating the holes.
+    """
+    fsrc = os.open(src, os.O_RDONLY)
+    try:
+        fdst = os.open(dst, os.O_WRONLY)
+        try:
+            for start, end in data_segments(fsrc, os.fstat(fsrc).st_size):
+                _copy_range(fsrc, fdst, start, end, offset)
+        finally:
+            os.close(fdst)
+    finally:
+        os.close(fsrc)
+
+
+def write_file_at(src, dst, offset):
+    """Write the file src into dst at offset like 'dd conv=notrunc'
+
+    Zero blocks of src are only written, if dst holds other data
+    there.  So holes of dst stay holes, but the result is the same
+    as writing all of src.
+    """
+    fsrc = os.open(src, os.O_RDONLY)
+    try:
+        fdst = os.open(dst, os.O_RDWR)
+        try:
+            pos = 0
+            while True:
+                buf = os.pread(fsrc, _BLOCK_SIZE, pos)
+                if not buf:
+                    break
+                if buf.count(0) != len(buf) or \
+                   os.pread(fdst, len(buf), offset + pos) != buf:
+                    os.pwrite(fdst, buf, offset + pos)
+                pos += len(buf)
+        finally:
+            os.close(fdst)
+    finally:
+        os.close(fsrc)
+
+
+def copy_xattrs(src, dst):
+    try:
+        names = os.listxattr(src, follow_symlinks=False)
+    except OSError as e:
+        if e.errno in (errno.ENOTSUP, errno.ENODATA):
+            return
+        raise
+
+    for name in names:
+        try:
+            value = os.getxattr(src, name, follow_symlinks=False)
+            os.setxattr(dst, name, value, follow_symlinks=False)
+        except OSError as e:
+            if e.errno not in (errno.EPERM, errno.ENOTSUP,
+                               errno.ENODATA, errno.EACCES):
+                raise
+
+
+def copy_metadata(src, dst, st):
+    """Copy ownership, permissions, xattrs and times from src to dst
+
+    The order is important.  chown() clears the setuid/setgid bits
+    and security.capability, so these have to be restored after it.
+    """
+    follow = not stat.S_ISLNK(st.st_mode)
+
+    try:
+        os.chown(dst, st.st_uid, st.st_gid, follow_symlinks=follow)
+    except PermissionError:
+        pass
+
+    if follow:
+        os.chmod(dst, stat.S_IMODE(st.st_mode))
+
+    copy_xattrs(src, dst)
+
+    if follow or os.utime in os.supports_follow_symlinks:
+        os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns),
+                 follow_symlinks=follow)
+
+
+def copy_file(src, dst, st=None):
+    """Copy a non-directory file like 'cp -a --reflink=auto' would
+
+    Regular files are reflinked if possible.  Otherwise, the data
+    segments are copied with copy_file_range() and holes are kept.
+    Symlinks, device nodes and fifos are recreated.  An existing dst
+    is replaced, unless it is a directory.
+    """
+    if st is None:
+        st = os.lstat(src)
+
+    mode = st.st_mode
+
+    if os.path.lexists(dst):
+        dst_mode = os.lstat(dst).st_mode
+        if stat.S_ISDIR(dst_mode):
+            raise IsADirectoryError(errno.EISDIR,
+                                    "Can not replace a directory", dst)
+        if not stat.S_ISREG(dst_mode):
+            os.unlink(dst)
+
+    if stat.S_ISREG(mode):
+        fsrc = os.open(src, os.O_RDONLY | os.O_NOFOLLOW)
+        try:
+            fdst = os.open(dst,
+                           os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW,
+                           0o600)
+            try:
+                copy_data(fsrc, fdst, st.st_size)
+            finally:
+                os.close(fdst)
+        finally:
+            os.close(fsrc)
+    elif stat.S_ISLNK(mode):
+        if os.path.lexists(dst):
+            os.unlink(dst)
+        os.symlink(os.readlink(src), dst)
+    elif stat.S_ISCHR(mode) or stat.S_ISBLK(mode):
+        os.mknod(dst, mode, st.st_rdev)
+    elif stat.S_ISFIFO(mode):
+        os.mkfifo(dst, stat.S_IMODE(mode))
+    elif stat.S_ISSOCK(mode):
+        # Sockets can not be copied, cp -a skips them too
+        return
+    else:
+        raise OSError(errno.EINVAL, "Unsupported file type", src)
+
+    copy_metadata(src, dst, st)
+
+
+class CopyEngine:
+    """Copy files in a pool of threads
+
+    All syscalls involved in copying release the GIL, so a
+    thread pool is enough to keep multiple copies in flight.
+
+    Errors are collected instead of being logged from the worker
+    threads, since elbe's log handlers only accept records from
+    the thread which set them up.  Use wait() to get them.
+    """
+
+    def __init__(self, workers=None):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _typ, _value, _traceback):
+        self.pool.shutdown(wait=True)
+
+    def submit(self, src, dst, st=None):
+        fut = self.pool.submit(copy_file, src, dst, st)
+        self.futures.append((src, dst, fut))
+
+    def wait(self):
+        """Wait for all submitted copies
+
+        Returns a list of (src, dst, exception) of failed copies.
+        """
+        errors = []
+        for src, dst, fut in self.futures:
+            exc = fut.exception()
+            if exc is not None:
+                errors.append((src, dst, exc))
+        self.futures = []
+        return errors
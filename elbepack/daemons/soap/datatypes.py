@@ -2,9 +2,11 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # SPDX-FileCopyrightText: 2015-2017 Linutronix GmbH
 
-from spyne.model.complex import ComplexModel
+from spyne.model.complex import ComplexModel, Array
 from spyne.model.primitive import Unicode, DateTime, Integer
 
+from elbepack.aptpkgutils import statestring
+
 
 class SoapProject (ComplexModel):
     __namespace__ = 'soap'
@@ -33,3 +35,41 @@ class SoapCmdReply (ComplexModel):
         # pylint: disable=super-init-not-called
         self.ret = ret
         self.out = out
+
+
+class SoapInstallPlan (ComplexModel):
+    __namespace__ = 'soap'
+
+    install = Array(Unicode)
+    upgrade = Array(Unicode)
+    remove = Array(Unicode)
+    missing = Array(Unicode)
+    conflicts = Array(Unicode)
+    download_size = Integer()
+    install_size = Integer()
+
+    def __init__(self, plan):
+        # pylint: disable=super-init-not-called
+        self.install = plan["install"]
+        self.upgrade = plan["upgrade"]
+        self.remove = plan["remove"]
+        self.missing = plan["missing"]
+        self.conflicts = plan["conflicts"]
+        self.download_size = plan["download_size"]
+        self.install_size = plan["install_size"]
+
+
+class SoapPackage (ComplexModel):
+    __namespace__ = 'soap'
+
+    name = Unicode()
+    installed_version = Unicode()
+    candidate_version = Unicode()
+    state = Unicode()
+
+    def __init__(self, pkg):
+        # pylint: disable=super-init-not-called
+        self.name = pkg.name
+        self.installed_version = pkg.installed_version
+        self.candidate_version = pkg.candidate_version
+        self.state = statestring[pkg.state]
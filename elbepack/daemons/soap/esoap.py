@@ -15,13 +15,15 @@ from spyne.decorator import rpc
 from spyne.model.primitive import String, Boolean, Integer
 from spyne.model.complex import Array
 
+from elbepack.copyengine import data_segments
 from elbepack.shellhelper import system, command_out
 from elbepack.version import elbe_version, is_devel
 from elbepack.elbexml import ValidationMode
 from elbepack.filesystem import hostfs
 
 from .faults import soap_faults
-from .datatypes import SoapProject, SoapFile, SoapCmdReply
+from .datatypes import (SoapProject, SoapFile, SoapCmdReply, SoapInstallPlan,
+                        SoapPackage)
 from .authentication import authenticated_admin, authenticated_uid
 
 
@@ -178,6 +180,39 @@ class ESoap (ServiceBase):
             except BaseException:
                 return "EndOfFile"
 
+    @rpc(String, String, Integer, _returns=String)
+    @authenticated_uid
+    @soap_faults
+    def get_sparse_file(self, uid, builddir, filename, part):
+        """Like get_file(), but holes are not transferred
+
+        A part, that is a hole in the file, is returned as
+        "Hole <size>" instead of its zeros.
+        """
+        self.app.pm.open_project(uid, builddir)
+
+        size = 1024 * 1024 * 5
+        pos = size * part
+        file_name = builddir + "/" + filename
+
+        try:
+            fd = os.open(file_name, os.O_RDONLY)
+        except OSError:
+            return "FileNotFound"
+
+        try:
+            file_size = os.fstat(fd).st_size
+            if pos >= file_size:
+                return "EndOfFile"
+
+            end = min(pos + size, file_size)
+            if next(data_segments(fd, end, pos), None) is None:
+                return f"Hole {end - pos}"
+
+            return binascii.b2a_base64(os.pread(fd, end - pos, pos))
+        finally:
+            os.close(fd)
+
     @rpc(String)
     @authenticated_uid
     @soap_faults
@@ -199,6 +234,26 @@ class ESoap (ServiceBase):
         self.app.pm.open_project(uid, builddir)
         self.app.pm.build_sdk(uid)
 
+    @rpc(String, String(max_occurs='unbounded'), _returns=SoapInstallPlan)
+    @authenticated_uid
+    @soap_faults
+    def plan_install(self, uid, builddir, pkgs):
+        self.app.pm.open_project(uid, builddir)
+        return SoapInstallPlan(self.app.pm.apt_plan_install(uid, pkgs))
+
+    @rpc(String, String, String, Integer, _returns=Array(SoapPackage))
+    @authenticated_uid
+    @soap_faults
+    def search_packages(self, uid, builddir, term, mode, limit):
+
+        # pylint: disable=too-many-arguments
+
+        self.app.pm.open_project(uid, builddir)
+        return [SoapPackage(p)
+                for p in self.app.pm.apt_get_pkgs(uid, term,
+                                                  mode or "substring",
+                                                  limit or None)]
+
     @rpc(String, Boolean, Boolean)
     @authenticated_uid
     @soap_faults
@@ -760,6 +760,9 @@ class ElbeDB:
                                       description)
 
     def update_project_files(self, ep):
+
+        # pylint: disable=too-many-branches
+
         with session_scope(self.session) as s:
             try:
                 p = s.query(Project).\
@@ -780,9 +783,14 @@ class ElbeDB:
 
                 images = set(ep.targetfs.images or [])
                 for img in images:
-                    _update_project_file(
-                        s, p.builddir, img,
-                        "application/octet-stream", "Image")
+                    if img.endswith(".bmap"):
+                        _update_project_file(
+                            s, p.builddir, img,
+                            "application/xml", "Block map")
+                    else:
+                        _update_project_file(
+                            s, p.builddir, img,
+                            "application/octet-stream", "Image")
 
             # Add other generated files
             _update_project_file(s, p.builddir, "source.xml",
@@ -0,0 +1,171 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import json
+import logging
+import os
+
+
+def usrmerge_path(path):
+    """Strip the /usr prefix, so that /bin/sh and /usr/bin/sh compare equal
+
+    >>> usrmerge_path("/usr/bin/sh")
+    '/bin/sh'
+    >>> usrmerge_path("/usr")
+    '/'
+    >>> usrmerge_path("/usrfoo")
+    '/usrfoo'
+    """
+    if path == "/usr":
+        return "/"
+    if path.startswith("/usr/"):
+        return path[4:]
+    return path
+
+
+class DpkgFileIndex:
+    """File ownership index of the dpkg database of an RFS
+
+    The .list and .conffiles files in var/lib/dpkg/info are parsed in
+    a single pass and give a path => package and a package => paths
+    mapping.  The parsed content is stored next to the RFS, and only
+    the packages whose dpkg files have changed are parsed again.
+    """
+
+    version = 1
+    infodir = "var/lib/dpkg/info"
+
+    def __init__(self, rfs, arch, cachefile=None):
+        self.rfs = rfs
+        self.arch = arch
+
+        if cachefile is None:
+            cachefile = f"{rfs.path.rstrip(os.sep)}.fileindex.json"
+        self.cachefile = cachefile
+
+        # dpkg info name (e.g. 'libc6:amd64') => [stamp, files, conffiles]
+        self.pkgs = {}
+        # usrmerge_path(path) => package name
+        self.owners = {}
+
+        self._load()
+        self.refresh()
+
+    def _load(self):
+        try:
+            with open(self.cachefile, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if data.get("version") != self.version or data.get("arch") != self.arch:
+            return
+
+        self.pkgs = data["pkgs"]
+
+    def _save(self):
+        tmp = f"{self.cachefile}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"version": self.version,
+                           "arch": self.arch,
+                           "pkgs": self.pkgs}, f)
+            os.replace(tmp, self.cachefile)
+        except OSError as e:
+            logging.warning("Can not write dpkg file index %s: %s",
+                            self.cachefile, e)
+
+    @staticmethod
+    def _read_lines(path):
+        try:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                return f.read().splitlines()
+        except OSError:
+            return []
+
+    def refresh(self):
+        """Reparse the dpkg files which changed since the last refresh
+
+        Returns the number of reparsed packages.
+        """
+        stamps = {}
+        infodir = self.rfs.fname(self.infodir)
+
+        try:
+            entries = list(os.scandir(infodir))
+        except OSError:
+            entries = []
+
+        for e in entries:
+            name, ext = os.path.splitext(e.name)
+            if ext not in (".list", ".conffiles"):
+                continue
+            st = e.stat(follow_symlinks=False)
+            stamp = stamps.setdefault(name, [0, 0, 0, 0])
+            if ext == ".list":
+                stamp[0:2] = [st.st_mtime_ns, st.st_size]
+            else:
+                stamp[2:4] = [st.st_mtime_ns, st.st_size]
+
+        changed = 0
+
+        for name in list(self.pkgs):
+            if name not in stamps:
+                del self.pkgs[name]
+                changed += 1
+
+        for name, stamp in stamps.items():
+            old = self.pkgs.get(name)
+            if old is not None and old[0] == stamp:
+                continue
+            files = self._read_lines(os.path.join(infodir, f"{name}.list"))
+            conffiles = self._read_lines(
+                os.path.join(infodir, f"{name}.conffiles"))
+            self.pkgs[name] = [stamp, files, conffiles]
+            changed += 1
+
+        if changed or not self.owners:
+            self._build_owners()
+
+        if changed:
+            self._save()
+
+        return changed
+
+    def _pkgname(self, name):
+        suffix = f":{self.arch}"
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+        return name
+
+    def _build_owners(self):
+        owners = {}
+        for name in sorted(self.pkgs):
+            pkgname = self._pkgname(name)
+            for f in self.pkgs[name][1]:
+                owners[usrmerge_path(f)] = pkgname
+        self.owners = owners
+
+    def owner(self, path):
+        """Return the package owning path, or None"""
+        return self.owners.get(usrmerge_path(path))
+
+    def files(self, pkgname):
+        """Return the files and conffiles of pkgname
+
+        Both the plain and the architecture qualified package are
+        looked up, like dpkg stores Multi-Arch: same packages.
+        """
+        ret = []
+        for name in (pkgname, f"{pkgname}:{self.arch}"):
+            try:
+                _, files, conffiles = self.pkgs[name]
+            except KeyError:
+                continue
+            ret += files
+            ret += conffiles
+        return ret
+
+    def packages(self):
+        return {self._pkgname(name) for name in self.pkgs}
@@ -77,6 +77,7 @@ def check_full_pkgs(pkgs, fullpkgs, cache):
 
     # pylint: disable=too-many-statements
     # pylint: disable=too-many-branches
+    # pylint: disable=too-many-locals
 
 
     validation.info("ELBE Package validation")
@@ -89,21 +90,28 @@ def check_full_pkgs(pkgs, fullpkgs, cache):
     errors = 0
 
     if pkgs:
+        # Query the cache for all packages at once, each call is a
+        # round-trip to the cache process
+        names = [p.et.text.split(":")[0] for p in pkgs]
+        has_pkgs = cache.has_pkgs(names)
+        installed = cache.is_installed_many(names)
+        pkg_index = cache.get_pkgs_by_name(names)
+
         for p in pkgs:
             name = p.et.text
             nomulti_name = name.split(":")[0]
-            if not cache.has_pkg(nomulti_name):
+            if not has_pkgs[nomulti_name]:
                 validation.error("Package '%s' does not exist", nomulti_name)
                 errors += 1
                 continue
 
-            if not cache.is_installed(nomulti_name):
+            if not installed[nomulti_name]:
                 validation.error("Package '%s' is not installed", nomulti_name)
                 errors += 1
                 continue
 
             ver = p.et.get('version')
-            pkg = cache.get_pkg(nomulti_name)
+            pkg = pkg_index[nomulti_name]
             if ver and not fnmatchcase(pkg.installed_version, ver):
                 validation.error("Package '%s' version '%s' does not match installed version %s",
                                  name, ver, pkg.installed_version)
@@ -121,6 +129,11 @@ def check_full_pkgs(pkgs, fullpkgs, cache):
     validation.info("")
     errors = 0
 
+    names = [p.et.text for p in fullpkgs]
+    has_pkgs = cache.has_pkgs(names)
+    installed = cache.is_installed_many(names)
+    pkg_index = cache.get_pkgs_by_name(names)
+
     pindex = {}
     for p in fullpkgs:
         name = p.et.text
@@ -130,17 +143,17 @@ def check_full_pkgs(pkgs, fullpkgs, cache):
 
         pindex[name] = p
 
-        if not cache.has_pkg(name):
+        if not has_pkgs[name]:
             validation.error("Package '%s' does not exist", name)
             errors += 1
             continue
 
-        if not cache.is_installed(name):
+        if not installed[name]:
             validation.error("Package '%s' is not installed", name)
             errors += 1
             continue
 
-        pkg = cache.get_pkg(name)
+        pkg = pkg_index[name]
 
         if not fnmatchcase(pkg.installed_version, ver):
             validation.error("Package '%s' version %s does not match installed version %s",
@@ -163,12 +176,12 @@ def check_full_pkgs(pkgs, fullpkgs, cache):
         if not md5 and not sha256:
             validation.error("Package '%s' has no hash setup in package list.",
                              name)
-            error += 1
+            errors += 1
 
-    for cp in cache.get_installed_pkgs():
-        if cp.name not in pindex:
+    for name in cache.snapshot_installed():
+        if name not in pindex:
             validation.error("Additional package %s installed, that was not requested",
-                             cp.name)
+                             name)
             errors += 1
 
     if errors == 0:
@@ -214,11 +227,12 @@ def elbe_report(xml, buildenv, cache, targetfs):
     report.info("-----------------------")
     report.info("")
 
-    instpkgs = cache.get_installed_pkgs()
+    instpkgs = cache.get_installed_pkgs(hashes=False)
     for p in instpkgs:
         report.info("|%s|%s|%s", p.name, p.installed_version, p.origin)
 
-    index = cache.get_fileindex(removeprefix='/usr')
+    arch = xml.text("project/buildimage/arch", key="arch")
+    index = rfs.dpkg_fileindex(arch)
     mt_index = targetfs.mtime_snap()
 
     if xml.has("archive") and not xml.text("archive") is None:
@@ -243,10 +257,11 @@ def elbe_report(xml, buildenv, cache, targetfs):
 
     tgt_pkg_list = set()
 
-    for fpath, _ in targetfs.walk_files():
-        unprefixed = fpath[len('/usr'):] if fpath.startswith('/usr') else fpath
-        if unprefixed in index:
-            pkg = index[unprefixed]
+    # The last snapshot was taken from the final target, it
+    # contains all files in the order of walk_files()
+    for fpath in mt_index_post_fine:
+        pkg = index.owner(fpath)
+        if pkg is not None:
             tgt_pkg_list.add(pkg)
         else:
             pkg = "postinst generated"
@@ -275,10 +290,8 @@ def elbe_report(xml, buildenv, cache, targetfs):
 
     for fpath in list(mt_index.keys()):
         if fpath not in mt_index_post_fine:
-            unprefixed = fpath[len('/usr'):] if fpath.startswith('/usr') else fpath
-            if unprefixed in index:
-                pkg = index[unprefixed]
-            else:
+            pkg = index.owner(fpath)
+            if pkg is None:
                 pkg = "postinst generated"
             report.info("|+%s+|%s", fpath, pkg)
 
@@ -296,6 +309,10 @@ def elbe_report(xml, buildenv, cache, targetfs):
         targetfs.remove('etc/elbe_pkglist')
         f = targetfs.open('etc/elbe_pkglist', 'w')
     for pkg in tgt_pkg_list:
+        # dpkg might still list files of packages which are not
+        # installed anymore, e.g. in the half-installed state
+        if pkg not in pkgindex:
+            continue
         p = pkgindex[pkg]
         report.info("|%s|%s|%s|%s",
                     p.name,
@@ -11,11 +11,14 @@ import stat
 import logging
 
 from elbepack.filesystem import Filesystem
+from elbepack.bmap import write_bmap
+from elbepack.copyengine import CopyEngine
+from elbepack.dpkgindex import DpkgFileIndex
 from elbepack.version import elbe_version
 from elbepack.hdimg import do_hdimg
 from elbepack.fstab import fstabentry
 from elbepack.licencexml import copyright_xml
-from elbepack.packers import default_packer
+from elbepack.packers import default_packer, pack_files
 from elbepack.shellhelper import (system,
                                   CommandError,
                                   do,
@@ -23,12 +26,46 @@ from elbepack.shellhelper import (system,
                                   get_command_out)
 
 
-def copy_filelist(src, file_lst, dst):
+class _CopyState:
+
+    def __init__(self, src, dst, engine):
+        self.src = src
+        self.dst = dst
+        self.engine = engine
+        self.done = set()
+        self.dirs = []
+        self._realdirs = {}
+
+    def realdir(self, fs, dirname):
+        """Filesystem.realpath() of a directory, memoised
+
+        Only directories which exist are cached, because the
+        destination is still growing and a missing component
+        might become a symlink later on.
+        """
+        key = (fs.path, dirname)
+        try:
+            return self._realdirs[key]
+        except KeyError:
+            pass
+        real = fs.realpath(dirname)
+        if os.path.isdir(real):
+            self._realdirs[key] = real
+        return real
+
+    def realpath(self, fs, path):
+        dirname, basename = os.path.split(path)
+        return os.path.join(self.realdir(fs, dirname), basename)
+
+
+def _copy_filelist(state, file_lst):
 
     # pylint: disable=too-many-branches
 
+    src = state.src
+    dst = state.dst
+
     files  = set()
-    copied = set()
 
     # Make sure to copy parent directories
     #
@@ -48,51 +85,80 @@ def copy_filelist(src, file_lst, dst):
     while files:
 
         f = files.pop()
-        copied.add(f)
 
-        if src.islink(f):
+        # Already copied, or queued for copy, by a recursive call
+        if f in state.done:
+            continue
+        state.done.add(f)
+
+        src_f = state.realpath(src, f)
+        try:
+            st = os.lstat(src_f)
+        except OSError as E:
+            logging.warning("Error while copying from %s to %s of file %s - %s",
+                            src.path, dst.path, f, E)
+            continue
 
-            tgt = src.readlink(f)
+        if stat.S_ISLNK(st.st_mode):
 
-            if not src.lexists(tgt):
-                dst.symlink(tgt, f, allow_exists=True)
-                continue
+            tgt = os.readlink(src_f)
+
+            # Resolve relative links from the directory containing
+            # the link, not from the root of the RFS
+            if os.path.isabs(tgt):
+                tgt_path = tgt
+            else:
+                parent = state.realdir(src, os.path.dirname(f))
+                parent = parent[len(src.path):] or os.sep
+                tgt_path = os.path.normpath(os.path.join(parent, tgt))
 
             # If the target is not yet in the destination RFS, we need
             # to defer the copy of the symlink after the target is
-            # resolved.  Thus, we recusively call copy_filelist
+            # resolved.  Thus, we recusively call _copy_filelist
             #
-            # Not that this will result in an infinite loop for
-            # circular symlinks
-            if not dst.lexists(tgt):
-                if not os.path.isabs(tgt):
-                    lst = [os.path.join(os.path.dirname(f), tgt)]
-                else:
-                    lst = [tgt]
-                copy_filelist(src, lst, dst)
-
-            dst.symlink(tgt, f, allow_exists=True)
-
-        elif src.isdir(f):
-            if not dst.isdir(f):
-                dst.mkdir(f)
-            st = src.stat(f)
-            dst.chown(f, st.st_uid, st.st_gid)
+            # Files which are already queued in the copy engine count
+            # as existing.  Circular symlinks are terminated by the
+            # set of already handled paths.
+            if (src.lexists(tgt_path) and
+                    tgt_path not in state.done and
+                    not dst.lexists(tgt_path)):
+                _copy_filelist(state, [tgt_path])
 
-        else:
             try:
-                system(
-                    'cp -a --reflink=auto '
-                    f'"{src.realpath(f)}" "{dst.realpath(f)}"')
-            except CommandError as E:
-                logging.warning("Error while copying from %s to %s of file %s - %s",
-                                src.path, dst.path, f, E)
+                os.symlink(tgt, state.realpath(dst, f))
+            except FileExistsError:
+                pass
+
+        elif stat.S_ISDIR(st.st_mode):
+            dst_f = state.realpath(dst, f)
+            if not os.path.isdir(dst_f):
+                os.makedirs(dst_f)
+            os.chown(dst_f, st.st_uid, st.st_gid)
+            state.dirs.append((src_f, dst_f))
+
+        else:
+            state.engine.submit(src_f, state.realpath(dst, f), st)
+
+
+def copy_filelist(src, file_lst, dst, workers=None):
+    """Copy the files in file_lst, and their parents, from src to dst
+
+    Directories and symlinks are created in order, while the actual
+    file copies are run in parallel by a CopyEngine.
+    """
+
+    with CopyEngine(workers) as engine:
+        state = _CopyState(src, dst, engine)
+        _copy_filelist(state, file_lst)
+
+        for src_f, dst_f, E in engine.wait():
+            logging.warning("Error while copying from %s to %s of file %s - %s",
+                            src.path, dst.path, src_f[len(src.path):], E)
 
     # update utime which will change after a file has been copied into
     # the directory
-    for f in copied:
-        if src.isdir(f) and not src.islink(f):
-            shutil.copystat(src.fname(f), dst.fname(f))
+    for src_f, dst_f in state.dirs:
+        shutil.copystat(src_f, dst_f)
 
 
 def extract_target(src, xml, dst, cache):
@@ -107,22 +173,13 @@ def extract_target(src, xml, dst, cache):
         arch = xml.text("project/buildimage/arch", key="arch")
 
         if xml.tgt.has("diet"):
-            withdeps = []
-            for p in pkglist:
-                deps = cache.get_dependencies(p)
-                withdeps += [d.name for d in deps]
-                withdeps += [p]
-
-            pkglist = list(set(withdeps))
+            deps = cache.get_dependency_names(pkglist)
+            pkglist = list(set(pkglist) | set(deps))
 
+        fileindex = src.dpkg_fileindex(arch)
         file_list = []
         for line in pkglist:
-            file_list += src.cat_file(f"var/lib/dpkg/info/{line}.list")
-            file_list += src.cat_file(f"var/lib/dpkg/info/{line}.conffiles")
-
-            file_list += src.cat_file(f"var/lib/dpkg/info/{line}:{arch}.list")
-            file_list += src.cat_file(
-                f"var/lib/dpkg/info/{line}:{arch}.conffiles")
+            file_list += fileindex.files(line)
 
         file_list = sorted(set(file_list),
                            key = lambda k: k[4:] if k.startswith('/usr') else k)
@@ -171,6 +228,15 @@ def extract_target(src, xml, dst, cache):
 class ElbeFilesystem(Filesystem):
     def __init__(self, path, clean=False):
         Filesystem.__init__(self, path, clean)
+        self.fileindex = None
+
+    def dpkg_fileindex(self, arch):
+        """Return the DpkgFileIndex of this RFS, refreshed if needed"""
+        if self.fileindex is None or self.fileindex.arch != arch:
+            self.fileindex = DpkgFileIndex(self, arch)
+        else:
+            self.fileindex.refresh()
+        return self.fileindex
 
     def dump_elbeversion(self, xml):
         f = self.open("etc/elbe_version", "w+")
@@ -484,11 +550,26 @@ class TargetFs(ChRootFilesystem):
             os.chdir(oldwd)
 
     def pack_images(self, builddir):
-        for img, packer in self.image_packers.items():
+
+        def write_image_bmap(img):
+            # The block map describes the unpacked image
+            try:
+                write_bmap(os.path.join(builddir, img))
+                bmaps.append(img + ".bmap")
+            except OSError as e:
+                logging.error("Can not write the block map of %s: %s",
+                              img, e)
+
+        bmaps = []
+        jobs = list(self.image_packers.items())
+        packed = pack_files(builddir, jobs, prepare=write_image_bmap)
+
+        for (img, _), p in zip(jobs, packed):
             self.images.remove(img)
-            packed = packer.pack_file(builddir, img)
-            if packed:
-                self.images.append(packed)
+            if p:
+                self.images.append(p)
+
+        self.images.extend(sorted(bmaps))
 
 
 class BuildImgFs(ChRootFilesystem):
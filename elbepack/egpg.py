@@ -187,7 +187,7 @@ def unlock_key(fingerprint):
            f"--preset -P requiredToAvoidUserInput {keygrip}",
            env_add={"GNUPGHOME": "/var/cache/elbe/gnupg"})
 
-def sign(infile, outfile, fingerprint):
+def sign(infile, outfile, fingerprint, mode=sig.mode.NORMAL, armor=False):
 
     ctx = core.Context()
 
@@ -209,7 +209,7 @@ def sign(infile, outfile, fingerprint):
     else:
         unlock_key(key.fpr)
         ctx.signers_add(key)
-        ctx.set_armor(False)
+        ctx.set_armor(armor)
 
     try:
         indata = core.Data(file=infile)
@@ -218,7 +218,7 @@ def sign(infile, outfile, fingerprint):
     else:
         outdata = core.Data()
         try:
-            ctx.op_sign(indata, outdata, sig.mode.NORMAL)
+            ctx.op_sign(indata, outdata, mode)
         except InvalidSigners as E:
             print("Error: Invalid signer - %s", E)
         except GPGMEError as E:
@@ -226,13 +226,21 @@ def sign(infile, outfile, fingerprint):
         else:
             outdata.seek(0, os.SEEK_SET)
             signature = outdata.read()
-            with open(outfile, 'w') as fd:
+            with open(outfile, 'wb') as fd:
                 fd.write(signature)
 
 def sign_file(fname, fingerprint):
     outfilename = fname + '.gpg'
     sign(fname, outfilename, fingerprint)
 
+def sign_release(fname, fingerprint):
+    """Write Release.gpg and InRelease next to the Release file fname"""
+    dirname = os.path.dirname(fname)
+    sign(fname, os.path.join(dirname, 'Release.gpg'), fingerprint,
+         sig.mode.DETACH, armor=True)
+    sign(fname, os.path.join(dirname, 'InRelease'), fingerprint,
+         sig.mode.CLEAR, armor=True)
+
 def get_fingerprints():
     ctx = core.Context()
     ctx.set_engine_info(PROTOCOL_OpenPGP,
@@ -279,7 +279,7 @@ class ElbeProject:
                 raise AptCacheCommitError(str(e))
 
             self.gen_licenses("sysroot-target", self.sysrootenv,
-                              [p.name for p in cache.get_installed_pkgs()])
+                              [p.name for p in cache.get_installed_pkgs(hashes=False)])
 
         try:
             self.sysrootenv.rfs.dump_elbeversion(self.xml)
@@ -345,7 +345,7 @@ class ElbeProject:
                 raise AptCacheCommitError(str(e))
 
             self.gen_licenses("sysroot-host", self.host_sysrootenv,
-                              [p.name for p in cache.get_installed_pkgs()])
+                              [p.name for p in cache.get_installed_pkgs(hashes=False)])
 
         # This is just a sysroot, some directories
         # need to be removed.
@@ -640,7 +640,7 @@ class ElbeProject:
 
         # chroot' licenses
         self.gen_licenses("chroot", self.buildenv,
-                          [p.name for p in cache.get_installed_pkgs()])
+                          [p.name for p in cache.get_installed_pkgs(hashes=False)])
 
         self.gen_licenses("target", self.buildenv, tgt_pkgs)
 
@@ -648,19 +648,21 @@ class ElbeProject:
         grub_arch = "ia32" if self.arch == "i386" else self.arch
         grub_fw_type = []
         grub_version = 0
-        if self.get_rpcaptcache().is_installed('grub-pc'):
+        installed = self.get_rpcaptcache().is_installed_many([
+            'grub-pc', f'grub-efi-{grub_arch}-bin', 'shim-signed',
+            f'grub-efi-{grub_arch}-signed', 'grub-legacy'])
+        if installed['grub-pc']:
             grub_version = 202
             grub_fw_type.append("bios")
-        if self.get_rpcaptcache().is_installed(f'grub-efi-{grub_arch}-bin'):
+        if installed[f'grub-efi-{grub_arch}-bin']:
             grub_version = 202
             grub_tgt = "x86_64" if self.arch == "amd64" else self.arch
             grub_fw_type.extend(["efi", grub_tgt + "-efi"])
-        if (self.get_rpcaptcache().is_installed('shim-signed') and
-                self.get_rpcaptcache().is_installed(
-                    f'grub-efi-{grub_arch}-signed')):
+        if (installed['shim-signed'] and
+                installed[f'grub-efi-{grub_arch}-signed']):
             grub_version = 202
             grub_fw_type.append("shimfix")
-        if self.get_rpcaptcache().is_installed('grub-legacy'):
+        if installed['grub-legacy']:
             logging.warning("package grub-legacy is installed, "
                             "this is obsolete.")
             grub_version = 97
@@ -1053,16 +1055,23 @@ class ElbeProject:
             if buildenv:
                 pkgs = pkgs + target.xml.get_buildenv_packages()
 
-            # Now install requested packages
-            for p in pkgs:
-                try:
-                    self.get_rpcaptcache(env=target).mark_install(p, None)
-                except KeyError:
-                    logging.exception("No Package %s", p)
-                except SystemError:
-                    logging.exception("Unable to correct problems "
-                                      "in package %s",
-                                      p)
+            # Now mark all requested packages and resolve them at once,
+            # so conflicts show up before anything is downloaded
+            plan = self.get_rpcaptcache(env=target).plan_install(
+                pkgs, dry_run=False)
+            for p in plan["missing"]:
+                logging.error("No Package %s", p)
+            if plan["conflicts"]:
+                for p in plan["conflicts"]:
+                    logging.error("Unable to correct problems in package %s",
+                                  p)
+                raise AptCacheCommitError(
+                    "Unresolvable conflicts in "
+                    f"{', '.join(plan['conflicts'])}")
+            logging.info("Installing %d, upgrading %d and removing %d "
+                         "packages, %d bytes to download",
+                         len(plan["install"]), len(plan["upgrade"]),
+                         len(plan["remove"]), plan["download_size"])
 
             # temporary disabled because of
             # https://bugs.debian.org/cgi-bin/bugreport.cgi?bug=776057
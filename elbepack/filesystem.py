@@ -11,6 +11,8 @@ from tempfile import mkdtemp
 from string import digits
 import gzip
 
+from concurrent.futures import ThreadPoolExecutor
+
 from elbepack.shellhelper import do
 
 def size_to_int(size):
@@ -47,6 +49,54 @@ def size_to_int(size):
 
     return int(s) * unit
 
+_STAT_FIELDS = {"mode": "st_mode",
+                "size": "st_size",
+                "mtime_ns": "st_mtime_ns",
+                "inode": "st_ino"}
+
+def _scan_dir(dirpath, striplen, exclude_dirs, fields):
+    """Read one directory for Filesystem.scan_files()
+
+    Returns the records of the files and the list of subdirectories
+    to descend into.  Like os.walk(), symlinks to directories are
+    neither followed nor reported and errors are ignored.
+    """
+    files = []
+    subdirs = []
+
+    subpath = dirpath[striplen:]
+    if not subpath:
+        subpath = "/"
+
+    try:
+        it = os.scandir(dirpath)
+    except OSError:
+        return files, subdirs
+
+    with it:
+        for e in it:
+            try:
+                is_dir = e.is_dir()
+            except OSError:
+                is_dir = False
+
+            if is_dir:
+                if not e.is_symlink() and \
+                   os.path.join(subpath, e.name) not in exclude_dirs:
+                    subdirs.append(e.path)
+                continue
+
+            rec = ("/" + os.path.join(subpath, e.name), e.path)
+            if fields:
+                if fields == ("inode",):
+                    rec += (e.inode(),)
+                else:
+                    st = e.stat(follow_symlinks=False)
+                    rec += tuple(getattr(st, _STAT_FIELDS[f]) for f in fields)
+            files.append(rec)
+
+    return files, subdirs
+
 class Filesystem:
 
     # pylint: disable=too-many-public-methods
@@ -428,59 +478,86 @@ class Filesystem:
             fp = self.open(fname, "w")
             fp.close()
 
-    def walk_files(self, directory='', exclude_dirs=None):
-        # pylint: disable=too-many-locals
+    def scan_files(self, directory='', exclude_dirs=None, fields=(),
+                   workers=None):
+        """Yield a record (path, realpath, *fields) for every file
+
+        Directories are read with os.scandir() from a pool of worker
+        threads.  fields is a subset of ("mode", "size", "mtime_ns",
+        "inode") and only when it is not empty, a lstat() is done on
+        the files.  The order of the records is the same as the one of
+        os.walk().
+
+        --
+        >>> this.mkdir_p("scan_files/a")
+        >>> this.write_file("scan_files/f", 0o644, "scan")
+        >>> this.write_file("scan_files/a/g", 0o600, "")
+        >>> sorted((p, size) for p, _, size
+        ...        in this.scan_files("scan_files", fields=("size",)))
+        [('//a/g', 0), ('//f', 4)]
+
+        >>> list(this.scan_files("scan_files", exclude_dirs=["/a"]))
+        ... # doctest: +ELLIPSIS
+        [('//f', '.../scan_files/f')]
+        """
         if not exclude_dirs:
             exclude_dirs = []
+        exclude_dirs = set(exclude_dirs)
 
         dirname = self.fname(directory)
         if dirname == "/":
             striplen = 0
         else:
             striplen = len(dirname)
-        for dirpath, dirnames, filenames in os.walk(dirname):
-            subpath = dirpath[striplen:]
-            if not subpath:
-                subpath = "/"
 
-            deldirs = []
-            for d in dirnames:
-                dpath = os.path.join(subpath, d)
-                if dpath in exclude_dirs:
-                    deldirs.append(d)
+        def emit(fut):
+            files, subdirs = fut.result()
+            pending = [pool.submit(_scan_dir, d, striplen, exclude_dirs, fields)
+                       for d in subdirs]
+            yield from files
+            for sub in pending:
+                yield from emit(sub)
 
-            for d in deldirs:
-                dirnames.remove(d)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            yield from emit(pool.submit(_scan_dir, dirname, striplen,
+                                        exclude_dirs, fields))
 
-            for f in filenames:
-                fpath = os.path.join(subpath, f)
-                realpath = os.path.join(dirpath, f)
-                yield "/" + fpath, realpath
+    def walk_files(self, directory='', exclude_dirs=None):
+        for fpath, realpath in self.scan_files(directory, exclude_dirs):
+            yield fpath, realpath
 
     def mtime_snap(self, dirname='', exclude_dirs=None):
-        if not exclude_dirs:
-            exclude_dirs = []
         mtime_index = {}
 
-        for fpath, realpath in self.walk_files(dirname, exclude_dirs):
-            stat = os.lstat(realpath)
-            mtime_index[fpath] = stat.st_mtime
+        for fpath, _, mtime in self.scan_files(dirname, exclude_dirs,
+                                               fields=("mtime_ns",)):
+            mtime_index[fpath] = mtime
 
         return mtime_index
 
     def __disk_usage(self, directory):
         size = os.path.getsize(directory)
 
-        for i in os.listdir(directory):
-            full = os.path.join(directory, i)
-            if os.path.isfile(full):
-                size += os.path.getsize(full)
-            elif os.path.isdir(full):
-                size += self.__disk_usage(full)
+        with os.scandir(directory) as it:
+            for e in it:
+                if e.is_file():
+                    size += e.stat().st_size
+                elif e.is_dir():
+                    size += self.__disk_usage(e.path)
 
         return size
 
     def disk_usage(self, dirname=''):
+        """Sum of the apparent sizes of all files and directories
+
+        --
+        >>> this.mkdir_p("disk_usage/a")
+        >>> this.write_file("disk_usage/a/f", 0o644, "12345")
+        >>> this.disk_usage("disk_usage") == (5 +
+        ...     os.path.getsize(this.fname("disk_usage")) +
+        ...     os.path.getsize(this.fname("disk_usage/a")))
+        True
+        """
         directory = self.fname(dirname)
         return self.__disk_usage(directory)
 
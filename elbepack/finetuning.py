@@ -463,25 +463,28 @@ class UpdatedAction(FinetuningAction):
         with buildenv:
             cache = get_rpcaptcache(buildenv.rfs, arch)
 
-            pkglist = cache.get_installed_pkgs()
-            for pkg in pkglist:
-                try:
-                    cache.download_binary(
-                        pkg.name, '/tmp/pkgs', pkg.installed_version)
-                except ValueError:
-                    logging.exception("No package %s-%s",
-                                      pkg.name, pkg.installed_version)
-                except FetchError:
-                    logging.exception("Package %s-%s could not be downloaded",
-                                      pkg.name, pkg.installed_version)
-                except TypeError:
-                    logging.exception("Package %s-%s missing name or version",
-                                      pkg.name, pkg.installed_version)
+            pkglist = cache.get_installed_pkgs(hashes=False)
+            results = cache.download_binaries(
+                [(pkg.name, pkg.installed_version) for pkg in pkglist],
+                '/tmp/pkgs')
+            for (name, version), deb in results.items():
+                if isinstance(deb, FetchError):
+                    logging.error("Package %s-%s could not be downloaded: %s",
+                                  name, version, deb)
+                elif isinstance(deb, ValueError):
+                    logging.error("No package %s-%s: %s", name, version, deb)
+                elif isinstance(deb, Exception):
+                    logging.error("Package %s-%s missing name or version: %s",
+                                  name, version, deb)
         r = UpdateRepo(target.xml,
                        target.path + '/var/cache/elbe/repos/base')
 
-        for d in buildenv.rfs.glob('tmp/pkgs/*.deb'):
-            r.includedeb(d, 'main')
+        failed = r.include_many(buildenv.rfs.glob('tmp/pkgs/*.deb'), 'main')
+        for d in failed:
+            logging.error("Package %s could not be added to the base repo",
+                          os.path.basename(d))
+        if failed:
+            raise next(iter(failed.values()))
         r.finalize()
 
         slist = target.path + '/etc/apt/sources.list.d/base.list'
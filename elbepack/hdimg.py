@@ -4,15 +4,19 @@
 
 import logging
 import os
+import shutil
+import tempfile
 
 from pathlib import Path
 
 import parted
 import _ped
 
+from elbepack.copyengine import splice_file, write_file_at
 from elbepack.fstab import fstabentry, mountpoint_dict, hdpart
 from elbepack.filesystem import Filesystem, size_to_int
-from elbepack.shellhelper import do, CommandError, chroot, get_command_out
+from elbepack.shellhelper import (do, CommandError, chroot, get_command_out,
+                                  run_parallel)
 
 
 def mkfs_mtd(mtd, fslabel, target):
@@ -343,7 +347,7 @@ def create_partition(
     return ppart
 
 
-def create_label(disk, part, ppart, fslabel, target, grub):
+def create_label(disk, part, ppart, fslabel, target, grub, *, images=None):
 
     # pylint: disable=too-many-arguments
 
@@ -352,31 +356,148 @@ def create_label(disk, part, ppart, fslabel, target, grub):
 
     grub.add_fs_entry(entry)
 
+    if images is not None:
+        # The filesystem is built later on by build_label_images()
+        images.append(entry)
+        return ppart
+
     loopdev = entry.losetup()
 
+    try:
+        mkfs_label(entry, loopdev, Path(target, "imagemnt"), target)
+    finally:
+        do(f"losetup -d {loopdev}")
+
+    return ppart
+
+
+def mkfs_label(entry, device, mount_path, target):
+    """Create the filesystem of entry on device and copy its content"""
+
+    if entry.fstype == "squashfs":
+        # squashfs is read only, it is created from its content in one
+        # go and can not be mounted for writing
+        if entry.fs_path_commands:
+            raise ValueError(f'squashfs "{entry.label}" does not support '
+                             f'path-command finetuning')
+        mkfs_from_dir(entry, device,
+                      os.path.join(target, "filesystems", entry.id))
+        _execute_fs_commands(entry.fs_device_commands, {"device": device})
+        return
+
+    do(
+        f"mkfs.{entry.fstype} {entry.mkfsopt} {entry.get_label_opt()} "
+        f"{device}")
+
+    _execute_fs_commands(entry.fs_device_commands, {"device": device})
+
+    do(f"mount {device} {mount_path}")
+
+    _execute_fs_commands(entry.fs_path_commands, {"path": mount_path})
+
     try:
         do(
-            f"mkfs.{entry.fstype} {entry.mkfsopt} {entry.get_label_opt()} "
-            f"{loopdev}")
+            f'cp -a "{os.path.join(target, "filesystems", entry.id)}/." '
+            f'"{mount_path}/"',
+            allow_fail=True)
+    finally:
+        do(f"umount {device}")
+
+
+def _has_symlinks(path):
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in dirnames + filenames:
+            if os.path.islink(os.path.join(dirpath, name)):
+                return True
+    return False
+
+
+def mkfs_from_dir(entry, fname, srcdir):
+    """Create the filesystem of entry in the file fname from srcdir
+
+    The filesystem is populated by the mkfs tool itself, no loop device
+    and no mount is needed.  Returns False, if this is not possible for
+    the filesystem type of entry.
+    """
+    opts = f"{entry.mkfsopt} {entry.get_label_opt()}"
+
+    if entry.fstype in ("ext2", "ext3", "ext4"):
+        do(f'mkfs.{entry.fstype} {opts} -d "{srcdir}" "{fname}"')
+    elif entry.fstype == "btrfs":
+        do(f'mkfs.btrfs {opts} --rootdir "{srcdir}" "{fname}"')
+    elif entry.fstype == "vfat" and shutil.which("mcopy") and \
+            not _has_symlinks(srcdir):
+        # mcopy would store the targets of symlinks, 'cp -a' on the
+        # loop mount skips them
+        do(f'mkfs.vfat {opts} "{fname}"')
+        files = " ".join(f'"{os.path.join(srcdir, f)}"'
+                         for f in sorted(os.listdir(srcdir)))
+        if files:
+            # Like 'cp -a' before, files vfat can not store are skipped
+            do(f'mcopy -s -p -m -i "{fname}" {files} ::/',
+               allow_fail=True, env_add={"MTOOLS_SKIP_CHECK": "1"})
+    elif entry.fstype == "squashfs":
+        do(f'mksquashfs "{srcdir}" "{fname}" -noappend {entry.mkfsopt}')
+        # mksquashfs grows the file as needed, it is spliced into the
+        # partition later on and must not run into the next one
+        if os.path.isfile(fname) and os.path.getsize(fname) > entry.size:
+            raise ValueError(f'squashfs "{entry.label}" does not fit into '
+                             f'partition {entry.partnum}')
+    else:
+        return False
+
+    return True
+
 
-        _execute_fs_commands(entry.fs_device_commands, dict(device=loopdev))
+def build_label_image(entry, fname, target):
+    """Build the filesystem of entry in the sparse image file fname"""
+    with open(fname, "wb") as f:
+        f.truncate(entry.size)
 
-        mount_path = Path(target, "imagemnt")
-        do(f"mount {loopdev} {mount_path}")
+    # Finetuning commands need the device or the mounted filesystem
+    if not (entry.fs_device_commands or entry.fs_path_commands) and \
+       mkfs_from_dir(entry, fname,
+                     os.path.join(target, "filesystems", entry.id)):
+        return
 
-        _execute_fs_commands(entry.fs_path_commands, dict(path=mount_path))
+    img = hdpart()
+    img.filename = fname
+    img.size = entry.size
 
+    mount_path = tempfile.mkdtemp(dir=target, prefix="imagemnt.")
+    try:
+        loopdev = img.losetup()
         try:
-            do(
-                f'cp -a "{os.path.join(target, "filesystems", entry.id)}/." '
-                f'"{mount_path}/"',
-                allow_fail=True)
+            mkfs_label(entry, loopdev, mount_path, target)
         finally:
-            do(f"umount {loopdev}")
+            do(f"losetup -d {loopdev}")
     finally:
-        do(f"losetup -d {loopdev}")
+        os.rmdir(mount_path)
+
+
+def build_label_images(images, target, jobs=None):
+    """Build the filesystems of all images in parallel
+
+    The partition table is not touched, every filesystem is created
+    in a sparse file of the size of its partition first, without a
+    loop mount where the filesystem allows.  Only the
+    data of the finished files is copied into the disk image at the
+    offsets of the partitions.  This results in the same disk image
+    as creating the filesystems in place.
+    """
+    fnames = [f"{entry.filename}.{entry.partnum}" for entry in images]
+
+    try:
+        run_parallel(lambda job: build_label_image(job[0], job[1], target),
+                     list(zip(images, fnames)), jobs)
+
+        for entry, fname in zip(images, fnames):
+            splice_file(fname, entry.filename, entry.offset)
+    finally:
+        for fname in fnames:
+            if os.path.exists(fname):
+                os.unlink(fname)
 
-    return ppart
 
 def _execute_fs_commands(commands, replacements):
     for command in commands:
@@ -392,26 +513,28 @@ def create_binary(disk, part, ppart, target):
     entry = hdpart()
     entry.set_geometry(ppart, disk)
 
-    loopdev = entry.losetup()
+    # copy from buildenv if path starts with /
+    if part.text("binary")[0] == '/':
+        tmp = target + "/" + "chroot" + part.text("binary")
+    # copy from project directory
+    else:
+        tmp = target + "/" + part.text("binary")
 
-    try:
-        # copy from buildenv if path starts with /
-        if part.text("binary")[0] == '/':
-            tmp = target + "/" + "chroot" + part.text("binary")
-        # copy from project directory
-        else:
-            tmp = target + "/" + part.text("binary")
+    if os.path.getsize(tmp) > entry.size:
+        raise ValueError(f'"{tmp}" does not fit into partition '
+                         f'{entry.partnum}')
 
-        do(f'dd if="{tmp}" of="{loopdev}"')
-    finally:
-        do(f'losetup -d "{loopdev}"')
+    # Zero blocks of the binary leave the image sparse
+    write_file_at(tmp, entry.filename, entry.offset)
 
 def create_logical_partitions(disk,
                               extended,
                               epart,
                               fslabel,
                               target,
-                              grub):
+                              grub,
+                              *,
+                              images=None):
 
     # pylint: disable=too-many-arguments
 
@@ -433,12 +556,14 @@ def create_logical_partitions(disk,
         if logical.has('binary'):
             create_binary(disk, logical, lpart, target)
         elif logical.has("label") and logical.text("label") in fslabel:
-            create_label(disk, logical, lpart, fslabel, target, grub)
+            create_label(disk, logical, lpart, fslabel, target, grub,
+                         images=images)
 
         current_sector += lpart.getLength()
 
 
-def do_image_hd(hd, fslabel, target, grub_version, grub_fw_type=None):
+def do_image_hd(hd, fslabel, target, grub_version, grub_fw_type=None, *,
+                jobs=None):
 
     # pylint: disable=too-many-arguments
     # pylint: disable=too-many-locals
@@ -470,6 +595,11 @@ def do_image_hd(hd, fslabel, target, grub_version, grub_fw_type=None):
     current_sector = size_to_int(hd.text("first_partition_sector",
                                          default="2048"))
 
+    # With a single job, the filesystems are created in place, one
+    # after the other.  Otherwise they are collected and built in
+    # parallel once the layout is known.
+    images = None if jobs == 1 else []
+
     for part in hd:
 
         if part.tag == "partition":
@@ -483,7 +613,8 @@ def do_image_hd(hd, fslabel, target, grub_version, grub_fw_type=None):
             if part.has("binary"):
                 create_binary(disk, part, ppart, target)
             elif part.text("label") in fslabel:
-                create_label(disk, part, ppart, fslabel, target, grub)
+                create_label(disk, part, ppart, fslabel, target, grub,
+                             images=images)
         elif part.tag == "extended":
             ppart = create_partition(
                 disk,
@@ -493,12 +624,15 @@ def do_image_hd(hd, fslabel, target, grub_version, grub_fw_type=None):
                 size_in_sectors,
                 current_sector)
             create_logical_partitions(disk, part, ppart,
-                                      fslabel, target, grub)
+                                      fslabel, target, grub, images=images)
         else:
             continue
 
         current_sector += ppart.getLength()
 
+    if images:
+        build_label_images(images, target, jobs)
+
     disk.commit()
 
     if hd.has("grub-install") and grub_version:
@@ -533,12 +667,18 @@ def add_binary_blob(hd, target):
             # use file from /var/cache/elbe/<uuid> project dir
             bf = os.path.join(target, binary.et.text)
 
-        do(
-            f'dd if="{bf}" of="{imagename}" seek="{offset}" bs="{bs}" '
-            'conv=notrunc')
+        if str(offset).isdigit() and str(bs).isdigit():
+            # Zero blocks of the blob leave the image sparse
+            write_file_at(bf, imagename, int(offset) * int(bs))
+        else:
+            # dd specific size suffixes
+            do(
+                f'dd if="{bf}" of="{imagename}" seek="{offset}" bs="{bs}" '
+                'conv=notrunc')
 
 
-def do_hdimg(xml, target, rfs, grub_version, grub_fw_type=None):
+def do_hdimg(xml, target, rfs, grub_version, grub_fw_type=None, *,
+             jobs=None):
 
     # pylint: disable=too-many-arguments
     # pylint: disable=too-many-locals
@@ -551,6 +691,9 @@ def do_hdimg(xml, target, rfs, grub_version, grub_fw_type=None):
     if not xml.tgt.has("images"):
         return img_files
 
+    if jobs is None and xml.tgt.has("images/build-jobs"):
+        jobs = int(xml.tgt.text("images/build-jobs"))
+
     # Build a dictonary of mount points
     fslabel = {}
     mountpoints = mountpoint_dict()
@@ -598,7 +741,8 @@ def do_hdimg(xml, target, rfs, grub_version, grub_fw_type=None):
                                   fslabel,
                                   target,
                                   grub_version,
-                                  grub_fw_type)
+                                  grub_fw_type,
+                                  jobs=jobs)
                 img_files.append(img)
 
             if i.tag == "gpthd":
@@ -606,7 +750,8 @@ def do_hdimg(xml, target, rfs, grub_version, grub_fw_type=None):
                                   fslabel,
                                   target,
                                   grub_version,
-                                  grub_fw_type)
+                                  grub_fw_type,
+                                  jobs=jobs)
                 img_files.append(img)
 
             if i.tag == "mtd":
@@ -19,6 +19,10 @@ msgonly_fmt = logging.Formatter("%(message)s")
 
 logging_methods = []
 
+# Worker threads, whose records are filtered like records of
+# the thread that started them.  See adopt_logging().
+adopted = {}
+
 
 class LoggingQueue(collections.deque):
     def __init__(self):
@@ -89,6 +93,7 @@ class ThreadFilter(logging.Filter):
             thread = record._thread
         else:
             thread = record.thread
+        thread = adopted.get(thread, thread)
         retval = record.name in self.allowed and thread == self.thread
         if retval and not hasattr(record, 'context'):
             record.context = f"[{record.levelname}]"
@@ -200,6 +205,21 @@ def elbe_logging(*args, **kwargs):
         close_logging()
 
 
+@contextmanager
+def adopt_logging(thread):
+    """Log the records of the current thread as records of thread
+
+    The log handlers only accept records from the thread that set them
+    up.  Worker threads use this to get their records logged anyway.
+    """
+    ident = threading.current_thread().ident
+    adopted[ident] = thread
+    try:
+        yield
+    finally:
+        del adopted[ident]
+
+
 def open_logging(targets):
 
     close_logging()
@@ -225,6 +245,7 @@ class AsyncLogging:
         self.atmost = atmost
         self.fd = None
         calling_thread = threading.current_thread().ident
+        calling_thread = adopted.get(calling_thread, calling_thread)
         extra = {"_thread": calling_thread}
         extra["context"] = ""
         self.stream = logging.LoggerAdapter(stream, extra)
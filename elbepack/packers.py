@@ -2,32 +2,61 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # SPDX-FileCopyrightText: 2019 Linutronix GmbH
 
+import logging
 import os
-from elbepack.shellhelper import CommandError, do
+import shutil
+import time
+
+from elbepack.seekzstd import SeekableZstdError, tar_index, write_seekable
+from elbepack.shellhelper import CommandError, do, run_parallel
+
+
+def cpu_count():
+    """Return the number of CPUs the build may use"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
 
 class Packer:
 
-    def pack_file(self, _builddir, _fname):
+    # Multi-threaded variant of the compressor, a tuple of the tool and
+    # a format string for the number of threads
+    threaded = None
+
+    def threaded_cmd(self, threads, default):
+        """Return the threaded command, if it can be used, else default"""
+        if threads is None or self.threaded is None:
+            return default
+        tool, cmd = self.threaded
+        if not shutil.which(tool):
+            return default
+        return cmd.format(threads=threads)
+
+    def pack_file(self, _builddir, _fname, _threads=None):
         raise NotImplementedError('abstract method called')
 
 
 class NoPacker(Packer):
 
-    def pack_file(self, _builddir, fname):
+    def pack_file(self, _builddir, fname, _threads=None):
         return fname
 
 
 class InPlacePacker(Packer):
 
-    def __init__(self, cmd, suffix):
+    def __init__(self, cmd, suffix, threaded=None):
 
         self.cmd = cmd
         self.suffix = suffix
+        self.threaded = threaded
 
-    def pack_file(self, builddir, fname):
+    def pack_file(self, builddir, fname, threads=None):
         try:
             fpath = os.path.join(builddir, fname)
-            do(f'{self.cmd} "{fpath}"')
+            cmd = self.threaded_cmd(threads, self.cmd)
+            do(f'{cmd} "{fpath}"')
         except CommandError:
             # in case of an error, we just return None
             # which means, that the orig file does not
@@ -39,18 +68,20 @@ class InPlacePacker(Packer):
 
 class TarArchiver(Packer):
 
-    def __init__(self, flag, suffix):
+    def __init__(self, flag, suffix, threaded=None):
         self.flag = flag
         self.suffix = suffix
+        self.threaded = threaded
 
-    def pack_file(self, builddir, fname):
+    def pack_file(self, builddir, fname, threads=None):
         try:
             fpath = os.path.join(builddir, fname)
             dirname = os.path.dirname(fpath)
             basename = os.path.basename(fpath)
             archname = fpath + self.suffix
+            flag = self.threaded_cmd(threads, self.flag)
             do(
-                f'tar --create --verbose --sparse {self.flag} '
+                f'tar --create --verbose --sparse {flag} '
                 f'--file "{archname}" --directory "{dirname}" "{basename}"')
             do(f'rm -f "{fpath}"')
         except CommandError:
@@ -66,13 +97,92 @@ class TarArchiver(Packer):
         return fname + self.suffix
 
 
+class SeekableZstdPacker(Packer):
+    """Pack into a seekable zstd archive, see elbepack.seekzstd
+
+    With tar, the file is put into a tar archive first, and the
+    archive gets an index of its members.
+    """
+
+    def __init__(self, tar=False):
+        self.tar = tar
+        self.suffix = ".tar.zst" if tar else ".zst"
+
+    def pack_file(self, builddir, fname, threads=None):
+        fpath = os.path.join(builddir, fname)
+        src = fpath
+        index = None
+        try:
+            if self.tar:
+                src = fpath + ".tar"
+                do(
+                    f'tar --create --verbose --sparse --file "{src}" '
+                    f'--directory "{os.path.dirname(fpath)}" '
+                    f'"{os.path.basename(fpath)}"')
+                index = tar_index(src)
+
+            write_seekable(src, fpath + self.suffix,
+                           threads=threads or cpu_count(), index=index)
+            do(f'rm -f "{fpath}"')
+        except (CommandError, OSError, SeekableZstdError) as e:
+            # in case of an error, we just return None
+            # which means, that the orig file does not
+            # exist anymore.
+            logging.error("Packing %s failed: %s", fname, e)
+            return None
+        finally:
+            if src != fpath and os.path.exists(src):
+                os.unlink(src)
+
+        return fname + self.suffix
+
+
 packers = {'none': NoPacker(),
-           'gzip': InPlacePacker('gzip -f', '.gz'),
-           'zstd': InPlacePacker('zstd -T0', '.zst'),
+           'gzip': InPlacePacker('gzip -f', '.gz',
+                                 ('pigz', 'pigz -f -p {threads}')),
+           'zstd': InPlacePacker('zstd -T0', '.zst',
+                                 ('zstd', 'zstd -T{threads}')),
            'tar':  TarArchiver('--auto-compress', '.tar'),
-           'tarxz': TarArchiver('--auto-compress', '.tar.xz'),
-           'targz': TarArchiver('--auto-compress', '.tar.gz'),
-           'tarzstd': TarArchiver('--use-compress-program="zstd -T0"', '.tar.zst'),
+           'tarxz': TarArchiver('--auto-compress', '.tar.xz',
+                                ('xz', '--use-compress-program="xz -T{threads}"')),
+           'targz': TarArchiver('--auto-compress', '.tar.gz',
+                                ('pigz', '--use-compress-program="pigz -p {threads}"')),
+           'tarzstd': TarArchiver('--use-compress-program="zstd -T0"', '.tar.zst',
+                                  ('zstd', '--use-compress-program="zstd -T{threads}"')),
+           'seekzstd': SeekableZstdPacker(),
+           'tarseekzstd': SeekableZstdPacker(tar=True),
            }
 
 default_packer = packers['targz']
+
+
+def pack_files(builddir, jobs, cpus=None, prepare=None):
+    """Pack several files at once
+
+    jobs is a list of (fname, packer) tuples.  Up to cpus files are
+    packed concurrently, the CPUs are split evenly between them for
+    the multi-threaded compressors.  prepare(fname) is called for
+    every file right before it is packed.
+
+    Returns the list of packed file names, None for failed ones, in
+    the order of jobs.
+    """
+    if not jobs:
+        return []
+
+    if cpus is None:
+        cpus = cpu_count()
+    concurrent = max(1, min(len(jobs), cpus))
+    threads = max(1, cpus // concurrent)
+
+    def pack(job):
+        fname, packer = job
+        if prepare is not None:
+            prepare(fname)
+        start = time.monotonic()
+        packed = packer.pack_file(builddir, fname, threads)
+        logging.info("Packed %s to %s in %.1fs with %d threads",
+                     fname, packed, time.monotonic() - start, threads)
+        return packed
+
+    return run_parallel(pack, jobs, concurrent)
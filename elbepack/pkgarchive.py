@@ -11,6 +11,9 @@ from elbepack.repomanager import RepoBase, RepoAttributes
 
 
 class ArchiveRepo(RepoBase):
+
+    native_index = True
+
     def __init__(self, xml, pathname, origin, description, components):
 
         # pylint: disable=too-many-arguments
@@ -29,6 +32,9 @@ class ArchiveRepo(RepoBase):
 
 
 def gen_binpkg_archive(ep, repodir):
+
+    # pylint: disable=too-many-locals
+
     repopath = path.join(ep.builddir, repodir)
 
     try:
@@ -46,7 +52,10 @@ def gen_binpkg_archive(ep, repodir):
                            "Elbe package archive", ["main"])
 
         c = ep.get_rpcaptcache()
-        pkglist = c.get_installed_pkgs()
+        pkglist = c.get_installed_pkgs(hashes=False)
+        debs = {}
+
+        missing = []
 
         for pkg in pkglist:
             # Use package from local APT archive, if the file exists
@@ -55,28 +64,40 @@ def gen_binpkg_archive(ep, repodir):
             abs_path = ep.buildenv.rfs.fname(rel_path)
 
             if not path.isfile(abs_path):
-                # Package file does not exist, download it and adjust path name
+                # Package file does not exist, download it below
                 logging.warning('Package file "%s" not found in var/cache/apt/archives, downloading it',
                                 filename)
-                abs_path = ep.buildenv.rfs.fname(rel_path)
-                pkg_id = f"{pkg.name}-{pkg.installed_version}"
-                try:
-                    abs_path = c.download_binary(pkg.name,
-                                                 '/var/cache/elbe/pkgarchive',
-                                                 pkg.installed_version)
-                except ValueError:
-                    logging.error('No package "%s"', pkg_id)
-                    raise
-                except FetchError:
-                    logging.error('Package "%s" could not be downloaded', pkg_id)
-                    raise
-                except TypeError:
-                    logging.error('Package "%s" missing name or version', pkg_id)
-                    raise
-
-            # Add package to repository
-            # XXX Use correct component
-            repo.includedeb(abs_path, "main")
+                missing.append(pkg)
+                continue
+
+            debs[abs_path] = f"{pkg.name}-{pkg.installed_version}"
+
+        results = c.download_binaries(
+            [(pkg.name, pkg.installed_version) for pkg in missing],
+            '/var/cache/elbe/pkgarchive')
+
+        for pkg in missing:
+            pkg_id = f"{pkg.name}-{pkg.installed_version}"
+            abs_path = results[(pkg.name, pkg.installed_version)]
+            if isinstance(abs_path, FetchError):
+                logging.error('Package "%s" could not be downloaded', pkg_id)
+                raise abs_path
+            if isinstance(abs_path, ValueError):
+                logging.error('No package "%s"', pkg_id)
+                raise abs_path
+            if isinstance(abs_path, Exception):
+                logging.error('Package "%s" missing name or version', pkg_id)
+                raise abs_path
+
+            debs[abs_path] = pkg_id
+
+        # Add packages to repository
+        # XXX Use correct component
+        failed = repo.include_many(debs, "main")
+        for deb in failed:
+            logging.error('Package "%s" could not be added to repo', debs[deb])
+        if failed:
+            raise next(iter(failed.values()))
 
         repo.finalize()
 
@@ -133,7 +154,7 @@ def checkout_binpkg_archive(ep, repodir):
             # deletion, using the same logic as in commands/updated.py
             logging.info("Calculating packages to install/remove")
             fpl = ep.xml.node("fullpkgs")
-            pkgs = c.get_pkglist('all')
+            pkgs = c.get_pkglist('all', hashes=False)
 
             for p in pkgs:
                 marked = False
@@ -0,0 +1,122 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import re
+
+from array import array
+from bisect import bisect_left
+from fnmatch import translate
+
+
+def trigrams(s):
+    """Return the set of trigrams of s
+
+    >>> sorted(trigrams("libc6"))
+    ['bc6', 'ibc', 'lib']
+    >>> trigrams("ab")
+    set()
+    """
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def glob_literals(pattern):
+    """Return the leading literal and all literal runs of a glob pattern
+
+    >>> glob_literals("lib*-dev")
+    ('lib', ['lib', '-dev'])
+    >>> glob_literals("*ssl[0-9]*")
+    ('', ['ssl'])
+    """
+    runs = re.split(r"\*|\?|\[[^]]*\]", pattern)
+    return runs[0], [r for r in runs if r]
+
+
+class NameIndex:
+    """Search index over package names
+
+    The names are kept sorted, so prefix queries are a binary search.
+    Substring and glob queries only test the names in the shortest
+    posting list of the trigrams of the query.
+    All results are in sorted order, a limit stops the search early.
+    """
+
+    def __init__(self, names):
+        self.names = sorted(set(names))
+        self.postings = {}
+        for idx, name in enumerate(self.names):
+            for t in trigrams(name):
+                self.postings.setdefault(t, array('I')).append(idx)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _candidates(self, literals):
+        """Return the sorted indices of names, that may contain literals
+
+        This is the shortest posting list of all trigrams, the names
+        are checked against the query afterwards anyway.  None means,
+        that no trigram is known and every name is a candidate.
+        """
+        grams = set()
+        for lit in literals:
+            grams |= trigrams(lit)
+        if not grams:
+            return None
+
+        return min((self.postings.get(t, ()) for t in grams), key=len)
+
+    def _select(self, indices, match, limit):
+        ret = []
+        for idx in indices:
+            name = self.names[idx]
+            if match(name):
+                ret.append(name)
+                if limit is not None and len(ret) >= limit:
+                    break
+        return ret
+
+    def prefix(self, prefix, limit=None):
+        """Return the names starting with prefix"""
+        start = bisect_left(self.names, prefix)
+        ret = []
+        for name in self.names[start:]:
+            if not name.startswith(prefix):
+                break
+            ret.append(name)
+            if limit is not None and len(ret) >= limit:
+                break
+        return ret
+
+    def substring(self, term, limit=None):
+        """Return the names containing term"""
+        indices = self._candidates([term])
+        if indices is None:
+            indices = range(len(self.names))
+        return self._select(indices, lambda name: term in name, limit)
+
+    def glob(self, pattern, limit=None):
+        """Return the names matching the shell pattern"""
+        regex = re.compile(translate(pattern))
+        lead, literals = glob_literals(pattern)
+
+        if lead:
+            start = bisect_left(self.names, lead)
+            end = bisect_left(self.names, lead + "\uffff")
+            indices = range(start, end)
+        else:
+            indices = self._candidates(literals)
+            if indices is None:
+                indices = range(len(self.names))
+
+        return self._select(indices, regex.match, limit)
+
+    def search(self, term, mode="substring", limit=None):
+        """Dispatch to prefix(), substring() or glob()"""
+        if mode == "prefix":
+            return self.prefix(term, limit)
+        if mode == "substring":
+            return self.substring(term, limit)
+        if mode == "glob":
+            return self.glob(term, limit)
+        raise ValueError(f"Unknown search mode '{mode}'")
@@ -0,0 +1,290 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from contextlib import contextmanager
+
+from elbepack.copyengine import copy_data
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class PackageStore:
+    """Host wide store of package files, addressed by their sha256
+
+    Projects fetch a file from the store by hardlinking it into their
+    own directories, a reflink or a copy is used across filesystems.
+    Files fetched from a mirror are added to the store, so every
+    package is only downloaded once per initvm.
+
+    All operations go through a directory file descriptor, which is
+    opened on creation.  Thus, a store can still be used after the
+    process entered the chroot of a project.
+
+    The index is protected by a lock file and records size, last use
+    and file name of every object.  The least recently used objects
+    are removed, when the store grows beyond maxsize.
+    """
+
+    default_path = "/var/cache/elbe/pkgstore"
+    default_maxsize = 20 * 1024 * 1024 * 1024
+
+    def __init__(self, path=None, maxsize=None):
+        if path is None:
+            path = self.default_path
+        if maxsize is None:
+            maxsize = self.default_maxsize
+
+        self.path = path
+        self.maxsize = maxsize
+
+        os.makedirs(os.path.join(path, "objects"), exist_ok=True)
+        self.dirfd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if getattr(self, "dirfd", None) is not None:
+            os.close(self.dirfd)
+            self.dirfd = None
+
+    @staticmethod
+    def _objname(sha256):
+        return f"objects/{sha256[:2]}/{sha256}"
+
+    @contextmanager
+    def _index(self, write=True):
+        """Lock the store and yield its index for modification"""
+        lockfd = os.open("lock", os.O_RDWR | os.O_CREAT, 0o644,
+                         dir_fd=self.dirfd)
+        try:
+            fcntl.flock(lockfd, fcntl.LOCK_EX)
+
+            try:
+                fd = os.open("index.json", os.O_RDONLY, dir_fd=self.dirfd)
+                with os.fdopen(fd, "r") as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                index = {}
+
+            yield index
+
+            if not write:
+                return
+
+            fd = os.open("index.json.tmp",
+                         os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644,
+                         dir_fd=self.dirfd)
+            with os.fdopen(fd, "w") as f:
+                json.dump(index, f)
+            os.replace("index.json.tmp", "index.json",
+                       src_dir_fd=self.dirfd, dst_dir_fd=self.dirfd)
+        finally:
+            os.close(lockfd)
+
+    def _materialize(self, objname, dest):
+        if os.path.lexists(dest):
+            os.unlink(dest)
+
+        try:
+            os.link(objname, dest, src_dir_fd=self.dirfd)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+
+        fsrc = os.open(objname, os.O_RDONLY, dir_fd=self.dirfd)
+        try:
+            fdst = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                copy_data(fsrc, fdst, os.fstat(fsrc).st_size)
+            finally:
+                os.close(fdst)
+        finally:
+            os.close(fsrc)
+
+    def fetch(self, items, touch=True):
+        """Place the store objects at the given destinations
+
+        items is a list of (sha256, destination path) tuples.  Returns
+        the set of destinations, which could be served from the store.
+        With touch, the objects count as used now.
+        """
+        if not items:
+            return set()
+
+        done = set()
+        now = time.time()
+
+        with self._index() as index:
+            for sha256, dest in items:
+                if sha256 not in index:
+                    continue
+                try:
+                    self._materialize(self._objname(sha256), dest)
+                except FileNotFoundError:
+                    # Object removed behind our back
+                    del index[sha256]
+                    continue
+                except OSError as e:
+                    logging.warning("Can not use %s from the package store: %s",
+                                    os.path.basename(dest), e)
+                    continue
+                if touch:
+                    index[sha256][1] = now
+                done.add(dest)
+
+        return done
+
+    def touch(self, sha256s):
+        """Mark the objects as used now"""
+        if not sha256s:
+            return
+
+        now = time.time()
+        with self._index() as index:
+            for sha256 in sha256s:
+                if sha256 in index:
+                    index[sha256][1] = now
+
+    def add(self, items):
+        """Add files to the store
+
+        items is a list of (path, sha256) tuples, a sha256 of None
+        means that it is computed from the file.
+        """
+        if not items:
+            return
+
+        now = time.time()
+
+        with self._index() as index:
+            for path, sha256 in items:
+                if sha256 is None:
+                    sha256 = file_sha256(path)
+
+                if sha256 in index:
+                    index[sha256][1] = now
+                    continue
+
+                objname = self._objname(sha256)
+                try:
+                    os.mkdir(os.path.dirname(objname), dir_fd=self.dirfd)
+                except FileExistsError:
+                    pass
+
+                try:
+                    try:
+                        os.unlink(objname, dir_fd=self.dirfd)
+                    except FileNotFoundError:
+                        pass
+                    os.link(path, objname, dst_dir_fd=self.dirfd)
+                except OSError:
+                    # Different filesystem, store a copy
+                    fsrc = os.open(path, os.O_RDONLY)
+                    try:
+                        fdst = os.open(objname,
+                                       os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                                       0o644, dir_fd=self.dirfd)
+                        try:
+                            copy_data(fsrc, fdst, os.fstat(fsrc).st_size)
+                        finally:
+                            os.close(fdst)
+                    finally:
+                        os.close(fsrc)
+
+                index[sha256] = [os.path.getsize(path), now,
+                                 os.path.basename(path)]
+
+            self._evict(index)
+
+    def _evict(self, index):
+        size = sum(entry[0] for entry in index.values())
+
+        for sha256 in sorted(index, key=lambda sha256: index[sha256][1]):
+            if size <= self.maxsize:
+                break
+            try:
+                os.unlink(self._objname(sha256), dir_fd=self.dirfd)
+            except FileNotFoundError:
+                pass
+            size -= index.pop(sha256)[0]
+
+    def names(self, suffixes):
+        """Return sha256 => file name of all objects ending with suffixes"""
+        with self._index(write=False) as index:
+            return {sha256: entry[2] for sha256, entry in index.items()
+                    if entry[2].endswith(suffixes)}
+
+    def newest(self, prefixes):
+        """Return file name => sha256 of the objects named prefixes*
+
+        Of several objects with the same name, the most recently used
+        one is returned.
+        """
+        ret = {}
+        with self._index(write=False) as index:
+            for sha256, entry in sorted(index.items(),
+                                        key=lambda item: item[1][1]):
+                if entry[2].startswith(prefixes):
+                    ret[entry[2]] = sha256
+        return ret
+
+    @contextmanager
+    def debootstrap_cache(self, arch):
+        """Yield a directory for 'debootstrap --cache-dir'
+
+        The directory holds the stored .deb files of arch, the
+        packages fetched by debootstrap are added to the store
+        afterwards.
+        """
+        cachedir = tempfile.mkdtemp(prefix="debootstrap-", dir=self.path)
+        try:
+            byname = {name: sha256 for sha256, name
+                      in self.names((f"_{arch}.deb", "_all.deb")).items()}
+
+            # Only the files debootstrap uses count as used.  It reads
+            # them, which sets the access time reset here, or links
+            # them into the chroot.
+            self.fetch([(sha256, os.path.join(cachedir, name))
+                        for name, sha256 in byname.items()], touch=False)
+            stored = {}
+            for name in os.listdir(cachedir):
+                path = os.path.join(cachedir, name)
+                os.utime(path, ns=(0, os.stat(path).st_mtime_ns))
+                st = os.stat(path)
+                stored[name] = (st.st_ino, st.st_nlink)
+
+            yield cachedir
+
+            used = []
+            new = []
+            for name in os.listdir(cachedir):
+                path = os.path.join(cachedir, name)
+                st = os.stat(path)
+                if name not in stored or stored[name][0] != st.st_ino:
+                    if name.endswith(".deb"):
+                        new.append((path, None))
+                elif st.st_atime_ns or st.st_nlink > stored[name][1]:
+                    used.append(byname[name])
+            self.touch(used)
+            self.add(new)
+        finally:
+            shutil.rmtree(cachedir, ignore_errors=True)
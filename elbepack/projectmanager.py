@@ -22,6 +22,7 @@ from elbepack.asyncworker import (AsyncWorker, BuildJob, APTUpdateJob,
 
 from elbepack.elbexml import ValidationMode
 from elbepack.log import read_loggingQ
+from elbepack.rpcaptcache import drop_rpcaptcaches
 
 
 class ProjectManagerError(Exception):
@@ -158,6 +159,7 @@ class ProjectManager:
                                       self.db.get_username(
                                           self.builddir2userid[builddir]))
 
+        drop_rpcaptcaches(builddir)
         self.db.del_project(builddir)
 
     def get_current_project_data(self, userid):
@@ -397,6 +399,25 @@ class ProjectManager:
                 pkgs.append(pkgname)
             ep.xml.set_target_packages(pkgs)
 
+    def apt_plan_install(self, userid, pkgnames=None):
+        """Return the plan for installing pkgnames without changing anything
+
+        The target packages of the project are used, if no pkgnames
+        are given.
+        """
+        with self.lock:
+            c = self._get_current_project_apt_cache(userid)
+            ep = self._get_current_project(userid)
+            if c.get_changes():
+                raise InvalidState(
+                    f"project {ep.builddir} has uncommited package changes, "
+                    "please commit them first")
+
+            if not pkgnames:
+                pkgnames = ep.xml.get_target_packages()
+
+            return c.plan_install(pkgnames)
+
     def apt_mark_upgrade(self, userid, pkgname, version):
         with self.lock:
             c = self._get_current_project_apt_cache(userid)
@@ -439,11 +460,13 @@ class ProjectManager:
             return c.get_changes()
 
     def apt_get_marked_install(self, userid, section='all'):
+        """Return a PackageSnapshot of the packages marked for install"""
         with self.lock:
             c = self._get_current_project_apt_cache(userid)
             return c.get_marked_install(section=section)
 
     def apt_get_installed(self, userid, section='all'):
+        """Return a PackageSnapshot of the installed packages"""
         with self.lock:
             c = self._get_current_project_apt_cache(userid)
             return c.get_installed_pkgs(section=section)
@@ -454,6 +477,7 @@ class ProjectManager:
             return c.get_upgradeable(section=section)
 
     def apt_get_pkglist(self, userid, section='all'):
+        """Return a PackageSnapshot of the packages in section"""
         with self.lock:
             c = self._get_current_project_apt_cache(userid)
             return c.get_pkglist(section)
@@ -463,10 +487,10 @@ class ProjectManager:
             c = self._get_current_project_apt_cache(userid)
             return c.get_pkg(term)
 
-    def apt_get_pkgs(self, userid, term):
+    def apt_get_pkgs(self, userid, term, mode="substring", limit=None):
         with self.lock:
             c = self._get_current_project_apt_cache(userid)
-            return c.get_pkgs(term)
+            return c.get_pkgs(term, mode, limit)
 
     def apt_get_sections(self, userid):
         with self.lock:
@@ -544,6 +568,7 @@ class ProjectManager:
 
             del self.builddir2userid[builddir]
             del self.userid2project[userid]
+            drop_rpcaptcaches(builddir)
 
     def _check_project_permission(self, userid, builddir):
         if self.db.is_admin(userid):
@@ -0,0 +1,401 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import gzip
+import hashlib
+import os
+import shutil
+import time
+
+from debian.deb822 import Changes, Deb822, Dsc, Packages, Sources
+from debian.debfile import DebFile
+
+from elbepack.shellhelper import CommandError
+
+
+class RepoIndexError(CommandError):
+
+    def __init__(self, msg):
+        super().__init__(msg, 1)
+        self.msg = msg
+
+    def __str__(self):
+        return f"Error: {self.msg}"
+
+
+def pool_dir(component, source):
+    """Directory of a source package in the pool, like reprepro uses it
+
+    >>> pool_dir("main", "bash")
+    'pool/main/b/bash'
+    >>> pool_dir("added", "libc6")
+    'pool/added/libc/libc6'
+    """
+    if source.startswith("lib") and len(source) > 3:
+        prefix = source[:4]
+    else:
+        prefix = source[0]
+    return f"pool/{component}/{prefix}/{source}"
+
+
+def file_checksums(path):
+    md5 = hashlib.md5()
+    sha1 = hashlib.sha1()
+    sha256 = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            md5.update(chunk)
+            sha1.update(chunk)
+            sha256.update(chunk)
+
+    return {"MD5Sum": md5.hexdigest(),
+            "SHA1": sha1.hexdigest(),
+            "SHA256": sha256.hexdigest()}
+
+
+def get_attr(attrs, codename):
+    """Return the RepoAttributes of the distribution codename"""
+    for attr in attrs:
+        if attr.codename == codename:
+            return attr
+    raise KeyError(f"No distribution {codename} in repository")
+
+
+def open_index(fs, attrs):
+    """Return the RepoIndex of the repository volume in fs
+
+    The distributions in attrs, that were exported already, are loaded.
+    """
+    index = RepoIndex(fs)
+    index.load(attrs)
+    return index
+
+
+class RepoIndex:
+    """In-process index of a repository volume
+
+    Repositories that are written once and then put onto a CD-ROM or
+    into an archive do not need a reprepro database.  The control
+    paragraphs of the included .deb and .dsc files are kept in memory
+    and written as Packages/Sources and Release files on export().
+    The files are placed into the same pool layout, reprepro uses.
+
+    An index is loaded again from the exported files, so a repository
+    can be extended by a later run.
+    """
+
+    def __init__(self, fs):
+        self.fs = fs
+
+        # (codename, component, arch) => {package: Packages paragraph}
+        self.packages = {}
+        # (codename, component) => {source: Sources paragraph}
+        self.sources = {}
+
+    @staticmethod
+    def _component(attr, components):
+        if components is None:
+            components = ["main"]
+        elif isinstance(components, str):
+            components = [components]
+
+        for component in components:
+            if component in attr.components:
+                return component
+
+        raise RepoIndexError(f"No component {'|'.join(components)} "
+                             f"in {attr.codename}")
+
+    def _add_file(self, path, directory):
+        fname = os.path.join(directory, os.path.basename(path))
+        checksums = file_checksums(path)
+
+        if self.fs.exists(fname):
+            if file_checksums(self.fs.fname(fname)) != checksums:
+                raise RepoIndexError(f"{fname} is already in the pool "
+                                     "with a different content")
+            return fname, checksums
+
+        self.fs.mkdir_p(directory)
+        try:
+            os.link(path, self.fs.fname(fname))
+        except OSError:
+            shutil.copyfile(path, self.fs.fname(fname))
+
+        return fname, checksums
+
+    def _remove_files(self, fnames):
+        # Most includes replace nothing, collecting the used files
+        # would make a batch of includes quadratic
+        if not fnames:
+            return
+
+        used = set()
+        for pkgs in self.packages.values():
+            used.update(p["Filename"] for p in pkgs.values())
+        for srcs in self.sources.values():
+            for p in srcs.values():
+                used.update(f"{p['Directory']}/{f['name']}"
+                            for f in p["Files"])
+
+        for fname in fnames:
+            if fname not in used and self.fs.lexists(fname):
+                self.fs.remove(fname)
+
+    def includedeb(self, path, attr, components=None, prio=None):
+
+        # pylint: disable=too-many-locals
+
+        control = DebFile(path).debcontrol()
+        component = self._component(attr, components)
+
+        name = control["Package"]
+        version = control["Version"]
+        source = control.get("Source", name).split()[0]
+
+        if control["Architecture"] == "all":
+            archs = sorted(attr.arch - {"source"})
+        elif control["Architecture"] in attr.arch:
+            archs = [control["Architecture"]]
+        else:
+            raise RepoIndexError(f"{os.path.basename(path)}: architecture "
+                                 f"{control['Architecture']} not in "
+                                 f"{attr.codename}")
+
+        if path.endswith(".udeb"):
+            component = f"{component}/debian-installer"
+
+        for arch in archs:
+            old = self.packages.get((attr.codename, component, arch), {}).get(name)
+            if old is not None and old["Version"] == version:
+                if old["SHA256"] != file_checksums(path)["SHA256"]:
+                    raise RepoIndexError(f"{name} {version} is already "
+                                         f"in {attr.codename} with a "
+                                         "different content")
+
+        fname, checksums = self._add_file(
+            path, pool_dir(component.split("/")[0], source))
+
+        para = Packages()
+        para["Package"] = name
+        for key, value in control.items():
+            if key != "Package":
+                para[key] = value
+        if prio is not None:
+            para["Priority"] = prio
+        para["Filename"] = fname
+        para["Size"] = str(os.path.getsize(path))
+        para["MD5sum"] = checksums["MD5Sum"]
+        para["SHA1"] = checksums["SHA1"]
+        para["SHA256"] = checksums["SHA256"]
+
+        replaced = []
+        for arch in archs:
+            pkgs = self.packages.setdefault((attr.codename, component, arch), {})
+            old = pkgs.get(name)
+            if old is not None and old["Filename"] != fname:
+                replaced.append(old["Filename"])
+            pkgs[name] = para
+
+        self._remove_files(replaced)
+
+    def includedsc(self, path, attr, components=None):
+
+        # pylint: disable=too-many-locals
+
+        with open(path, "r", encoding="utf-8") as f:
+            dsc = Dsc(f)
+        component = self._component(attr, components)
+
+        name = dsc["Source"]
+        directory = pool_dir(component, name)
+        dscdir = os.path.dirname(path)
+
+        old = self.sources.get((attr.codename, component), {}).get(name)
+        if old is not None and old["Version"] == dsc["Version"]:
+            for f in old["Files"]:
+                if f["name"] == os.path.basename(path):
+                    if f["md5sum"] != file_checksums(path)["MD5Sum"]:
+                        raise RepoIndexError(f"{name} {dsc['Version']} is "
+                                             f"already in {attr.codename} "
+                                             "with a different content")
+
+        for f in dsc["Files"]:
+            self._add_file(os.path.join(dscdir, f["name"]), directory)
+        _, checksums = self._add_file(path, directory)
+        size = str(os.path.getsize(path))
+        dscname = os.path.basename(path)
+
+        para = Sources()
+        para["Package"] = name
+        for key, value in dsc.items():
+            if key not in ("Source", "Files",
+                           "Checksums-Sha1", "Checksums-Sha256"):
+                para[key] = value
+        para.setdefault("Priority", "normal")
+        para.setdefault("Section", "misc")
+        para["Directory"] = directory
+        para["Files"] = [{"md5sum": checksums["MD5Sum"],
+                          "size": size,
+                          "name": dscname}] + dsc["Files"]
+        para["Checksums-Sha1"] = [{"sha1": checksums["SHA1"],
+                                   "size": size,
+                                   "name": dscname}] + \
+            dsc.get("Checksums-Sha1", [])
+        para["Checksums-Sha256"] = [{"sha256": checksums["SHA256"],
+                                     "size": size,
+                                     "name": dscname}] + \
+            dsc.get("Checksums-Sha256", [])
+
+        srcs = self.sources.setdefault((attr.codename, component), {})
+        old = srcs.get(name)
+        srcs[name] = para
+
+        if old is not None and old["Directory"] == directory:
+            self._remove_files(f"{directory}/{f['name']}" for f in old["Files"])
+
+    def include_changes(self, path, attr, components=None):
+        """Include the .deb and .dsc files listed in a .changes file"""
+        dirname = os.path.dirname(path)
+        with open(path, "r", encoding="utf-8") as f:
+            changes = Changes(f)
+
+        for f in changes["Files"]:
+            fname = os.path.join(dirname, f["name"])
+            if fname.endswith(".dsc"):
+                self.includedsc(fname, attr, components)
+            elif fname.endswith((".deb", ".udeb")):
+                self.includedeb(fname, attr, components)
+
+    def removedeb(self, codename, pkgname, components=None):
+        removed = []
+        for (cn, component, _), pkgs in self.packages.items():
+            if cn != codename or pkgname not in pkgs:
+                continue
+            if components is not None and \
+               component.split("/")[0] not in components:
+                continue
+            removed.append(pkgs.pop(pkgname)["Filename"])
+
+        self._remove_files(removed)
+
+    def removesrc(self, codename, srcname, components=None):
+        removed = []
+        for (cn, component), srcs in self.sources.items():
+            if cn != codename or srcname not in srcs:
+                continue
+            if components is not None and component not in components:
+                continue
+            para = srcs.pop(srcname)
+            removed += [f"{para['Directory']}/{f['name']}"
+                        for f in para["Files"]]
+
+        self._remove_files(removed)
+
+    def load(self, attrs):
+        """Read the index of an already exported repository volume"""
+        for attr in attrs:
+            for component in attr.components:
+                for arch in attr.arch:
+                    if arch == "source":
+                        index = f"dists/{attr.codename}/{component}/source/Sources"
+                        if not self.fs.exists(index):
+                            continue
+                        with self.fs.open(index, "r") as f:
+                            srcs = {p["Package"]: p
+                                    for p in Sources.iter_paragraphs(f)}
+                        self.sources[(attr.codename, component)] = srcs
+                        continue
+
+                    for comp in (component, f"{component}/debian-installer"):
+                        index = (f"dists/{attr.codename}/{comp}/"
+                                 f"binary-{arch}/Packages")
+                        if not self.fs.exists(index):
+                            continue
+                        with self.fs.open(index, "r") as f:
+                            pkgs = {p["Package"]: p
+                                    for p in Packages.iter_paragraphs(f)}
+                        self.packages[(attr.codename, comp, arch)] = pkgs
+
+    def _write_index(self, directory, basename, paragraphs, release):
+        content = "\n".join(p.dump() for p in paragraphs).encode("utf-8")
+
+        self.fs.mkdir_p(directory)
+        with self.fs.open(f"{directory}/{basename}", "wb") as f:
+            f.write(content)
+        with self.fs.open(f"{directory}/{basename}.gz", "wb") as f:
+            f.write(gzip.compress(content, mtime=0))
+        self.fs.write_file(f"{directory}/Release", 0o644, release.dump())
+
+    def export(self, attrs, origin, description):
+        """Write the indices and return the Release files written"""
+
+        # pylint: disable=too-many-locals
+
+        date = time.strftime("%a, %d %b %Y %H:%M:%S UTC", time.gmtime())
+        releases = []
+
+        for attr in attrs:
+            dist = f"dists/{attr.codename}"
+            components = sorted(attr.components)
+            binarchs = sorted(attr.arch - {"source"})
+
+            indexdirs = []
+
+            for component in components:
+                for arch in binarchs:
+                    comps = [component]
+                    if (attr.codename, f"{component}/debian-installer",
+                            arch) in self.packages:
+                        comps.append(f"{component}/debian-installer")
+                    for comp in comps:
+                        pkgs = self.packages.get((attr.codename, comp, arch), {})
+                        directory = f"{dist}/{comp}/binary-{arch}"
+                        release = Deb822()
+                        release["Component"] = component
+                        release["Architecture"] = arch
+                        self._write_index(directory, "Packages",
+                                          [pkgs[p] for p in sorted(pkgs)],
+                                          release)
+                        indexdirs.append((directory, "Packages"))
+
+                if "source" in attr.arch:
+                    srcs = self.sources.get((attr.codename, component), {})
+                    directory = f"{dist}/{component}/source"
+                    release = Deb822()
+                    release["Component"] = component
+                    release["Architecture"] = "source"
+                    self._write_index(directory, "Sources",
+                                      [srcs[p] for p in sorted(srcs)],
+                                      release)
+                    indexdirs.append((directory, "Sources"))
+
+            files = []
+            for directory, basename in indexdirs:
+                for fname in (basename, f"{basename}.gz", "Release"):
+                    path = f"{directory}/{fname}"
+                    files.append((path[len(dist) + 1:],
+                                  self.fs.stat(path).st_size,
+                                  file_checksums(self.fs.fname(path))))
+
+            release = Deb822()
+            release["Origin"] = origin
+            release["Label"] = origin
+            release["Codename"] = attr.codename
+            release["Date"] = date
+            release["Architectures"] = " ".join(binarchs)
+            release["Components"] = " ".join(components)
+            release["Description"] = description
+            for field in ("MD5Sum", "SHA1", "SHA256"):
+                release[field] = "".join(
+                    f"\n {sums[field]} {size:>16} {fname}"
+                    for fname, size, sums in files)
+
+            self.fs.remove(f"{dist}/InRelease", noerr=True)
+            self.fs.remove(f"{dist}/Release.gpg", noerr=True)
+            self.fs.write_file(f"{dist}/Release", 0o644, release.dump())
+            releases.append(self.fs.fname(f"{dist}/Release"))
+
+        return releases
@@ -10,6 +10,8 @@ from debian.deb822 import Deb822
 from elbepack.filesystem import Filesystem
 from elbepack.pkgutils import get_dsc_size
 from elbepack.egpg import generate_elbe_internal_key, export_key, unlock_key
+from elbepack.egpg import sign_release
+from elbepack.repoindex import get_attr, open_index
 from elbepack.shellhelper import CommandError, do
 
 class RepoAttributes:
@@ -45,6 +47,18 @@ class RepoBase:
 
     # pylint: disable=too-many-instance-attributes
 
+    # Upper bound of what an include adds to a volume besides the
+    # package files themselves, i.e. new pool directories and the
+    # growth of the reprepro database.
+    include_overhead = 64 * 1024
+
+    # Maximum number of files passed to a single reprepro call
+    include_batch_size = 256
+
+    # Write the indices in-process instead of keeping a reprepro
+    # database.  Only useful for repositories, that are written once.
+    native_index = False
+
     def __init__(
             self,
             path,
@@ -52,7 +66,8 @@ class RepoBase:
             repo_attr,
             origin,
             description,
-            maxsize=None):
+            maxsize=None,
+            native=None):
 
         # pylint: disable=too-many-arguments
 
@@ -74,6 +89,21 @@ class RepoBase:
         self.maxsize = maxsize
         self.fs = self.get_volume_fs(self.volume_count)
 
+        # Running size of the current volume, seeded on demand
+        self.volume_size = None
+
+        if native is None:
+            native = self.native_index
+
+        # The debian-installer components are fetched with
+        # 'reprepro update', which needs the reprepro database
+        if any('main/debian-installer' in att.components
+               for att in self.attrs):
+            native = False
+
+        self.native = native
+        self.index = open_index(self.fs, self.attrs) if native else None
+
         # if repo exists retrive the keyid otherwise
         # generate a new key and generate repository config
         if self.fs.isdir("/"):
@@ -101,10 +131,46 @@ class RepoBase:
         return Filesystem(self.vol_path)
 
     def new_repo_volume(self):
+        # The current volume is complete, nothing is added to it
+        # anymore
+        if self.index is not None:
+            self._export_index()
+
         self.volume_count += 1
         self.fs = self.get_volume_fs(self.volume_count)
+        self.volume_size = None
+        if self.native:
+            self.index = open_index(self.fs, self.attrs)
         self.gen_repo_conf()
 
+    def _export_index(self):
+        for release in self.index.export(self.attrs,
+                                         self.origin,
+                                         self.description):
+            sign_release(release, self.keyid)
+
+    def fits_volume(self, size):
+        """Check whether size bytes can be added to the current volume
+
+        The running volume size is an upper bound of the actual size.
+        Only if it says that size does not fit anymore, the size is
+        recomputed exactly.  Thus, the volume is only walked a few
+        times, when it is nearly full.
+        """
+        if self.volume_size is None:
+            self.volume_size = self.fs.disk_usage("")
+
+        if self.volume_size + size <= self.maxsize:
+            return True
+
+        self.volume_size = self.fs.disk_usage("")
+
+        return self.volume_size + size <= self.maxsize
+
+    def account_volume(self, size):
+        if self.volume_size is not None:
+            self.volume_size += size + self.include_overhead
+
     def gen_repo_conf(self):
         self.fs.mkdir_p("conf")
         fp = self.fs.open("conf/distributions", "w")
@@ -159,21 +225,29 @@ class RepoBase:
         if need_update:
             cmd = f'reprepro --export=force --basedir "{self.fs.path}" update'
             do(cmd, env_add={'GNUPGHOME': "/var/cache/elbe/gnupg"})
+        elif self.index is not None:
+            self._export_index()
         else:
             for att in self.attrs:
                 do(f'reprepro --basedir "{self.fs.path}" export {att.codename}',
                    env_add={'GNUPGHOME': "/var/cache/elbe/gnupg"})
 
     def finalize(self):
+        if self.index is not None:
+            self._export_index()
+            return
+
         for att in self.attrs:
             cmd = f'reprepro --basedir "{self.fs.path}" export {att.codename}'
             do(cmd, env_add={'GNUPGHOME': '/var/cache/elbe/gnupg'})
 
-    def _includedeb(self, path, codename, components=None, prio=None):
-        if self.maxsize:
-            new_size = self.fs.disk_usage("") + os.path.getsize(path)
-            if new_size > self.maxsize:
-                self.new_repo_volume()
+    def _includedebs(self, paths, codename, components=None, prio=None):
+
+        if self.index is not None:
+            att = get_attr(self.attrs, codename)
+            for path in paths:
+                self.index.includedeb(path, att, components, prio)
+            return
 
         global_opt = ["--keepunreferencedfiles",
                       "--export=never",
@@ -189,8 +263,20 @@ class RepoBase:
             global_opt.append(f'--component "{"|".join(components)}"')
 
         global_opt = ' '.join(global_opt)
+        files = ' '.join(f'"{path}"' for path in paths)
+
+        do(f"reprepro {global_opt} includedeb {codename} {files}")
 
-        do(f"reprepro {global_opt} includedeb {codename} {path}")
+    def _includedeb(self, path, codename, components=None, prio=None):
+        if self.maxsize:
+            size = os.path.getsize(path)
+            if not self.fits_volume(size):
+                self.new_repo_volume()
+
+        self._includedebs([path], codename, components, prio)
+
+        if self.maxsize:
+            self.account_volume(size)
 
     def includedeb(self, path, components=None, pkgname=None, force=False, prio=None):
         # pkgname needs only to be specified if force is enabled
@@ -212,8 +298,89 @@ class RepoBase:
             else:
                 raise ce
 
+    def _include_batch(self, batch, components, prio, force, failed):
+
+        try:
+            self._includedebs([path for path, _ in batch],
+                              self.repo_attr.codename,
+                              components, prio)
+        except CommandError:
+            # Some of the files could not be included.  reprepro
+            # skips files that are already included with the same
+            # content, so just include them one after the other, to
+            # find the conflicting ones.
+            for path, _ in batch:
+                pkgname = os.path.basename(path).split('_')[0]
+                try:
+                    self.includedeb(path, components, pkgname, force, prio)
+                except CommandError as ce:
+                    failed[path] = ce
+        else:
+            if self.maxsize:
+                for _, size in batch:
+                    self.account_volume(size)
+
+    def include_many(self, paths, components=None, prio_map=None, force=False):
+        """Include .deb files with as few reprepro calls as possible
+
+        The files are grouped by their priority from prio_map, which
+        maps a path to a priority.  If a reprepro call fails, the files
+        of the batch are included one by one and with force, only the
+        conflicting ones are removed and added again.
+
+        Returns a dict mapping the path of every file that could not
+        be included to its CommandError.
+        """
+
+        # pylint: disable=too-many-arguments
+
+        if prio_map is None:
+            prio_map = {}
+
+        groups = {}
+        for path in paths:
+            groups.setdefault(prio_map.get(path), []).append(path)
+
+        failed = {}
+
+        for prio, group in groups.items():
+            batch = []
+            batch_size = 0
+
+            for path in group:
+                size = os.path.getsize(path) if self.maxsize else 0
+
+                if self.maxsize and not self.fits_volume(batch_size + size):
+                    if batch:
+                        self._include_batch(batch, components, prio,
+                                            force, failed)
+                        batch = []
+                        batch_size = 0
+                    if not self.fits_volume(size):
+                        self.new_repo_volume()
+
+                batch.append((path, size))
+                batch_size += size
+
+                if len(batch) >= self.include_batch_size:
+                    self._include_batch(batch, components, prio,
+                                        force, failed)
+                    batch = []
+                    batch_size = 0
+
+            if batch:
+                self._include_batch(batch, components, prio, force, failed)
+
+        return failed
+
     def _include(self, path, codename, components=None):
 
+        if self.index is not None:
+            self.index.include_changes(path, get_attr(self.attrs, codename),
+                                       components)
+            self.volume_size = None
+            return
+
         global_opt = ["--ignore=wrongdistribution",
                       "--ignore=surprisingbinary",
                       "--keepunreferencedfiles",
@@ -232,8 +399,18 @@ class RepoBase:
 
         do(f"reprepro {global_opt} include {codename} {path}")
 
+        # The size of the included files is unknown here, so the
+        # volume size has to be computed again
+        self.volume_size = None
+
     def _removedeb(self, pkgname, codename, components=None):
 
+        if self.index is not None:
+            if isinstance(components, str):
+                components = [components]
+            self.index.removedeb(codename, pkgname, components)
+            return
+
         global_opt = [f'--basedir "{self.fs.path}"']
 
         if components is not None:
@@ -252,6 +429,12 @@ class RepoBase:
 
     def _removesrc(self, srcname, codename, components=None):
 
+        if self.index is not None:
+            if isinstance(components, str):
+                components = [components]
+            self.index.removesrc(codename, srcname, components)
+            return
+
         global_opt = [f"--basedir {self.fs.path}"]
 
         if components is not None:
@@ -289,13 +472,32 @@ class RepoBase:
 
     def _includedsc(self, path, codename, components=None):
         if self.maxsize:
-            new_size = self.fs.disk_usage("") + get_dsc_size(path)
-            if new_size > self.maxsize:
+            size = get_dsc_size(path)
+            if not self.fits_volume(size):
                 self.new_repo_volume()
 
-        if self.maxsize and (self.fs.disk_usage("") > self.maxsize):
+        if self.maxsize and not self.fits_volume(0):
             self.new_repo_volume()
 
+        self._includedscs([path], codename, components)
+
+        if self.maxsize:
+            self.account_volume(size)
+
+    def _includedscs(self, paths, codename, components=None):
+
+        if self.index is not None:
+            att = get_attr(self.attrs, codename)
+            for path in paths:
+                self.index.includedsc(path, att, components)
+            return
+
+        # reprepro takes only a single .dsc file per includedsc call
+        for path in paths:
+            self._reprepro_includedsc(path, codename, components)
+
+    def _reprepro_includedsc(self, path, codename, components=None):
+
         global_opt = ["--keepunreferencedfiles",
                       "--export=never",
                       f'--basedir "{self.fs.path}"',
@@ -327,6 +529,73 @@ class RepoBase:
             else:
                 raise ce
 
+    def _includedsc_batch(self, batch, codename, components, include_one,
+                          failed):
+
+        # pylint: disable=too-many-arguments
+
+        try:
+            self._includedscs([path for path, _ in batch], codename,
+                              components)
+        except CommandError:
+            # Find the conflicting files one after the other, the ones
+            # already included are skipped with the same content
+            for path, _ in batch:
+                try:
+                    include_one(path)
+                except CommandError as ce:
+                    failed[path] = ce
+        else:
+            if self.maxsize:
+                for _, size in batch:
+                    self.account_volume(size)
+
+    def _includedsc_many(self, paths, codename, components, include_one):
+        failed = {}
+        batch = []
+        batch_size = 0
+
+        for path in paths:
+            size = get_dsc_size(path) if self.maxsize else 0
+
+            if self.maxsize and not self.fits_volume(batch_size + size):
+                if batch:
+                    self._includedsc_batch(batch, codename, components,
+                                           include_one, failed)
+                    batch = []
+                    batch_size = 0
+                if not self.fits_volume(size):
+                    self.new_repo_volume()
+
+            batch.append((path, size))
+            batch_size += size
+
+            if len(batch) >= self.include_batch_size:
+                self._includedsc_batch(batch, codename, components,
+                                       include_one, failed)
+                batch = []
+                batch_size = 0
+
+        if batch:
+            self._includedsc_batch(batch, codename, components,
+                                   include_one, failed)
+
+        return failed
+
+    def includedsc_many(self, paths, components=None, force=False):
+        """Include .dsc files in batches
+
+        Like include_many(), the volume is checked once per batch.  If
+        a batch fails, its files are included one by one and with
+        force, only the conflicting ones are removed and added again.
+
+        Returns a dict mapping the path of every file that could not
+        be included to its CommandError.
+        """
+        return self._includedsc_many(
+            paths, self.repo_attr.codename, components,
+            lambda path: self.includedsc(path, components, force))
+
     def include(self, path, components=None, force=False):
         if force:
             self._remove(path, self.repo_attr.codename, components)
@@ -338,6 +607,15 @@ class RepoBase:
     def include_init_dsc(self, path, components=None):
         self._includedsc(path, self.init_attr.codename, components)
 
+    def include_init_dsc_many(self, paths, components=None):
+        """Include .dsc files into the initvm distribution in batches
+
+        Returns a dict like includedsc_many().
+        """
+        return self._includedsc_many(
+            paths, self.init_attr.codename, components,
+            lambda path: self.include_init_dsc(path, components))
+
     def buildiso(self, fname, options=""):
         files = []
         if self.volume_count == 0:
@@ -394,6 +672,9 @@ class CdromInitRepo(RepoBase):
 
 
 class CdromBinRepo(RepoBase):
+
+    native_index = True
+
     def __init__(
             self,
             arch,
@@ -421,6 +702,9 @@ class CdromBinRepo(RepoBase):
 
 
 class CdromSrcRepo(RepoBase):
+
+    native_index = True
+
     def __init__(self, codename, init_codename, path, maxsize,
                  mirror='http://ftp.debian.org/debian'):
 
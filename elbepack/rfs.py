@@ -10,6 +10,7 @@ from urllib.parse import urlsplit
 
 from elbepack.efilesystem import BuildImgFs
 from elbepack.egpg import unarmor_openpgp_keyring
+from elbepack.pkgstore import PackageStore
 from elbepack.templates import (write_pack_template, get_preseed,
                                 preseed_to_text)
 from elbepack.shellhelper import CommandError, do, chroot, get_command_out
@@ -142,6 +143,22 @@ class BuildEnv:
 
     def debootstrap(self, arch="default"):
 
+        if arch == "default":
+            arch = self.xml.text("project/buildimage/arch", key="arch")
+
+        try:
+            store = PackageStore()
+        except OSError as e:
+            logging.warning("Package store not available: %s", e)
+            self._debootstrap(arch)
+            return
+
+        # Let debootstrap reuse the packages of former builds
+        with store.debootstrap_cache(arch) as cachedir:
+            self._debootstrap(arch, cachedir)
+
+    def _debootstrap(self, arch, cachedir=None):
+
         # pylint: disable=too-many-statements
         # pylint: disable=too-many-branches
 
@@ -170,13 +187,13 @@ class BuildEnv:
 
         logging.info("Debootstrap log")
 
-        if arch == "default":
-            arch = self.xml.text("project/buildimage/arch", key="arch")
-
         host_arch = get_command_out("dpkg --print-architecture").strip().decode()
 
         strapcmd  = "debootstrap"
 
+        if cachedir is not None:
+            strapcmd += f' --cache-dir="{cachedir}"'
+
         # Should we use a special bootstrap variant?
         if self.xml.has("target/debootstrap/variant"):
             strapcmd += f" --variant={self.xml.text('target/debootstrap/variant')}"
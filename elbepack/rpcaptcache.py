@@ -2,22 +2,31 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # SPDX-FileCopyrightText: 2014-2018 Linutronix GmbH
 
+import glob
+import hashlib
 import logging
 import os
 import sys
+import threading
 import time
 
 from multiprocessing.util import Finalize
-from multiprocessing.managers import BaseManager
+from multiprocessing.managers import BaseManager, BaseProxy
 
-from apt_pkg import config, version_compare, TagFile, SourceRecords, Acquire, AcquireFile
+from apt_pkg import config, version_compare, TagFile, ProblemResolver
 from apt import Cache
 from apt.package import FetchError
 
+from elbepack.aptlists import ListsCache, read_sources
 from elbepack.aptprogress import (ElbeAcquireProgress, ElbeInstallProgress,
                                   ElbeOpProgress)
-from elbepack.aptpkgutils import getalldeps, APTPackage, fetch_binary
+from elbepack.aptpkgutils import (APTPackage, fetch_binary, fetch_binaries,
+                                  fetch_sources, PackageSnapshot,
+                                  DependencyGraph, append_hashes)
+from elbepack.config import cfg
 from elbepack.log import async_logging
+from elbepack.pkgsearch import NameIndex
+from elbepack.pkgstore import PackageStore
 
 
 log = logging.getLogger("log")
@@ -28,10 +37,10 @@ class MyMan(BaseManager):
 
     # pylint: disable=arguments-differ
     @staticmethod
-    def register(typeid):
+    def register(typeid, proxytype=None):
         """Register to BaseManager through decorator"""
         def _register(cls):
-            BaseManager.register(typeid, cls)
+            BaseManager.register(typeid, cls, proxytype)
             return cls
         return _register
 
@@ -62,14 +71,53 @@ class InChRootObject:
         self.finalizer = Finalize(self, self.rfs.leave_chroot, exitpriority=10)
 
 
-@MyMan.register("RPCAPTCache")
+class RPCAPTCacheProxy(BaseProxy):
+    """Proxy for all public methods of a RPCAPTCache
+
+    Package snapshots with lazy hashes get the server as their hash
+    source again, after they were unpickled.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def method(*args, **kwds):
+            ret = self._callmethod(name, args, kwds)
+            if isinstance(ret, PackageSnapshot) and ret.lazy_hashes:
+                ret.hash_source = self._get_hashes
+            return ret
+        return method
+
+    def _get_hashes(self, *args):
+        return self._callmethod("get_hashes", args)
+
+
+@MyMan.register("RPCAPTCache", RPCAPTCacheProxy)
 class RPCAPTCache(InChRootObject):
 
     # pylint: disable=too-many-public-methods
+    # pylint: disable=too-many-instance-attributes
     def __init__(self, rfs, arch,
                  notifier=None, norecommend=False, noauth=True):
 
         # pylint: disable=too-many-arguments
+
+        # The package and lists stores have to be opened outside of
+        # the chroot
+        try:
+            self.store = PackageStore()
+        except OSError as e:
+            print(f"Package store not available: {e}")
+            self.store = None
+        try:
+            self.lists = ListsCache()
+        except OSError as e:
+            print(f"Lists cache not available: {e}")
+            self.lists = None
+
         InChRootObject.__init__(self, rfs)
 
         self.notifier = notifier
@@ -84,8 +132,116 @@ class RPCAPTCache(InChRootObject):
         else:
             config.set("APT::Get::AllowUnauthenticated", "0")
 
+        # Package snapshots are kept until the cache is modified
+        self.generation = 0
+        self.snapshots = {}
+        self.depgraph = None
+        self.search_index = None
+        self.srcindex = None
+
+        # Creating the apt.Cache opens it already
+        self.opens = 0
+        self.stamp = None
+        start = time.monotonic()
         self.cache = Cache(progress=ElbeOpProgress())
+        self._opened(start)
+
+    @staticmethod
+    def _stamp():
+        """Return the state of the files apt reads its cache from"""
+        stamp = []
+        for path in ('/var/lib/dpkg/status', '/var/lib/apt/lists'):
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stamp.append(None)
+        return stamp
+
+    def _open(self):
+        start = time.monotonic()
         self.cache.open(progress=ElbeOpProgress())
+        self._opened(start)
+
+    def _opened(self, start):
+        self.opens += 1
+        self.stamp = self._stamp()
+        self.search_index = None
+        print(f"Opened apt cache in {time.monotonic() - start:.2f}s "
+              f"({self.opens} opens by this cache server)")
+
+    @staticmethod
+    def root_id():
+        """Return (st_dev, st_ino) of the chroot this server runs in"""
+        st = os.stat('/')
+        return (st.st_dev, st.st_ino)
+
+    def reopen(self):
+        """Reopen the apt cache, keeping the server process"""
+        self._changed()
+        self._open()
+
+    def refresh(self):
+        """Reopen the apt cache, if dpkg or the package lists changed
+
+        Returns True, if the cache was reopened.
+        """
+        if self._stamp() == self.stamp:
+            return False
+        self.reopen()
+        return True
+
+    def reuse(self, notifier=None):
+        """Prepare a pooled server for a new user
+
+        Pending changes belong to another user of the server, which
+        still works with them.  Such a server is not reused and False
+        is returned.  Otherwise the cache is brought up to date, like
+        in a newly started server.
+        """
+        if self.cache.install_count or self.cache.delete_count:
+            return False
+        self.notifier = notifier
+        self.refresh()
+        return True
+
+    def _changed(self):
+        self.generation += 1
+        self.snapshots.clear()
+        self.depgraph = None
+        self.srcindex = None
+
+    def _depgraph(self):
+        if self.depgraph is None:
+            self.depgraph = DependencyGraph(self.cache)
+        return self.depgraph
+
+    def _snapshot(self, kind, section, select, hashes):
+        key = (kind, section)
+        snap = self.snapshots.get(key)
+        if snap is None:
+            pkgs = (p for p in self.cache if select(p) and
+                    section in ('all', p.section))
+            snap = PackageSnapshot.from_packages(pkgs, self.generation,
+                                                 hashes=False)
+            self.snapshots[key] = snap
+        if hashes:
+            return snap.with_lazy_hashes(self.get_hashes)
+        return snap
+
+    def get_hashes(self, names, installed_versions, candidate_versions):
+        """Return the hash columns of a PackageSnapshot
+
+        The hashes are looked up for the given versions of the packages.
+        """
+        hashes = {field: [] for field in PackageSnapshot.hash_fields}
+        for name, iver, cver in zip(names, installed_versions,
+                                    candidate_versions):
+            versions = self.cache[name].versions
+            append_hashes(hashes,
+                          iver and versions.get(iver),
+                          cver and versions.get(cver))
+        return hashes
 
     def dbg_dump(self, filename):
         ts = time.localtime()
@@ -105,16 +261,18 @@ class RPCAPTCache(InChRootObject):
         ret.sort()
         return ret
 
-    def get_pkglist(self, section):
-        if section == 'all':
-            ret = [APTPackage(p) for p in self.cache]
-        else:
-            ret = [APTPackage(p) for p in self.cache if p.section == section]
+    def get_pkglist(self, section, hashes=True):
+        """Return a PackageSnapshot of all packages in section
 
-        return ret
+        The snapshot replaces the former list of APTPackage.  With
+        hashes, the md5 and sha256 of a package are looked up on the
+        first access to one of them.
+        """
+        return self._snapshot("all", section, lambda p: True, hashes)
 
     def mark_install(self, pkgname, version, from_user=True, nodeps=False):
         print(f'Mark for install "{pkgname}"')
+        self._changed()
         p = self.cache[pkgname]
         if version:
             p.candidate = p.versions[version]
@@ -122,90 +280,187 @@ class RPCAPTCache(InChRootObject):
                        auto_inst=not nodeps,
                        from_user=from_user)
 
+    def _mark_install_batch(self, pkgs, versions):
+        """Mark pkgs for installation without running the resolver
+
+        The candidate of a package is set to the version of its
+        counterpart in versions, if available.  Returns the number of
+        resolver runs, that marking the packages one by one would have
+        needed.
+        """
+        # pylint: disable=protected-access
+        depcache = self.cache._depcache
+        runs = 0
+
+        for pkg, counterpart in pkgs:
+            version = versions.get(counterpart)
+            if version:
+                candidate = pkg.versions.get(version)
+                if candidate:
+                    pkg.candidate = candidate
+
+            broken = depcache.broken_count
+            pkg.mark_install(auto_fix=False)
+            if depcache.broken_count > broken:
+                runs += 1
+
+        return runs
+
+    def _resolve(self, pkgs):
+        """Fix broken dependencies, keeping the marks of pkgs"""
+        # pylint: disable=protected-access
+        depcache = self.cache._depcache
+        if depcache.broken_count == 0:
+            return 0
+
+        fix = ProblemResolver(depcache)
+        for pkg in pkgs:
+            fix.clear(pkg._pkg)
+            fix.protect(pkg._pkg)
+        fix.resolve(True)
+        return 1
+
     def mark_install_devpkgs(self, ignore_pkgs, ignore_dev_pkgs):
 
+        # pylint: disable=too-many-locals
+        # pylint: disable=too-many-branches
+
+        self._changed()
+
         # we don't want to ignore libc
         ignore_pkgs.discard('libc6')
         ignore_pkgs.discard('libstdc++5')
         ignore_pkgs.discard('libstdc++6')
 
-        # list all debian src packages of all installed packages that
-        # don't come from debootstrap
-        src_name_lst = []
+        # Index the cache in a single pass: the versions of all
+        # installed packages that don't come from debootstrap and of
+        # their sources, the -dev packages by source package and all
+        # -dbgsym packages
         version_dict = {}
+        dev_idx = {}
+        dbgsym_names = []
 
         for pkg in self.cache:
-            if pkg.is_installed and pkg.name not in ignore_pkgs:
-                src_name = pkg.candidate.source_name
-                src_name_lst.append(src_name)
-                version_dict[pkg.name] = pkg.candidate.version
-                version_dict[src_name] = pkg.candidate.version
-
-        def mark_install(pkg_lst, suffix):
-
-            for pkg in pkg_lst:
-
-                if pkg.name in ignore_dev_pkgs:
+            name = pkg.name
+
+            if pkg.is_installed and name not in ignore_pkgs:
+                version_dict[name] = pkg.candidate.version
+                version_dict[pkg.candidate.source_name] = pkg.candidate.version
+
+            if name.endswith("-dev") and pkg.candidate:
+                dev_idx.setdefault(pkg.candidate.source_name, []).append(
+                    (pkg, pkg.candidate.source_version))
+            elif name.endswith("-dbgsym"):
+                dbgsym_names.append(name)
+
+        # remember the -dev packages, which are built from the same
+        # source version as one of the installed packages
+        dev_lst = [(pkg, pkg.name[:-len("-dev")])
+                   for src_name, pkgs in dev_idx.items()
+                   if src_name in version_dict
+                   for pkg, src_version in pkgs
+                   if src_version == version_dict[src_name]
+                   and pkg.name not in ignore_dev_pkgs]
+
+        # Every mark_install() would run the resolver and the cleanup
+        # of its action group, mark everything first and resolve once
+        # per stage instead
+        marked = [pkg for pkg, _ in dev_lst]
+        with self.cache.actiongroup():
+            runs = self._mark_install_batch(dev_lst, version_dict)
+
+            # ensure that the symlinks package will be installed (it's
+            # needed for fixing links inside the sysroot
+            symlinks = self.cache['symlinks']
+            runs += self._mark_install_batch([(symlinks, None)], {})
+            marked.append(symlinks)
+
+            # pylint: disable=protected-access
+            for name in ignore_dev_pkgs:
+                broken = self.cache._depcache.broken_count
+                self.cache[name].mark_delete(auto_fix=False)
+                if self.cache._depcache.broken_count > broken:
+                    runs += 1
+
+            resolved = self._resolve(marked)
+
+            dbgsym_lst = []
+            for name in dbgsym_names:
+                base = name[:-len("-dbgsym")]
+                if base not in self.cache:
                     continue
+                pkg = self.cache[base]
+                if (pkg.is_installed or pkg.marked_install) and \
+                   name not in ignore_dev_pkgs:
+                    dbgsym_lst.append((self.cache[name], base))
+
+            runs += self._mark_install_batch(dbgsym_lst, version_dict)
+            resolved += self._resolve(marked + [pkg for pkg, _ in dbgsym_lst])
+
+        print(f"Marked {len(marked) + len(dbgsym_lst)} development and debug "
+              f"packages in one action group, {resolved} resolver runs "
+              f"instead of {runs}")
+
+    def plan_install(self, pkgnames, dry_run=True):
+        """Mark pkgnames for installation and resolve once
+
+        All packages are marked inside one action group, the problem
+        resolver runs a single time afterwards.  Returns a dict with
+        the sorted 'install', 'upgrade' and 'remove' lists of
+        "name-version" strings, the 'missing' package names, the
+        'conflicts' the resolver could not fix, the 'download_size'
+        and the 'install_size' in bytes.
+
+        With dry_run, the marks are cleared again, otherwise they are
+        kept for a following commit().
+        """
+        self._changed()
 
-                name_no_suffix = pkg.name[:-len(suffix)]
-
-                if name_no_suffix in version_dict:
-
-                    version   = version_dict[name_no_suffix]
-                    candidate = pkg.versions.get(version)
-
-                    if candidate:
-                        pkg.candidate = candidate
-
-                pkg.mark_install()
-
-        # go through all packages, remember package if its source
-        # package matches one of the installed packages and the binary
-        # package is a '-dev' package
-        dev_lst = []
-
-        for pkg in self.cache:
-
-            if not pkg.name.endswith("-dev"):
-                continue
-
-            src_name = pkg.candidate.source_name
-
-            if src_name not in version_dict:
-                continue
-
-            src_version = pkg.candidate.source_version
-
-            if src_version != version_dict[src_name]:
-                continue
-
-            dev_lst.append(pkg)
-
-        mark_install(dev_lst, "-dev")
-
-        # ensure that the symlinks package will be installed (it's
-        # needed for fixing links inside the sysroot
-        self.cache['symlinks'].mark_install()
+        missing = []
+        marked = []
+        conflicts = []
 
-        for pkg in ignore_dev_pkgs:
-            self.cache[pkg].mark_delete()
+        with self.cache.actiongroup():
+            for name in pkgnames:
+                if name not in self.cache:
+                    missing.append(name)
+                    continue
+                pkg = self.cache[name]
+                pkg.mark_install(auto_fix=False)
+                marked.append(pkg)
 
-        dbgsym_lst = []
+            try:
+                self._resolve(marked)
+            except SystemError as e:
+                print(f"Unable to correct problems: {e}")
 
-        for pkg in self.cache:
+        # pylint: disable=protected-access
+        if self.cache._depcache.broken_count:
+            conflicts = sorted(p.name for p in self.cache if p.is_inst_broken)
 
-            if pkg.is_installed or pkg.marked_install:
+        plan = {"install": [], "upgrade": [], "remove": [],
+                "missing": sorted(missing), "conflicts": conflicts,
+                "download_size": self.cache.required_download,
+                "install_size": self.cache.required_space}
 
-                dbg_pkg = f"{pkg.name}-dbgsym"
+        for p in self.cache.get_changes():
+            if p.marked_delete:
+                plan["remove"].append(f"{p.name}-{p.installed.version}")
+            elif p.marked_upgrade or p.marked_downgrade:
+                plan["upgrade"].append(f"{p.name}-{p.candidate.version}")
+            elif p.marked_install or p.marked_reinstall:
+                plan["install"].append(f"{p.name}-{p.candidate.version}")
 
-                if dbg_pkg in self.cache:
-                    dbgsym_lst.append(self.cache[dbg_pkg])
+        for key in ("install", "upgrade", "remove"):
+            plan[key].sort()
 
-        mark_install(dbgsym_lst, "-dbgsym")
+        if dry_run:
+            self.clear()
 
+        return plan
 
     def cleanup(self, exclude_pkgs):
+        self._changed()
         for p in self.cache:
             if p.is_installed and not \
                p.is_auto_installed or \
@@ -218,71 +473,83 @@ class RPCAPTCache(InChRootObject):
                     p.mark_delete(auto_fix=True, purge=True)
 
     def mark_upgrade(self, pkgname, version):
+        self._changed()
         p = self.cache[pkgname]
         if version:
             p.candidate = p.versions[version]
         p.mark_upgrade()
 
     def mark_delete(self, pkgname):
+        self._changed()
         p = self.cache[pkgname]
         p.mark_delete(purge=True)
 
     def mark_keep(self, pkgname, _version):
+        self._changed()
         p = self.cache[pkgname]
         p.mark_keep()
 
     def update(self):
+        self._changed()
+
+        listsdir = config.find_dir("Dir::State::Lists")
+        if self.lists is not None:
+            sources = read_sources(
+                [config.find_file("Dir::Etc::SourceList")] +
+                glob.glob(os.path.join(config.find_dir("Dir::Etc::SourceParts"),
+                                       "*.list")))
+            try:
+                seeded = self.lists.seed(listsdir, sources)
+                print(f"Using {seeded} package lists from the lists cache")
+            except OSError as e:
+                print(f"Can not use the lists cache: {e}")
+
         self.cache.update(fetch_progress=ElbeAcquireProgress())
-        self.cache.open(progress=ElbeOpProgress())
+
+        if self.lists is not None:
+            try:
+                self.lists.collect(listsdir)
+            except OSError as e:
+                print(f"Can not add package lists to the lists cache: {e}")
+
+        self._open()
 
     def commit(self):
         os.environ["DEBIAN_FRONTEND"] = "noninteractive"
         os.environ["DEBONF_NONINTERACTIVE_SEEN"] = "true"
         print("Commiting changes ...")
+        self._changed()
         self.cache.commit(ElbeAcquireProgress(),
                           ElbeInstallProgress(fileno=sys.stdout.fileno()))
-        self.cache.open(progress=ElbeOpProgress())
+        self._open()
 
     def clear(self):
+        self._changed()
         self.cache.clear()
 
     def get_dependencies(self, pkgname):
-        deps = getalldeps(self.cache, pkgname)
-        return [APTPackage(p, cache=self.cache) for p in deps]
+        deps = self._depgraph().closure(pkgname)
+        return [APTPackage(p, cache=self.cache) for p in sorted(deps)]
 
-    def get_installed_pkgs(self, section='all'):
-        if section == 'all':
-            pl = [APTPackage(p) for p in self.cache if p.is_installed]
-        else:
-            pl = [APTPackage(p) for p in self.cache if (
-                p.section == section and p.is_installed)]
-        return pl
+    def get_dependency_names(self, pkgnames):
+        """Return the names of all dependencies of pkgnames"""
+        return sorted(self._depgraph().closure_many(pkgnames))
 
-    def get_fileindex(self, removeprefix=None):
-        """
-        Returns a map filepath => packagename indexed by the filepath.
-        Use removeprefix to remove any prefix from the actual filepath.
-        """
-        index = {}
+    def get_installed_pkgs(self, section='all', hashes=True):
+        """Return a PackageSnapshot of the installed packages
 
-        for p in self.cache:
-            if p.is_installed:
-                for f in p.installed_files:
-                    if removeprefix and f.startswith(removeprefix):
-                        unprefixed = f[len(removeprefix):]
-                    else:
-                        unprefixed = f
-                    index[unprefixed] = p.name
+        See get_pkglist() for the hashes.
+        """
+        return self._snapshot("installed", section,
+                              lambda p: p.is_installed, hashes)
 
-        return index
+    def get_marked_install(self, section='all', hashes=True):
+        """Return a PackageSnapshot of the packages marked for install
 
-    def get_marked_install(self, section='all'):
-        if section == 'all':
-            ret = [APTPackage(p) for p in self.cache if p.marked_install]
-        else:
-            ret = [APTPackage(p) for p in self.cache if (p.section == section
-                                                         and p.marked_install)]
-        return ret
+        See get_pkglist() for the hashes.
+        """
+        return self._snapshot("marked_install", section,
+                              lambda p: p.marked_install, hashes)
 
     def get_upgradeable(self, section='all'):
         if section == 'all':
@@ -293,6 +560,7 @@ class RPCAPTCache(InChRootObject):
         return ret
 
     def upgrade(self, dist_upgrade=False):
+        self._changed()
         self.cache.upgrade(dist_upgrade)
 
     def get_changes(self):
@@ -310,41 +578,106 @@ class RPCAPTCache(InChRootObject):
     def get_pkg(self, pkgname):
         return APTPackage(self.cache[pkgname])
 
-    def get_pkgs(self, pkgname):
-        return [
-            APTPackage(
-                self.cache[p]) for p in sorted(
-                self.cache.keys()) if pkgname in p.lower()]
+    # The batch methods below answer a query for many packages with
+    # a single call through the proxy, instead of one call per
+    # package.
 
-    def get_corresponding_source_packages(self, pkg_lst=None):
+    def has_pkgs(self, pkgnames):
+        """Return a dict pkgname => bool"""
+        return {name: name in self.cache for name in pkgnames}
 
-        if pkg_lst is None:
-            pkg_lst = {p.name for p in self.cache if p.is_installed}
+    def is_installed_many(self, pkgnames):
+        """Return a dict pkgname => bool"""
+        return {name: name in self.cache and self.cache[name].is_installed
+                for name in pkgnames}
 
-        src_set = set()
+    def get_pkgs_by_name(self, pkgnames):
+        """Return a dict pkgname => APTPackage of the existing packages"""
+        return {name: APTPackage(self.cache[name])
+                for name in pkgnames if name in self.cache}
+
+    def snapshot_installed(self):
+        """Return a dict pkgname => package of all installed packages"""
+        return {p.name: p for p in self.get_installed_pkgs(hashes=False)}
+
+    def get_pkgs(self, pkgname, mode="substring", limit=None):
+        """Search packages by name
 
+        mode is one of 'prefix', 'substring' or 'glob'.  The result
+        is sorted by name.
+        """
+        if self.search_index is None:
+            self.search_index = NameIndex(self.cache.keys())
+        return [APTPackage(self.cache[p])
+                for p in self.search_index.search(pkgname.lower(), mode, limit)]
+
+    def _source_index(self):
+        """Return binary name => (installed, source, built using sources)
+
+        The index is built from the dpkg status file and kept until
+        the cache changes.
+        """
+        if self.srcindex is not None:
+            return self.srcindex
+
+        self.srcindex = {}
         with TagFile('/var/lib/dpkg/status') as tagfile:
             for section in tagfile:
-
                 pkg = section['Package']
+                installed = section.get('Status', '').split(' ')[-1] not in (
+                    'not-installed', 'config-files')
 
-                if pkg not in pkg_lst:
+                if installed:
+                    src = section.get('Source', pkg).split(' ', 1)
+                    if len(src) > 1:
+                        src = (src[0], src[1].strip('()'))
+                    else:
+                        src = (src[0], section['Version'])
+                elif pkg in self.cache:
+                    tmp = self.cache[pkg].candidate
+                    if tmp is None:
+                        continue
+                    src = (tmp.source_name, tmp.source_version)
+                else:
                     continue
 
-                tmp = self.cache[pkg].installed or self.cache[pkg].candidate
+                built_using = []
+                for built in section.get('Built-Using', '').split(','):
+                    built = built.strip()
+                    if not built:
+                        continue
+                    name, version = built.split(' ', 1)
+                    built_using.append((name, version.strip('(= )')))
 
-                src_set.add((tmp.source_name, tmp.source_version))
+                self.srcindex[pkg] = (installed, src, tuple(built_using))
 
-                if "Built-Using" not in section:
-                    continue
+        return self.srcindex
+
+    def get_corresponding_source_packages(self, pkg_lst=None):
+        """Return the sorted (name, version) list of all sources of pkg_lst
+
+        This includes the sources listed in Built-Using.  Without
+        pkg_lst, the sources of all installed packages are returned.
+        """
+        start = time.monotonic()
+        cached = self.srcindex is not None
+        index = self._source_index()
+
+        if pkg_lst is None:
+            entries = [entry for entry in index.values() if entry[0]]
+        else:
+            entries = [index[pkg] for pkg in set(pkg_lst) if pkg in index]
+
+        src_set = set()
+        for _, src, built_using in entries:
+            src_set.add(src)
+            src_set.update(built_using)
 
-                built_using_lst = section["Built-Using"].split(', ')
-                for built_using in built_using_lst:
-                    name, version = built_using.split(' ', 1)
-                    version = version.strip('(= )')
-                    src_set.add((name, version))
+        print(f"Found {len(src_set)} source packages for {len(entries)} "
+              f"binary packages in {time.monotonic() - start:.3f}s"
+              f"{' (cached index)' if cached else ''}")
 
-        return list(src_set)
+        return sorted(src_set)
 
     @staticmethod
     def compare_versions(self, ver1, ver2):
@@ -358,65 +691,120 @@ class RPCAPTCache(InChRootObject):
             pkgver = p.versions[version]
         rel_filename = fetch_binary(pkgver,
                                     path,
-                                    ElbeAcquireProgress())
+                                    ElbeAcquireProgress(),
+                                    self.store)
         return self.rfs.fname(rel_filename)
 
+    def download_binaries(self, pkgs, path):
+        """Download several binary packages in a single acquire run
+
+        pkgs is a list of (pkgname, version) tuples, a version of None
+        selects the installed version.  Returns a dict mapping every
+        tuple to the path of its .deb file or to the exception, which
+        download_binary() would have raised.
+        """
+        ret = {}
+        versions = []
+
+        for pkgname, version in pkgs:
+            try:
+                p = self.cache[pkgname]
+                if version is None:
+                    pkgver = p.installed
+                    if pkgver is None:
+                        raise ValueError(f"{pkgname} is not installed")
+                else:
+                    pkgver = p.versions[version]
+            except (KeyError, ValueError, TypeError) as e:
+                ret[(pkgname, version)] = e
+                continue
+            versions.append(((pkgname, version), pkgver))
+
+        fetched = fetch_binaries([pkgver for _, pkgver in versions],
+                                 path,
+                                 ElbeAcquireProgress(),
+                                 self.store)
+
+        for (key, _), result in zip(versions, fetched):
+            if isinstance(result, FetchError):
+                ret[key] = result
+            else:
+                ret[key] = self.rfs.fname(result)
+
+        return ret
+
     def download_source(self, src_name, src_version, dest_dir):
+        ret = self.download_sources([(src_name, src_version)], dest_dir)
+        dsc = ret[(src_name, src_version)]
+        if isinstance(dsc, Exception):
+            raise dsc
+        return dsc
+
+    def download_sources(self, srcpkgs, dest_dir):
+        """Download many source packages at once
+
+        srcpkgs is a list of (source name, version) tuples.  Returns a
+        dict mapping every (name, version) to the host path of its .dsc
+        file, or to the ValueError or FetchError that prevented the
+        download.
+        """
+        ret = fetch_sources(srcpkgs, dest_dir, ElbeAcquireProgress(),
+                            self.store)
+        for key, dsc in ret.items():
+            if not isinstance(dsc, Exception):
+                ret[key] = self.rfs.fname(dsc)
+        return ret
+
 
-        allow_untrusted = config.find_b("APT::Get::AllowUnauthenticated",
-                                        False)
-
-        rec = SourceRecords()
-        acq = Acquire(ElbeAcquireProgress())
-
-        # poorman's iterator
-        while True:
-            next_p = rec.lookup(src_name)
-            # End of the list?
-            if not next_p:
-                raise ValueError(
-                    f"No source found for {src_name}_{src_version}")
-            if src_version == rec.version:
-                break
-
-        # We don't allow untrusted package and the package is not
-        # marks as trusted
-        if not (allow_untrusted or rec.index.is_trusted):
-            raise FetchError(
-                f"Can't fetch source {src_name}_{src_version}; "
-                f"Source {rec.index.describe} is not trusted")
-
-        # Copy from src to dst all files of the source package
-        dsc = None
-        files = []
-        for _file in rec.files:
-            src = os.path.basename(_file.path)
-            dst = os.path.join(dest_dir, src)
-
-            if 'dsc' ==  _file.type:
-                dsc = dst
-
-            if not (allow_untrusted or _file.hashes.usable):
-                raise FetchError(
-                    f"Can't fetch file {dst}. No trusted hash found.")
-
-            # acq is accumlating the AcquireFile, the files list only
-            # exists to prevent Python from GC the object .. I guess.
-            # Anyway, if we don't keep the list, We will get an empty
-            # directory
-            files.append(AcquireFile(acq, rec.index.archive_uri(_file.path),
-                                     _file.hashes, _file.size, src, destfile=dst))
-        acq.run()
-
-        if dsc is None:
-            raise ValueError(f"No source found for {src_name}_{src_version}")
-
-        for item in acq.items:
-            if item.STAT_DONE != item.status:
-                raise FetchError(
-                    f"Can't fetch item {item.destfile}: {item.error_text}")
-
-        return self.rfs.fname(os.path.abspath(dsc))
+# Cache servers by (rootdir, arch, sources checksum, options), so that
+# build stages working on the same chroot share one server process.
+# A server with pending changes is not handed out again, so users never
+# see or drop the marks of each other.
+#
+# Every idle server keeps a whole apt cache in memory, so only a few of
+# them are kept: by default two, like the buildenv and a sysroot of one
+# project.
+# ELBE_APTCACHE_POOL sets the number, 0 disables the pool.
+_pool = {}
+_pool_lock = threading.Lock()
+
+
+def sources_checksum(rfs):
+    """Return a checksum over the apt sources of rfs"""
+    h = hashlib.sha256()
+    for fname in [rfs.fname('etc/apt/sources.list')] + \
+            sorted(rfs.glob('etc/apt/sources.list.d/*')):
+        try:
+            with open(fname, 'rb') as f:
+                data = f.read()
+        except OSError:
+            continue
+        h.update(fname.encode())
+        h.update(data)
+    return h.hexdigest()
+
+
+def _pooled(key, rfs, notifier):
+    """Return the pooled cache for key, if it is still usable"""
+    cache = _pool.pop(key, None)
+    if cache is None:
+        return None
+
+    try:
+        # A chroot, that was removed and created again, has a new inode
+        st = os.stat(rfs.path)
+        if cache.root_id() != (st.st_dev, st.st_ino):
+            return None
+        if not cache.reuse(notifier):
+            # A new server replaces it in the pool
+            return None
+    except (OSError, EOFError):
+        # Server process is gone
+        return None
+
+    # Most recently used goes last
+    _pool[key] = cache
+    return cache
 
 
 def get_rpcaptcache(rfs, arch,
@@ -424,12 +812,40 @@ def get_rpcaptcache(rfs, arch,
 
     # pylint: disable=too-many-arguments
 
-    mm = MyMan()
-    mm.start()
+    key = (os.path.realpath(rfs.path), arch, sources_checksum(rfs),
+           norecommend, noauth)
+
+    with _pool_lock:
+        cache = _pooled(key, rfs, notifier)
+        if cache is not None:
+            return cache
+
+        mm = MyMan()
+        mm.start()
+
+        # Disable false positive, because pylint can not
+        # see the creation of MyMan.RPCAPTCache by
+        # MyMan.register()
+        #
+        # pylint: disable=no-member
+        cache = mm.RPCAPTCache(rfs, arch, notifier, norecommend, noauth)
+
+        # The least recently used servers are shut down, as soon as
+        # their last user drops them
+        _pool[key] = cache
+        while len(_pool) > cfg['aptcache_pool']:
+            del _pool[next(iter(_pool))]
+
+        return cache
+
+
+def drop_rpcaptcaches(path):
+    """Drop the pooled cache servers of all chroots below path
 
-    # Disable false positive, because pylint can not
-    # see the creation of MyMan.RPCAPTCache by
-    # MyMan.register()
-    #
-    # pylint: disable=no-member
-    return mm.RPCAPTCache(rfs, arch, notifier, norecommend, noauth)
+    The servers stop as soon as their last user releases them.
+    """
+    path = os.path.realpath(path)
+    with _pool_lock:
+        for key in [key for key in _pool
+                    if os.path.commonpath((key[0], path)) == path]:
+            del _pool[key]
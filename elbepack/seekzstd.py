@@ -0,0 +1,372 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+"""Seekable zstd archives
+
+The archive is a series of independent zstd frames, each holding
+FRAME_SIZE bytes of the input, followed by the seek table of the zstd
+seekable format.  Every zstd decompressor can unpack it as usual, the
+seek table is a skippable frame.  Readers that know the seek table
+decompress only the frames covering the requested range.
+
+For tar archives, an index of the members is stored in another
+skippable frame, listed in the seek table with a decompressed size of
+zero.  SeekableZstdFile.extract() looks a member up there and reads
+only its frames.
+"""
+
+import io
+import json
+import os
+import struct
+import tarfile
+
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from subprocess import DEVNULL, PIPE, Popen
+from tempfile import TemporaryFile
+
+from elbepack.copyengine import data_segments
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FRAME_SIZE = 4 * 1024 * 1024
+
+# Input compressed by a single run of the zstd tool
+BATCH_SIZE = 16 * 1024 * 1024
+
+ZSTD_MAGIC = 0xFD2FB528
+SEEK_TABLE_MAGIC = 0x184D2A5E
+INDEX_MAGIC = 0x184D2A5B
+SEEKABLE_MAGIC = 0x8F92EAB1
+
+_FOOTER = struct.Struct("<IBI")
+_ENTRY = struct.Struct("<II")
+_SKIPPABLE = struct.Struct("<II")
+
+
+class SeekableZstdError(Exception):
+    pass
+
+
+def _zstd(args, data=None, pass_fds=()):
+    with Popen(["zstd", "-q", "-c"] + args,
+               stdin=DEVNULL if data is None else PIPE,
+               stdout=PIPE, stderr=PIPE, pass_fds=pass_fds) as p:
+        out, err = p.communicate(data)
+    if p.returncode:
+        raise SeekableZstdError(f"zstd {' '.join(args)} failed: "
+                                f"{err.decode(errors='replace').strip()}")
+    return out
+
+
+def frame_length(buf, pos=0):
+    """Return the length of the zstd frame at pos in buf"""
+    magic, desc = struct.unpack_from("<IB", buf, pos)
+    if magic != ZSTD_MAGIC:
+        raise SeekableZstdError(f"No zstd frame at {pos}")
+
+    single_segment = desc >> 5 & 1
+    end = pos + 5 + (not single_segment) + (0, 1, 2, 4)[desc & 3] + \
+        (single_segment, 2, 4, 8)[desc >> 6]
+
+    # Every block header holds the last block flag, the block type
+    # and the block size.  RLE blocks store a single byte.
+    last = False
+    while not last:
+        header = int.from_bytes(buf[end:end + 3], "little")
+        last = header & 1
+        end += 3 + (1 if header >> 1 & 3 == 1 else header >> 3)
+
+    # Content checksum
+    if desc >> 2 & 1:
+        end += 4
+
+    if end > len(buf):
+        raise SeekableZstdError(f"Truncated zstd frame at {pos}")
+    return end - pos
+
+
+def compress_frames(chunks, level=3):
+    """Return every chunk compressed into a zstd frame of its own
+
+    The zstandard module is used, if it is available.  Otherwise all
+    chunks are compressed by a single run of the zstd tool, which
+    writes a frame per input file.  The chunks are passed as
+    temporary files.
+    """
+    if zstandard is not None:
+        cctx = zstandard.ZstdCompressor(level=level, write_checksum=True)
+        return [cctx.compress(chunk) for chunk in chunks]
+
+    with ExitStack() as stack:
+        files = [stack.enter_context(TemporaryFile()) for _ in chunks]
+        for f, chunk in zip(files, chunks):
+            f.write(chunk)
+            f.flush()
+        fds = [f.fileno() for f in files]
+        # -f, the /dev/fd entries are symlinks
+        out = _zstd(["-f", f"-{level}"] + [f"/dev/fd/{fd}" for fd in fds],
+                    pass_fds=fds)
+
+    frames = []
+    pos = 0
+    for _ in chunks:
+        length = frame_length(out, pos)
+        frames.append(out[pos:pos + length])
+        pos += length
+    return frames
+
+
+def compress_frame(data, level=3):
+    """Return data compressed into a single zstd frame"""
+    return compress_frames([data], level)[0]
+
+
+def decompress_frame(frame):
+    if zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(frame)
+    return _zstd(["-d"], frame)
+
+
+def skippable_frame(magic, payload):
+    return _SKIPPABLE.pack(magic, len(payload)) + payload
+
+
+def tar_index(fname):
+    """Return the index of the members of the tar file fname
+
+    Every member name maps to the offset of its first header in the
+    uncompressed tar file.
+    """
+    with tarfile.open(fname, "r:") as tar:
+        return {m.name: m.offset for m in tar}
+
+
+def write_seekable(src, dst, level=3, threads=1, *, index=None,
+                   frame_size=FRAME_SIZE):
+    """Compress the file src into the seekable zstd archive dst
+
+    The frames are compressed in batches, up to threads batches at
+    once.  Frames that are a hole in src are not read, all zero
+    frames are compressed only once.  index is stored as the member
+    index of a tar archive, if given.
+    """
+
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-locals
+
+    fd = os.open(src, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        segments = list(data_segments(fd, size))
+        zero_frames = {}
+
+        def read(start, end):
+            # The last data segment starting before end
+            i = bisect_right(segments, (end,)) - 1
+            if i < 0 or segments[i][1] <= start:
+                return None
+            data = os.pread(fd, end - start, start)
+            if data.count(0) == len(data):
+                return None
+            return data
+
+        def compress(starts):
+            ends = [min(start + frame_size, size) for start in starts]
+            chunks = [read(start, end) for start, end in zip(starts, ends)]
+            cframes = iter(compress_frames([c for c in chunks if c], level))
+
+            ret = []
+            for start, end, chunk in zip(starts, ends, chunks):
+                if chunk is None:
+                    # Hole or only zeros, all of them compress to the
+                    # same frame.  A race would only compress it twice.
+                    if end - start not in zero_frames:
+                        zero_frames[end - start] = compress_frame(
+                            bytes(end - start), level)
+                    ret.append((zero_frames[end - start], end - start))
+                else:
+                    ret.append((next(cframes), end - start))
+            return ret
+
+        starts = range(0, size, frame_size)
+        per_batch = max(1, BATCH_SIZE // frame_size)
+        batches = [starts[i:i + per_batch]
+                   for i in range(0, len(starts), per_batch)]
+
+        entries = []
+        with open(dst, "wb") as out, \
+             ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+
+            # Keep the memory bounded, only two batches per thread are
+            # in flight
+            window = max(1, threads) * 2
+            for i in range(0, len(batches), window):
+                for frames in pool.map(compress, batches[i:i + window]):
+                    for cframe, dsize in frames:
+                        out.write(cframe)
+                        entries.append((len(cframe), dsize))
+
+            if index is not None:
+                iframe = skippable_frame(INDEX_MAGIC,
+                                         json.dumps(index).encode())
+                out.write(iframe)
+                entries.append((len(iframe), 0))
+
+            table = b"".join(_ENTRY.pack(c, d) for c, d in entries)
+            table += _FOOTER.pack(len(entries), 0, SEEKABLE_MAGIC)
+            out.write(skippable_frame(SEEK_TABLE_MAGIC, table))
+    finally:
+        os.close(fd)
+
+
+class SeekableZstdFile(io.RawIOBase):
+    """Read only file object for the content of a seekable zstd archive
+
+    Only the frames covering the read data are decompressed.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, fname):
+        super().__init__()
+        # pylint: disable=consider-using-with
+        self.f = open(fname, "rb")
+        self.pos = 0
+        self.cache = (None, b"")
+        self._index = None
+
+        try:
+            self._read_seek_table()
+        except BaseException:
+            self.f.close()
+            raise
+
+    def _read_seek_table(self):
+        self.f.seek(-_FOOTER.size, os.SEEK_END)
+        nframes, descriptor, magic = _FOOTER.unpack(self.f.read(_FOOTER.size))
+        if magic != SEEKABLE_MAGIC:
+            raise SeekableZstdError(f"{self.f.name} is not seekable")
+
+        entry_size = _ENTRY.size + (4 if descriptor & 0x80 else 0)
+        table_size = nframes * entry_size
+        self.f.seek(-(_FOOTER.size + table_size + _SKIPPABLE.size),
+                    os.SEEK_END)
+        magic, _ = _SKIPPABLE.unpack(self.f.read(_SKIPPABLE.size))
+        if magic != SEEK_TABLE_MAGIC:
+            raise SeekableZstdError(f"{self.f.name} has no seek table")
+
+        table = self.f.read(table_size)
+
+        # Start offsets of the frames, compressed and decompressed
+        self.frames = []
+        self.index_frame = None
+        coffset = 0
+        doffset = 0
+        for i in range(nframes):
+            csize, dsize = _ENTRY.unpack_from(table, i * entry_size)
+            if dsize:
+                self.frames.append((doffset, coffset, csize, dsize))
+            else:
+                self.f.seek(coffset)
+                magic, _ = _SKIPPABLE.unpack(self.f.read(_SKIPPABLE.size))
+                if magic == INDEX_MAGIC:
+                    self.index_frame = (coffset, csize)
+            coffset += csize
+            doffset += dsize
+
+        self.size = doffset
+        self.starts = [frame[0] for frame in self.frames]
+
+    def close(self):
+        self.f.close()
+        super().close()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.pos
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self.pos = offset
+        return self.pos
+
+    def _frame(self, i):
+        if self.cache[0] != i:
+            _, coffset, csize, _ = self.frames[i]
+            self.f.seek(coffset)
+            self.cache = (i, decompress_frame(self.f.read(csize)))
+        return self.cache[1]
+
+    def pread(self, size, offset):
+        """Return up to size bytes at offset"""
+        end = min(offset + size, self.size)
+        ret = []
+        while offset < end:
+            i = bisect_right(self.starts, offset) - 1
+            data = self._frame(i)
+            start = offset - self.starts[i]
+            chunk = data[start:start + end - offset]
+            if not chunk:
+                raise SeekableZstdError(f"Frame {i} is truncated")
+            ret.append(chunk)
+            offset += len(chunk)
+        return b"".join(ret)
+
+    def readinto(self, b):
+        data = self.pread(len(b), self.pos)
+        b[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+    def index(self):
+        """Return the tar member index of the archive or None"""
+        if self._index is None and self.index_frame is not None:
+            coffset, csize = self.index_frame
+            self.f.seek(coffset + _SKIPPABLE.size)
+            self._index = json.loads(self.f.read(csize - _SKIPPABLE.size))
+        return self._index
+
+    def _member(self, name):
+        index = self.index()
+        if index is None:
+            raise SeekableZstdError(f"{self.f.name} has no tar index")
+        if name not in index:
+            raise KeyError(f"{name} not found in {self.f.name}")
+
+        # Opening reads the first member already, drop it and continue
+        # at the header of the requested one
+        # pylint: disable=consider-using-with
+        tar = tarfile.open(fileobj=self, mode="r:")
+        tar.firstmember = None
+        tar.offset = self.seek(index[name])
+        return tar, tar.next()
+
+    def getmember(self, name):
+        """Return the TarInfo of the tar member name"""
+        return self._member(name)[1]
+
+    def extract(self, name):
+        """Return the content of the tar member name"""
+        tar, member = self._member(name)
+        f = tar.extractfile(member)
+        if f is None:
+            raise SeekableZstdError(f"{name} is not a regular file")
+        with f:
+            return f.read()
@@ -5,12 +5,14 @@
 
 import os
 import logging
+import threading
 
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import Popen, PIPE, STDOUT, call
 
 from io import TextIOWrapper, BytesIO
 
-from elbepack.log import async_logging
+from elbepack.log import async_logging, adopt_logging
 
 log = logging.getLogger("log")
 soap = logging.getLogger("soap")
@@ -333,3 +335,44 @@ def get_command_out(cmd, stdin=None, allow_fail=False, env_add=None):
         raise CommandError(cmd, p.returncode)
 
     return stdout
+
+
+def run_parallel(func, items, jobs=None):
+    """run_parallel() - Call func for every item in a pool of jobs threads.
+
+    The records logged by func, e.g. by do(), are logged like records of
+    the calling thread.  Waits for all calls and returns their results in
+    the order of items.  The exception of the first failing call is
+    raised again.
+
+    --
+
+    Let's redirect the loggers to current stdout
+    >>> import sys
+    >>> from elbepack.log import open_logging
+    >>> open_logging({"streams":sys.stdout})
+
+    >>> run_parallel(lambda x: x * 2, [1, 2, 3])
+    [2, 4, 6]
+
+    >>> run_parallel(do, ["true", "true"])
+    [CMD] true
+    [CMD] true
+    [None, None]
+
+    >>> run_parallel(do, ["true", "false"], jobs=1) # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    elbepack.shellhelper.CommandError: ...
+    """
+
+    thread = threading.current_thread().ident
+
+    def _run_one(item):
+        with adopt_logging(thread):
+            return func(item)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(_run_one, item) for item in items]
+
+    return [fut.result() for fut in futures]
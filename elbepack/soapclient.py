@@ -3,6 +3,8 @@
 # SPDX-FileCopyrightText: 2014-2018 Linutronix GmbH
 # SPDX-FileCopyrightText: 2016 Claudius Heine <ch@denx.de>
 
+# pylint: disable=too-many-lines
+
 import binascii
 import logging
 import socket
@@ -18,7 +20,7 @@ from urllib.error import URLError
 import deb822   # package for dealing with Debian related data
 
 from suds.client import Client
-from suds import WebFault
+from suds import MethodNotFound, WebFault
 
 from elbepack.config import cfg
 from elbepack.filesystem import Filesystem
@@ -86,9 +88,15 @@ class ElbeSoapClient:
         # the root cause instead of stupid retrying.
         retry = 5
 
+        # Daemons before the sparse transfer only know get_file
+        try:
+            get_part = self.service.get_sparse_file
+        except MethodNotFound:
+            get_part = self.service.get_file
+
         while True:
             try:
-                ret = self.service.get_file(builddir, filename, part)
+                ret = get_part(builddir, filename, part)
             except BadStatusLine as e:
                 retry = retry - 1
 
@@ -106,10 +114,16 @@ class ElbeSoapClient:
                 print(ret, file=sys.stderr)
                 sys.exit(20)
             if ret == "EndOfFile":
+                # Trailing holes are not written
+                fp.truncate()
                 fp.close()
                 return
 
-            fp.write(binascii.a2b_base64(ret))
+            if ret.startswith("Hole "):
+                # Keep the hole in the downloaded file
+                fp.seek(int(ret[5:]), os.SEEK_CUR)
+            else:
+                fp.write(binascii.a2b_base64(ret))
             part = part + 1
 
 class ClientAction:
@@ -407,6 +421,74 @@ class BuildSysrootAction(ClientAction):
 ClientAction.register(BuildSysrootAction)
 
 
+class PlanInstallAction(ClientAction):
+
+    tag = 'plan_install'
+
+    def __init__(self, node):
+        ClientAction.__init__(self, node)
+
+    def execute(self, client, _opt, args):
+        if not args:
+            print(
+                "usage: elbe control plan_install <project_dir> [<pkg> ...]",
+                file=sys.stderr)
+            sys.exit(20)
+
+        builddir = args[0]
+        plan = client.service.plan_install(builddir, args[1:])
+
+        for title, pkgs in (("Install", plan.install),
+                            ("Upgrade", plan.upgrade),
+                            ("Remove", plan.remove),
+                            ("Missing", plan.missing),
+                            ("Conflicts", plan.conflicts)):
+            if not pkgs:
+                continue
+            print(f"{title}:")
+            for p in pkgs:
+                print(f"  {p}")
+
+        print(f"Download size: {plan.download_size} bytes")
+        print(f"Installed size change: {plan.install_size} bytes")
+
+        if plan.conflicts:
+            sys.exit(20)
+
+
+ClientAction.register(PlanInstallAction)
+
+
+class SearchPackagesAction(ClientAction):
+
+    tag = 'search_packages'
+
+    def __init__(self, node):
+        ClientAction.__init__(self, node)
+
+    def execute(self, client, opt, args):
+        if len(args) != 2:
+            print(
+                "usage: elbe control [--search-mode prefix|substring|glob] "
+                "[--limit <n>] search_packages <project_dir> <term>",
+                file=sys.stderr)
+            sys.exit(20)
+
+        builddir, term = args
+        pkgs = client.service.search_packages(builddir, term,
+                                              opt.search_mode, opt.limit)
+
+        try:
+            for p in pkgs.SoapPackage:
+                print(f"{p.name}\t{p.installed_version or '-'}\t"
+                      f"{p.candidate_version or '-'}\t{p.state}")
+        except AttributeError:
+            print("No packages found")
+
+
+ClientAction.register(SearchPackagesAction)
+
+
 class BuildSDKAction(ClientAction):
 
     tag = 'build_sdk'
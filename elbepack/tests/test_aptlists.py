@@ -0,0 +1,65 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import os
+import unittest
+
+from elbepack.aptlists import ListsCache
+from elbepack.filesystem import TmpdirFilesystem
+
+
+SOURCES = "deb http://deb.debian.org/debian bookworm main\n"
+PREFIX = "deb.debian.org_debian_dists_bookworm_"
+
+
+class TestListsCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = TmpdirFilesystem()
+        self.tmp.mkdir_p("prj1/lists/partial")
+        self.tmp.mkdir_p("prj2/lists/partial")
+        self.lists = ListsCache(self.tmp.fname("cache"))
+
+    def tearDown(self):
+        self.lists.close()
+        del self.tmp
+
+    def test_seed_collect(self):
+        self.tmp.write_file(f"prj1/lists/{PREFIX}InRelease", 0o644, "release")
+        self.tmp.write_file(f"prj1/lists/{PREFIX}main_binary-amd64_Packages",
+                            0o644, "packages")
+        self.tmp.write_file("prj1/lists/example.com_dists_sid_InRelease",
+                            0o644, "other")
+        self.tmp.write_file("prj1/lists/lock", 0o640, "")
+        self.lists.collect(self.tmp.fname("prj1/lists"))
+
+        # Only the lists of the sources are used
+        self.assertEqual(self.lists.seed(self.tmp.fname("prj2/lists"),
+                                         SOURCES), 2)
+        self.assertEqual(sorted(os.listdir(self.tmp.fname("prj2/lists"))),
+                         [f"{PREFIX}InRelease",
+                          f"{PREFIX}main_binary-amd64_Packages",
+                          "partial"])
+
+        inrelease = f"lists/{PREFIX}InRelease"
+        self.assertEqual(self.tmp.read_file(f"prj2/{inrelease}"), "release")
+        self.assertEqual(self.tmp.stat(f"prj1/{inrelease}").st_ino,
+                         self.tmp.stat(f"prj2/{inrelease}").st_ino)
+
+        # Present files are kept
+        self.assertEqual(self.lists.seed(self.tmp.fname("prj2/lists"),
+                                         SOURCES), 0)
+
+    def test_newest(self):
+        release = f"prj1/lists/{PREFIX}InRelease"
+        self.tmp.write_file(release, 0o644, "old")
+        self.lists.collect(self.tmp.fname("prj1/lists"))
+
+        self.tmp.remove(release)
+        self.tmp.write_file(release, 0o644, "new")
+        self.lists.collect(self.tmp.fname("prj1/lists"))
+
+        self.lists.seed(self.tmp.fname("prj2/lists"), SOURCES)
+        self.assertEqual(self.tmp.read_file(f"prj2/lists/{PREFIX}InRelease"),
+                         "new")
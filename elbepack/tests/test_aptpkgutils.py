@@ -0,0 +1,109 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import unittest
+
+from elbepack.aptpkgutils import DependencyGraph, getalldeps
+
+
+class FakeDep:
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, target_pkg):
+        self.target_pkg = target_pkg
+
+
+class FakeVersion:
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, pkg, depends_list):
+        self.parent_pkg = pkg
+        self.ver_str = "1.0"
+        self.depends_list = depends_list
+
+
+class FakePackage:
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, name):
+        self.name = name
+        self.has_versions = False
+        self.provides_list = []
+        self.current_ver = None
+        self.candidate = None
+        self.marked = False
+
+
+class FakeDepCache:
+
+    @staticmethod
+    def get_candidate_ver(pkg):
+        return pkg.candidate
+
+    @staticmethod
+    def marked_install(pkg):
+        return pkg.marked
+
+
+class FakeCache:
+    """apt.Cache with just what DependencyGraph needs"""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self._cache = {}
+        self._depcache = FakeDepCache()
+
+    def add(self, name, depends=(), provides=(), installed=False,
+            marked=False):
+
+        # pylint: disable=too-many-arguments
+
+        pkg = self._cache.setdefault(name, FakePackage(name))
+        groups = [[FakeDep(self._cache.setdefault(d, FakePackage(d)))
+                   for d in group.split("|")]
+                  for group in depends]
+        ver = FakeVersion(pkg, {"Depends": groups})
+        pkg.has_versions = True
+        pkg.candidate = ver
+        pkg.current_ver = ver if installed else None
+        pkg.marked = marked
+        for p in provides:
+            self._cache.setdefault(p, FakePackage(p)).provides_list.append(
+                (p, None, ver))
+
+
+class TestDependencyGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = FakeCache()
+        self.cache.add("app", depends=["awk", "libc6|libc-alt"])
+        self.cache.add("mawk", depends=["libc6"], provides=["awk"],
+                       installed=True)
+        self.cache.add("gawk", provides=["awk"])
+        self.cache.add("original-awk", provides=["awk"], marked=True)
+        self.cache.add("libc6", installed=True)
+        self.cache.add("libc-alt")
+        self.cache.add("a", depends=["b"])
+        self.cache.add("b", depends=["a"])
+
+    def test_virtual(self):
+        # awk resolves to its installed and marked providers, all
+        # alternatives are followed
+        self.assertEqual(getalldeps(self.cache, "app"),
+                         ["libc-alt", "libc6", "mawk", "original-awk"])
+
+    def test_cycle(self):
+        graph = DependencyGraph(self.cache)
+        self.assertEqual(graph.closure("a"), {"a", "b"})
+        self.assertEqual(graph.closure("libc6"), set())
+        self.assertEqual(graph.closure_many(["mawk", "a"]),
+                         {"libc6", "a", "b"})
+
+    def test_no_versions(self):
+        with self.assertRaises(KeyError):
+            DependencyGraph(self.cache).closure("awk")
@@ -0,0 +1,74 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import hashlib
+import unittest
+
+from xml.etree import ElementTree
+
+from elbepack.bmap import write_bmap
+from elbepack.copyengine import write_file_at
+from elbepack.filesystem import TmpdirFilesystem
+
+MiB = 1024 * 1024
+
+
+class TestBmap(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = TmpdirFilesystem()
+        with self.tmp.open("img", "wb") as f:
+            f.write(b"mbr")
+            f.seek(4 * MiB)
+            f.write(b"x" * 5000)
+            f.truncate(64 * MiB)
+
+    def tearDown(self):
+        del self.tmp
+
+    def test_bmap(self):
+        bmapname = write_bmap(self.tmp.fname("img"))
+        self.assertEqual(bmapname, self.tmp.fname("img.bmap"))
+
+        data = self.tmp.read_file("img.bmap")
+        bmap = ElementTree.fromstring(data)
+
+        self.assertEqual(bmap.get("version"), "2.0")
+        self.assertEqual(int(bmap.find("ImageSize").text), 64 * MiB)
+        self.assertEqual(int(bmap.find("BlocksCount").text), 16384)
+        self.assertEqual(int(bmap.find("MappedBlocksCount").text), 3)
+
+        ranges = [r.text.strip() for r in bmap.find("BlockMap")]
+        self.assertEqual(ranges, ["0", "1024-1025"])
+
+        with self.tmp.open("img", "rb") as f:
+            f.seek(4 * MiB)
+            chunk = f.read(2 * 4096)
+        self.assertEqual(bmap.find("BlockMap")[1].get("chksum"),
+                         hashlib.sha256(chunk).hexdigest())
+
+        # Like bmaptool, check the file with zeros for the checksum
+        checksum = bmap.find("BmapFileChecksum").text.strip()
+        self.assertEqual(
+            hashlib.sha256(data.replace(checksum, "0" * 64).encode())
+            .hexdigest(), checksum)
+
+    def test_write_file_at(self):
+        with self.tmp.open("blob", "wb") as f:
+            f.write(b"uboot")
+            f.write(bytes(MiB))
+            f.write(b"env")
+
+        write_file_at(self.tmp.fname("blob"), self.tmp.fname("img"), 0)
+
+        with self.tmp.open("img", "rb") as f:
+            self.assertEqual(f.read(8), b"uboot" + bytes(3))
+            f.seek(5 + MiB)
+            self.assertEqual(f.read(3), b"env")
+
+        # The zeros of the blob did not fill the hole of the image
+        write_bmap(self.tmp.fname("img"))
+        bmap = ElementTree.fromstring(self.tmp.read_file("img.bmap"))
+        ranges = [r.text.strip() for r in bmap.find("BlockMap")]
+        self.assertEqual(ranges, ["0", "256", "1024-1025"])
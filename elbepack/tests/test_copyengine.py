@@ -0,0 +1,192 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import os
+import time
+import unittest
+
+from elbepack.commands.test import ElbeTestCase, ElbeTestLevel
+from elbepack.copyengine import (CopyEngine, copy_file, data_segments,
+                                 splice_file)
+from elbepack.efilesystem import copy_filelist
+from elbepack.filesystem import TmpdirFilesystem
+from elbepack.shellhelper import system
+
+
+class TestCopyEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.src = TmpdirFilesystem()
+        self.dst = TmpdirFilesystem()
+
+    def tearDown(self):
+        del self.src
+        del self.dst
+
+    def test_mode_and_times(self):
+        self.src.write_file('/bla', 0o4751, 'bla')
+        self.src.utime('/bla', (1000000, 2000000))
+
+        copy_file(self.src.fname('/bla'), self.dst.fname('/bla'))
+
+        st_src = self.src.stat('/bla')
+        st_dst = self.dst.stat('/bla')
+        self.assertEqual(st_src.st_mode, st_dst.st_mode)
+        self.assertEqual(st_src.st_mtime_ns, st_dst.st_mtime_ns)
+        self.assertEqual(self.dst.read_file('/bla'), 'bla')
+
+    def test_sparse(self):
+        with self.src.open('/sparse', 'wb') as f:
+            f.seek(16 * 1024 * 1024)
+            f.write(b'end')
+            f.truncate(32 * 1024 * 1024)
+
+        copy_file(self.src.fname('/sparse'), self.dst.fname('/sparse'))
+
+        st_src = self.src.stat('/sparse')
+        st_dst = self.dst.stat('/sparse')
+        self.assertEqual(st_src.st_size, st_dst.st_size)
+        self.assertLessEqual(st_dst.st_blocks, st_src.st_blocks)
+
+        with self.dst.open('/sparse', 'rb') as f:
+            f.seek(16 * 1024 * 1024)
+            self.assertEqual(f.read(3), b'end')
+
+    def test_data_segments(self):
+        MiB = 1024 * 1024
+        with self.src.open('/sparse', 'wb') as f:
+            f.seek(50 * MiB)
+            f.write(b'data')
+            f.truncate(60 * MiB)
+
+        fd = os.open(self.src.fname('/sparse'), os.O_RDONLY)
+        try:
+            # Only a hole in the range, the data follows later
+            self.assertEqual(list(data_segments(fd, 5 * MiB)), [])
+            self.assertEqual(list(data_segments(fd, 10 * MiB, 5 * MiB)), [])
+
+            segments = list(data_segments(fd, 55 * MiB, 45 * MiB))
+            self.assertEqual(len(segments), 1)
+            start, end = segments[0]
+            self.assertLessEqual(start, 50 * MiB)
+            self.assertGreaterEqual(end, 50 * MiB + 4)
+        finally:
+            os.close(fd)
+
+    def test_splice(self):
+        with self.src.open('/part', 'wb') as f:
+            f.write(b'head')
+            f.seek(8 * 1024 * 1024)
+            f.write(b'tail')
+            f.truncate(16 * 1024 * 1024)
+
+        with self.dst.open('/disk', 'wb') as f:
+            f.write(b'mbr')
+            f.truncate(64 * 1024 * 1024)
+
+        offset = 1024 * 1024
+        splice_file(self.src.fname('/part'), self.dst.fname('/disk'), offset)
+
+        self.assertEqual(self.dst.stat('/disk').st_size, 64 * 1024 * 1024)
+        with self.src.open('/part', 'rb') as f:
+            part = f.read()
+        with self.dst.open('/disk', 'rb') as f:
+            self.assertEqual(f.read(3), b'mbr')
+            f.seek(offset)
+            self.assertEqual(f.read(len(part)), part)
+            self.assertEqual(f.read(16), bytes(16))
+
+    def test_symlink(self):
+        self.src.symlink('target', '/link')
+
+        copy_file(self.src.fname('/link'), self.dst.fname('/link'))
+
+        self.assertEqual(self.dst.readlink('/link'), 'target')
+
+    def test_replace(self):
+        self.src.write_file('/bla', 0o644, 'new')
+        self.dst.symlink('target', '/link')
+        self.dst.write_file('/file', 0o644, 'old content')
+
+        copy_file(self.src.fname('/bla'), self.dst.fname('/link'))
+        copy_file(self.src.fname('/bla'), self.dst.fname('/file'))
+
+        self.assertFalse(self.dst.islink('/link'))
+        self.assertEqual(self.dst.read_file('/link'), 'new')
+        self.assertEqual(self.dst.read_file('/file'), 'new')
+
+    def test_directory_dst(self):
+        self.src.write_file('/bla', 0o644, 'bla')
+        self.dst.mkdir_p('/bla')
+
+        with self.assertRaisesRegex(IsADirectoryError,
+                                    'Can not replace a directory'):
+            copy_file(self.src.fname('/bla'), self.dst.fname('/bla'))
+        self.assertTrue(self.dst.isdir('/bla'))
+
+    def test_errors(self):
+        with CopyEngine() as engine:
+            engine.submit(self.src.fname('/missing'), self.dst.fname('/missing'))
+            errors = engine.wait()
+
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0][2], FileNotFoundError)
+
+    def test_deferred_link_to_file(self):
+
+        self.src.mkdir_p('/usr/lib')
+        self.src.write_file('/usr/lib/libbla.so.1', 0o644, 'bla')
+        self.src.symlink('libbla.so.1', '/usr/lib/libbla.so')
+
+        # Only the symlink is requested, the target has to be copied
+        # along
+        copy_filelist(self.src, ['/usr/lib/libbla.so'], self.dst)
+
+        self.assertEqual(self.dst.readlink('/usr/lib/libbla.so'), 'libbla.so.1')
+        self.assertEqual(self.dst.read_file('/usr/lib/libbla.so'), 'bla')
+
+
+@unittest.skipIf(ElbeTestCase.level < ElbeTestLevel.EXTEND,
+                 "Test level not set to EXTEND")
+class TestCopyEngineBenchmark(ElbeTestCase):
+
+    nr_dirs = 40
+    nr_files = 250
+
+    def setUp(self):
+        self.src = TmpdirFilesystem()
+        self.files = []
+
+        for d in range(self.nr_dirs):
+            self.src.mkdir_p(f'/usr/share/bench{d}')
+            for f in range(self.nr_files):
+                fname = f'/usr/share/bench{d}/file{f}'
+                self.src.write_file(fname, 0o644, fname * 16)
+                self.files.append(fname)
+
+    def tearDown(self):
+        del self.src
+
+    def test_benchmark(self):
+
+        # The former copy path, one cp process per file
+        with TmpdirFilesystem() as dst:
+            start = time.monotonic()
+            for f in self.files:
+                dst.mkdir_p(os.path.dirname(f))
+                system(f'cp -a --reflink=auto '
+                       f'"{self.src.realpath(f)}" "{dst.realpath(f)}"')
+            cp_time = time.monotonic() - start
+
+        with TmpdirFilesystem() as dst:
+            start = time.monotonic()
+            copy_filelist(self.src, self.files, dst)
+            engine_time = time.monotonic() - start
+
+            for f in self.files[::self.nr_files]:
+                self.assertEqual(self.src.read_file(f), dst.read_file(f))
+
+        self.stdout = (f"copy of {len(self.files)} files: "
+                       f"cp -a {cp_time:.2f}s, "
+                       f"CopyEngine {engine_time:.2f}s")
@@ -6,6 +6,10 @@ import doctest
 
 import elbepack.shellhelper as shellhelper
 import elbepack.filesystem as filesystem
+import elbepack.dpkgindex as dpkgindex
+import elbepack.repoindex as repoindex
+import elbepack.pkgsearch as pkgsearch
+import elbepack.aptlists as aptlists
 
 from elbepack.commands.test import ElbeTestCase
 
@@ -14,7 +18,8 @@ class ElbeDocTest(ElbeTestCase):
     # This is an example of a callable parametrization
     @staticmethod
     def params():
-        return [shellhelper, filesystem]
+        return [shellhelper, filesystem, dpkgindex, repoindex, pkgsearch,
+                aptlists]
 
     def setUp(self):
 
@@ -0,0 +1,63 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import os
+import unittest
+
+from elbepack.dpkgindex import DpkgFileIndex
+from elbepack.filesystem import TmpdirFilesystem
+
+class TestDpkgFileIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.rfs = TmpdirFilesystem()
+        self.rfs.mkdir_p("var/lib/dpkg/info")
+        self.cachefile = self.rfs.fname("fileindex.json")
+
+        self.add_pkg("bash", ["/.", "/bin", "/bin/bash"],
+                     ["/etc/bash.bashrc"])
+        self.add_pkg("libc6:amd64", ["/.", "/usr/lib/libc.so.6"])
+
+    def tearDown(self):
+        del self.rfs
+
+    def add_pkg(self, name, files, conffiles=None):
+        info = "var/lib/dpkg/info"
+        self.rfs.write_file(f"{info}/{name}.list", 0o644,
+                            "\n".join(files) + "\n")
+        if conffiles:
+            self.rfs.write_file(f"{info}/{name}.conffiles", 0o644,
+                                "\n".join(conffiles) + "\n")
+
+    def test_index(self):
+        index = DpkgFileIndex(self.rfs, "amd64", self.cachefile)
+
+        self.assertEqual(index.owner("/usr/bin/bash"), "bash")
+        self.assertEqual(index.owner("/lib/libc.so.6"), "libc6")
+        self.assertIsNone(index.owner("/etc/hostname"))
+
+        self.assertEqual(index.files("bash"),
+                         ["/.", "/bin", "/bin/bash", "/etc/bash.bashrc"])
+        self.assertEqual(index.files("libc6"), ["/.", "/usr/lib/libc.so.6"])
+        self.assertEqual(index.packages(), {"bash", "libc6"})
+
+    def test_refresh(self):
+        index = DpkgFileIndex(self.rfs, "amd64", self.cachefile)
+        self.assertTrue(os.path.exists(self.cachefile))
+
+        # Nothing changed, nothing to parse
+        self.assertEqual(index.refresh(), 0)
+
+        self.add_pkg("dash", ["/.", "/bin/dash"])
+        self.rfs.remove("var/lib/dpkg/info/bash.list")
+        self.rfs.remove("var/lib/dpkg/info/bash.conffiles")
+        self.assertEqual(index.refresh(), 2)
+
+        self.assertEqual(index.owner("/bin/dash"), "dash")
+        self.assertIsNone(index.owner("/bin/bash"))
+
+        # A new instance picks up the persisted index
+        index = DpkgFileIndex(self.rfs, "amd64", self.cachefile)
+        self.assertEqual(index.refresh(), 0)
+        self.assertEqual(index.packages(), {"dash", "libc6"})
@@ -0,0 +1,268 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import filecmp
+import os
+import shutil
+import time
+import unittest
+
+from contextlib import contextmanager
+
+from lxml.etree import fromstring
+
+from elbepack.commands.test import ElbeTestCase, ElbeTestLevel
+from elbepack.filesystem import TmpdirFilesystem
+from elbepack.fstab import fstabentry, hdpart
+from elbepack.hdimg import do_image_hd, mkfs_from_dir, mkfs_label
+from elbepack.shellhelper import do, get_command_out
+from elbepack.treeutils import elem
+
+
+class FakeEntry(hdpart):
+
+    # pylint: disable=too-few-public-methods
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, fstype, size):
+        super().__init__()
+        self.fstype = fstype
+        self.mkfsopt = ""
+        self.label = "rootfs"
+        self.id = "0"
+        self.partnum = 1
+        self.size = size
+        self.fs_device_commands = []
+        self.fs_path_commands = []
+
+    def get_label_opt(self):
+        return "-L " + self.label
+
+
+@contextmanager
+def mounted(fname, mount_path, opts=""):
+    do(f'mount -o loop,ro{"," + opts if opts else ""} '
+       f'"{fname}" "{mount_path}"')
+    try:
+        yield mount_path
+    finally:
+        do(f'umount "{mount_path}"')
+
+
+@unittest.skipIf(os.geteuid() != 0, "Loop mounts need root")
+class TestMkfsFromDir(ElbeTestCase):
+
+    size = 64 * 1024 * 1024
+
+    def setUp(self):
+        self.tmp = TmpdirFilesystem()
+        self.tmp.mkdir_p("imagemnt")
+        self.tmp.mkdir_p("loopmnt")
+        self.tmp.mkdir_p("dirmnt")
+
+        self.tmp.mkdir_p("filesystems/0/boot/grub")
+        self.tmp.mkdir_p("filesystems/0/empty")
+        self.tmp.write_file("filesystems/0/boot/grub/grub.cfg", 0o644,
+                            "set timeout=0\n")
+        self.tmp.write_file("filesystems/0/README", 0o644, "readme\n")
+        with self.tmp.open("filesystems/0/boot/kernel", "wb") as f:
+            f.write(os.urandom(3 * 1024 * 1024 + 17))
+        self.tmp.symlink("kernel", "filesystems/0/boot/vmlinuz")
+
+    def tearDown(self):
+        del self.tmp
+
+    def image(self, name, entry):
+        fname = self.tmp.fname(name)
+        with open(fname, "wb") as f:
+            f.truncate(entry.size)
+        return fname
+
+    def assertSameTree(self, a, b):
+        # pylint: disable=invalid-name
+        cmp = filecmp.dircmp(a, b, ignore=["lost+found"])
+        self.assertEqual(cmp.left_only, [])
+        self.assertEqual(cmp.right_only, [])
+        self.assertEqual(cmp.funny_files, [])
+        _, mismatch, errors = filecmp.cmpfiles(a, b, cmp.common_files,
+                                               shallow=False)
+        self.assertEqual(mismatch + errors, [])
+        for d in cmp.common_dirs:
+            self.assertSameTree(os.path.join(a, d), os.path.join(b, d))
+
+    def check_fstype(self, fstype):
+        entry = FakeEntry(fstype, self.size)
+
+        # The former path, mkfs on a loop device, mount and cp -a
+        img = hdpart()
+        img.filename = self.image("loop.img", entry)
+        img.size = entry.size
+        loopdev = img.losetup()
+        try:
+            mkfs_label(entry, loopdev, self.tmp.fname("imagemnt"),
+                       self.tmp.path)
+        finally:
+            do(f"losetup -d {loopdev}")
+
+        fname = self.image("dir.img", entry)
+        self.assertTrue(mkfs_from_dir(entry, fname,
+                                      self.tmp.fname("filesystems/0")))
+
+        with mounted(img.filename, self.tmp.fname("loopmnt")) as loop, \
+             mounted(fname, self.tmp.fname("dirmnt")) as mkfs:
+            self.assertSameTree(loop, mkfs)
+            self.assertSameTree(self.tmp.fname("filesystems/0"), mkfs)
+
+    @unittest.skipIf(not shutil.which("mkfs.ext4"), "mkfs.ext4 not found")
+    def test_ext4(self):
+        self.check_fstype("ext4")
+
+    @unittest.skipIf(not (shutil.which("mkfs.vfat") and shutil.which("mcopy")),
+                     "mkfs.vfat or mcopy not found")
+    def test_vfat(self):
+        # vfat can not store symlinks, only the loop mount path skips
+        # them like before
+        entry = FakeEntry("vfat", self.size)
+        self.assertFalse(mkfs_from_dir(entry, self.image("dir.img", entry),
+                                       self.tmp.fname("filesystems/0")))
+
+        self.tmp.remove("filesystems/0/boot/vmlinuz")
+        self.check_fstype("vfat")
+
+    @unittest.skipIf(not shutil.which("mksquashfs"), "mksquashfs not found")
+    def test_squashfs(self):
+        self.check_fstype("squashfs")
+
+    @unittest.skipIf(not shutil.which("mksquashfs"), "mksquashfs not found")
+    def test_squashfs_too_big(self):
+        entry = FakeEntry("squashfs", 1024 * 1024)
+        fname = self.image("dir.img", entry)
+        with self.assertRaises(ValueError):
+            mkfs_from_dir(entry, fname, self.tmp.fname("filesystems/0"))
+
+
+@unittest.skipIf(os.geteuid() != 0, "Loop mounts need root")
+class TestDoImageHd(ElbeTestCase):
+
+    hd = """
+    <msdoshd>
+      <name>disk.img</name>
+      <size>96MiB</size>
+      <partition><size>32MiB</size><label>boot</label></partition>
+      <partition><size>remain</size><label>root</label></partition>
+    </msdoshd>
+    """
+
+    fstab = ("""<bylabel><label>boot</label><source>/dev/sda1</source>
+                <mountpoint>/boot</mountpoint><fs><type>ext2</type></fs>
+                </bylabel>""",
+             """<bylabel><label>root</label><source>/dev/sda2</source>
+                <mountpoint>/</mountpoint><fs><type>ext4</type></fs>
+                </bylabel>""")
+
+    def setUp(self):
+        self.tmp = TmpdirFilesystem()
+        self.tmp.mkdir_p("imagemnt")
+        self.tmp.mkdir_p("mnt")
+
+        self.fslabel = {}
+        for fsid, fs in enumerate(self.fstab):
+            entry = fstabentry(None, elem(fromstring(fs)), fsid)
+            self.fslabel[entry.label] = entry
+            self.tmp.mkdir_p(f"filesystems/{fsid}/{entry.label}")
+            with self.tmp.open(f"filesystems/{fsid}/{entry.label}/data",
+                               "wb") as f:
+                f.write(os.urandom(1024 * 1024))
+
+    def tearDown(self):
+        del self.tmp
+
+    def build(self, jobs):
+        do_image_hd(elem(fromstring(self.hd)), self.fslabel, self.tmp.path,
+                    0, jobs=jobs)
+        fname = self.tmp.fname(f"disk.img.{jobs}")
+        os.rename(self.tmp.fname("disk.img"), fname)
+        return fname
+
+    @staticmethod
+    def partitions(fname):
+        dump = get_command_out(f'sfdisk --dump "{fname}"').decode()
+        return [line.replace(fname, "disk.img")
+                for line in dump.splitlines() if line.startswith(fname)]
+
+    def test_serial_and_parallel(self):
+        serial = self.build(1)
+        parallel = self.build(2)
+
+        self.assertEqual(len(self.partitions(serial)), 2)
+        self.assertEqual(self.partitions(serial), self.partitions(parallel))
+
+        for fname in (serial, parallel):
+            for entry in self.fslabel.values():
+                opts = f"offset={entry.offset},sizelimit={entry.size}"
+                with mounted(fname, self.tmp.fname("mnt"), opts) as mnt:
+                    self.assertTrue(filecmp.cmp(
+                        os.path.join(mnt, entry.label, "data"),
+                        self.tmp.fname(f"filesystems/{entry.id}/"
+                                       f"{entry.label}/data"),
+                        shallow=False))
+
+
+@unittest.skipIf(ElbeTestCase.level < ElbeTestLevel.EXTEND,
+                 "Test level not set to EXTEND")
+@unittest.skipIf(os.geteuid() != 0, "Loop mounts need root")
+class TestMkfsBenchmark(ElbeTestCase):
+
+    rootfs_size = 2 * 1024 * 1024 * 1024
+    file_size = 1024 * 1024
+    nr_dirs = 64
+
+    def setUp(self):
+        self.tmp = TmpdirFilesystem()
+        self.tmp.mkdir_p("imagemnt")
+
+        nr_files = self.rootfs_size // self.file_size
+        for i in range(nr_files):
+            d = f"filesystems/0/usr/share/bench{i % self.nr_dirs}"
+            self.tmp.mkdir_p(d)
+            with self.tmp.open(f"{d}/file{i}", "wb") as f:
+                f.write(os.urandom(self.file_size))
+
+        self.entry = FakeEntry("ext4", self.rootfs_size * 3 // 2)
+
+    def tearDown(self):
+        del self.tmp
+
+    def image(self, name):
+        fname = self.tmp.fname(name)
+        with open(fname, "wb") as f:
+            f.truncate(self.entry.size)
+        return fname
+
+    def test_benchmark(self):
+
+        # The former path, mkfs on a loop device, mount and cp -a
+        img = hdpart()
+        img.filename = self.image("loop.img")
+        img.size = self.entry.size
+        start = time.monotonic()
+        loopdev = img.losetup()
+        try:
+            mkfs_label(self.entry, loopdev, self.tmp.fname("imagemnt"),
+                       self.tmp.path)
+        finally:
+            do(f"losetup -d {loopdev}")
+        loop_time = time.monotonic() - start
+
+        fname = self.image("dir.img")
+        start = time.monotonic()
+        self.assertTrue(mkfs_from_dir(self.entry, fname,
+                                      self.tmp.fname("filesystems/0")))
+        dir_time = time.monotonic() - start
+
+        do(f'e2fsck -fn "{fname}"')
+
+        self.stdout = (f"ext4 from a {self.rootfs_size >> 20} MiB rootfs: "
+                       f"loop mount and cp -a {loop_time:.2f}s, "
+                       f"mkfs.ext4 -d {dir_time:.2f}s")
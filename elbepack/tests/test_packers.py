@@ -0,0 +1,44 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import unittest
+
+from elbepack.filesystem import TmpdirFilesystem
+from elbepack.packers import Packer, pack_files, packers
+
+
+class RecordingPacker(Packer):
+
+    def __init__(self):
+        self.threads = {}
+
+    def pack_file(self, _builddir, fname, threads=None):
+        self.threads[fname] = threads
+        if fname == "broken.img":
+            return None
+        return fname + ".packed"
+
+
+class TestPackFiles(unittest.TestCase):
+
+    def test_cpu_budget(self):
+        packer = RecordingPacker()
+        jobs = [("a.img", packer), ("b.img", packer), ("broken.img", packer)]
+
+        self.assertEqual(pack_files("/", jobs, cpus=8),
+                         ["a.img.packed", "b.img.packed", None])
+        self.assertEqual(packer.threads,
+                         {"a.img": 2, "b.img": 2, "broken.img": 2})
+
+        pack_files("/", jobs[:1], cpus=8)
+        self.assertEqual(packer.threads["a.img"], 8)
+
+    def test_pack(self):
+        with TmpdirFilesystem() as tmp:
+            tmp.write_file("img", 0o644, "image")
+            self.assertEqual(
+                pack_files(tmp.path, [("img", packers["targz"])], cpus=2),
+                ["img.tar.gz"])
+            self.assertFalse(tmp.exists("img"))
+            self.assertTrue(tmp.exists("img.tar.gz"))
@@ -0,0 +1,44 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import unittest
+
+from elbepack.pkgsearch import NameIndex
+
+
+class TestNameIndex(unittest.TestCase):
+
+    names = ["libc6", "libc6-dev", "libssl3", "libssl-dev", "openssl",
+             "bash", "dash", "libc-bin", "ssl-cert", "xz-utils"]
+
+    def setUp(self):
+        self.index = NameIndex(self.names)
+
+    def test_prefix(self):
+        self.assertEqual(self.index.prefix("libc"),
+                         ["libc-bin", "libc6", "libc6-dev"])
+        self.assertEqual(self.index.prefix("libc", limit=2),
+                         ["libc-bin", "libc6"])
+        self.assertEqual(self.index.prefix("zsh"), [])
+
+    def test_substring(self):
+        self.assertEqual(self.index.substring("ssl"),
+                         ["libssl-dev", "libssl3", "openssl", "ssl-cert"])
+        self.assertEqual(self.index.substring("sh"), ["bash", "dash"])
+        self.assertEqual(self.index.substring("-dev", limit=1), ["libc6-dev"])
+
+    def test_glob(self):
+        self.assertEqual(self.index.glob("lib*-dev"),
+                         ["libc6-dev", "libssl-dev"])
+        self.assertEqual(self.index.glob("*ssl[0-9]"), ["libssl3"])
+        self.assertEqual(self.index.glob("?ash"), ["bash", "dash"])
+
+    def test_matches_scan(self):
+        for term in ("l", "ib", "libc", "-", "ssl-", "s", "nope"):
+            self.assertEqual(self.index.search(term),
+                             sorted(n for n in self.names if term in n))
+
+    def test_bad_mode(self):
+        with self.assertRaises(ValueError):
+            self.index.search("libc", mode="regex")
@@ -0,0 +1,95 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import os
+import unittest
+
+from elbepack.filesystem import TmpdirFilesystem
+from elbepack.pkgstore import PackageStore, file_sha256
+
+
+class TestPackageStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = TmpdirFilesystem()
+        self.prj = TmpdirFilesystem()
+        self.store = PackageStore(self.tmp.fname("store"), maxsize=1024)
+
+    def tearDown(self):
+        self.store.close()
+        del self.tmp
+        del self.prj
+
+    def mk_file(self, name, content):
+        self.prj.write_file(name, 0o644, content)
+        return self.prj.fname(name)
+
+    def test_fetch(self):
+        deb = self.mk_file("bash_5.2_amd64.deb", "bash")
+        sha256 = file_sha256(deb)
+
+        self.assertEqual(self.store.fetch([(sha256, self.prj.fname("x.deb"))]),
+                         set())
+
+        self.store.add([(deb, None)])
+
+        dest = self.prj.fname("copy.deb")
+        self.assertEqual(self.store.fetch([(sha256, dest)]), {dest})
+        self.assertEqual(self.prj.read_file("copy.deb"), "bash")
+        self.assertEqual(os.stat(dest).st_ino, os.stat(deb).st_ino)
+
+        # A second store on the same directory shares the index
+        other = PackageStore(self.store.path)
+        self.assertEqual(other.names((".deb",)),
+                         {sha256: "bash_5.2_amd64.deb"})
+        other.close()
+
+    def test_evict(self):
+        debs = []
+        for i in range(3):
+            deb = self.mk_file(f"pkg{i}_1_amd64.deb", str(i) * 400)
+            debs.append((deb, file_sha256(deb)))
+            self.store.add([debs[-1]])
+            # Mark the first one as recently used
+            self.store.fetch([(debs[0][1], self.prj.fname("used.deb"))])
+
+        names = self.store.names((".deb",))
+        self.assertIn(debs[0][1], names)
+        self.assertNotIn(debs[1][1], names)
+        self.assertIn(debs[2][1], names)
+
+    def test_debootstrap_cache(self):
+        deb = self.mk_file("bash_5.2_amd64.deb", "bash")
+        self.mk_file("bash_5.2_arm64.deb", "arm")
+        self.store.add([(deb, None), (self.prj.fname("bash_5.2_arm64.deb"), None)])
+
+        with self.store.debootstrap_cache("amd64") as cachedir:
+            self.assertEqual(os.listdir(cachedir), ["bash_5.2_amd64.deb"])
+            with open(os.path.join(cachedir, "dash_0.5_all.deb"), "w",
+                      encoding="utf-8") as f:
+                f.write("dash")
+
+        self.assertFalse(os.path.exists(cachedir))
+        self.assertIn("dash_0.5_all.deb",
+                      self.store.names(("_all.deb",)).values())
+
+    def test_debootstrap_cache_last_use(self):
+        debs = {}
+        for name in ("used_1_all.deb", "unused_1_all.deb"):
+            deb = self.mk_file(name, name * 30)
+            debs[name] = file_sha256(deb)
+            self.store.add([(deb, debs[name])])
+
+        with self.store.debootstrap_cache("amd64") as cachedir:
+            # debootstrap reads the packages it takes from the cache
+            with open(os.path.join(cachedir, "used_1_all.deb"), "rb") as f:
+                f.read()
+
+        # Only the package read by debootstrap counts as used, the
+        # other one is evicted first
+        self.store.add([(self.mk_file("new_1_all.deb", "n" * 400), None)])
+
+        names = self.store.names((".deb",))
+        self.assertIn(debs["used_1_all.deb"], names)
+        self.assertNotIn(debs["unused_1_all.deb"], names)
@@ -0,0 +1,182 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import gzip
+import hashlib
+import unittest
+
+from debian.deb822 import Packages, Sources
+
+from elbepack.filesystem import TmpdirFilesystem
+from elbepack.repoindex import (RepoIndex, RepoIndexError, get_attr,
+                                open_index)
+from elbepack.shellhelper import do
+
+
+class Attr:
+    # Stand-in for repomanager.RepoAttributes, which pulls in gpg
+    def __init__(self, codename, arch, components):
+        self.codename = codename
+        self.arch = set(arch)
+        self.components = set(components)
+
+
+class TestRepoIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = TmpdirFilesystem()
+        self.repo = TmpdirFilesystem()
+        self.attr = Attr("bookworm", ["amd64", "arm64", "source"],
+                         ["main", "added"])
+
+    def tearDown(self):
+        del self.tmp
+        del self.repo
+
+    def mk_deb(self, name, version, arch="amd64", source=None, content="x"):
+        pkgdir = f"{name}-{version}-{content}"
+        self.tmp.mkdir_p(f"{pkgdir}/DEBIAN")
+        self.tmp.mkdir_p(f"{pkgdir}/usr/share/{name}")
+        self.tmp.write_file(f"{pkgdir}/usr/share/{name}/file", 0o644, content)
+        control = (f"Package: {name}\n"
+                   f"Version: {version}\n"
+                   f"Architecture: {arch}\n"
+                   "Maintainer: Elbe <elbe@example.com>\n"
+                   "Section: misc\n"
+                   "Priority: optional\n"
+                   "Description: test package\n")
+        if source:
+            control += f"Source: {source}\n"
+        self.tmp.write_file(f"{pkgdir}/DEBIAN/control", 0o644, control)
+        deb = self.tmp.fname(f"{name}_{version}_{arch}_{content}.deb")
+        do(f'dpkg-deb --root-owner-group -b "{self.tmp.fname(pkgdir)}" "{deb}"')
+        return deb
+
+    def mk_dsc(self, name, version):
+        tarball = f"{name}_{version}.tar.gz"
+        self.tmp.write_file(tarball, 0o644, "source")
+        data = self.tmp.read_file(tarball).encode()
+        md5 = hashlib.md5(data).hexdigest()
+        sha256 = hashlib.sha256(data).hexdigest()
+        self.tmp.write_file(f"{name}_{version}.dsc", 0o644,
+                            "Format: 1.0\n"
+                            f"Source: {name}\n"
+                            f"Binary: {name}\n"
+                            "Architecture: any\n"
+                            f"Version: {version}\n"
+                            "Maintainer: Elbe <elbe@example.com>\n"
+                            "Checksums-Sha256:\n"
+                            f" {sha256} {len(data)} {tarball}\n"
+                            "Files:\n"
+                            f" {md5} {len(data)} {tarball}\n")
+        return self.tmp.fname(f"{name}_{version}.dsc")
+
+    def read_packages(self, component, arch):
+        index = f"dists/bookworm/{component}/binary-{arch}/Packages"
+        with self.repo.open(index) as f:
+            return {p["Package"]: p for p in Packages.iter_paragraphs(f)}
+
+    def test_binary(self):
+        index = RepoIndex(self.repo)
+        index.includedeb(self.mk_deb("bash", "5.2"), self.attr, "main")
+        index.includedeb(self.mk_deb("libfoo1", "1.0", source="libfoo (1.0)"),
+                         self.attr, ["added"], prio="required")
+        index.includedeb(self.mk_deb("bash-doc", "5.2", arch="all"),
+                         self.attr, "main")
+        index.export([self.attr], "Elbe", "Test repo")
+
+        pkgs = self.read_packages("main", "amd64")
+        self.assertEqual(sorted(pkgs), ["bash", "bash-doc"])
+        self.assertEqual(pkgs["bash"]["Filename"],
+                         "pool/main/b/bash/bash_5.2_amd64_x.deb")
+        self.assertTrue(self.repo.isfile(pkgs["bash"]["Filename"]))
+        self.assertEqual(sorted(self.read_packages("main", "arm64")),
+                         ["bash-doc"])
+
+        pkgs = self.read_packages("added", "amd64")
+        self.assertEqual(pkgs["libfoo1"]["Filename"],
+                         "pool/added/libf/libfoo/libfoo1_1.0_amd64_x.deb")
+        self.assertEqual(pkgs["libfoo1"]["Priority"], "required")
+
+        # The compressed index and the Release checksums must match
+        content = self.repo.read_file(
+            "dists/bookworm/main/binary-amd64/Packages").encode()
+        with self.repo.open("dists/bookworm/main/binary-amd64/Packages.gz",
+                            "rb") as f:
+            self.assertEqual(gzip.decompress(f.read()), content)
+
+        release = self.repo.read_file("dists/bookworm/Release")
+        self.assertIn(f" {hashlib.sha256(content).hexdigest()} ", release)
+        self.assertIn("Components: added main", release)
+        self.assertIn("Architectures: amd64 arm64", release)
+
+    def test_conflict(self):
+        index = RepoIndex(self.repo)
+        index.includedeb(self.mk_deb("bash", "5.2"), self.attr, "main")
+
+        # Same file again is fine, different content is not
+        index.includedeb(self.mk_deb("bash", "5.2"), self.attr, "main")
+        other = self.mk_deb("bash", "5.2", content="y")
+        with self.assertRaises(RepoIndexError):
+            index.includedeb(other, self.attr, "main")
+
+        index.removedeb("bookworm", "bash", ["main"])
+        self.assertFalse(self.repo.exists("pool/main/b/bash/bash_5.2_amd64_x.deb"))
+        index.includedeb(other, self.attr, "main")
+
+    def test_source(self):
+        index = RepoIndex(self.repo)
+        index.includedsc(self.mk_dsc("bash", "5.2"), self.attr, "main")
+        index.export([self.attr], "Elbe", "Test repo")
+
+        with self.repo.open("dists/bookworm/main/source/Sources") as f:
+            srcs = list(Sources.iter_paragraphs(f))
+
+        self.assertEqual(len(srcs), 1)
+        self.assertEqual(srcs[0]["Package"], "bash")
+        self.assertEqual(srcs[0]["Directory"], "pool/main/b/bash")
+        self.assertEqual([f["name"] for f in srcs[0]["Files"]],
+                         ["bash_5.2.dsc", "bash_5.2.tar.gz"])
+        self.assertTrue(self.repo.isfile("pool/main/b/bash/bash_5.2.tar.gz"))
+
+    def test_load(self):
+        index = RepoIndex(self.repo)
+        index.includedeb(self.mk_deb("bash", "5.2"), self.attr, "main")
+        index.includedsc(self.mk_dsc("bash", "5.2"), self.attr, "main")
+        index.export([self.attr], "Elbe", "Test repo")
+
+        index = RepoIndex(self.repo)
+        index.load([self.attr])
+        index.includedeb(self.mk_deb("dash", "0.5"), self.attr, "main")
+        index.export([self.attr], "Elbe", "Test repo")
+
+        self.assertEqual(sorted(self.read_packages("main", "amd64")),
+                         ["bash", "dash"])
+        self.assertIn("bash", self.repo.read_file(
+            "dists/bookworm/main/source/Sources"))
+
+    def test_changes(self):
+        deb = self.mk_deb("bash", "5.2")
+        dsc = self.mk_dsc("bash", "5.2")
+        files = "".join(f" 0 0 misc optional {fname.split('/')[-1]}\n"
+                        for fname in (dsc, deb))
+        self.tmp.write_file("bash_5.2_amd64.changes", 0o644,
+                            "Format: 1.8\n"
+                            "Source: bash\n"
+                            "Version: 5.2\n"
+                            "Distribution: bookworm\n"
+                            # Non-ASCII maintainers are common
+                            "Changed-By: J\u00f6rg <elbe@example.com>\n"
+                            f"Files:\n{files}")
+
+        index = open_index(self.repo, [self.attr])
+        index.include_changes(self.tmp.fname("bash_5.2_amd64.changes"),
+                              get_attr([self.attr], "bookworm"), "main")
+        index.export([self.attr], "Elbe", "Test repo")
+
+        self.assertEqual(sorted(self.read_packages("main", "amd64")),
+                         ["bash"])
+        self.assertTrue(self.repo.isfile("pool/main/b/bash/bash_5.2.dsc"))
+        with self.assertRaises(KeyError):
+            get_attr([self.attr], "trixie")
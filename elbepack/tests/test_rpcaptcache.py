@@ -0,0 +1,134 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import os
+import pickle
+import unittest
+from multiprocessing.managers import BaseManager
+from unittest import mock
+
+from elbepack import rpcaptcache
+from elbepack.rpcaptcache import RPCAPTCache, RPCAPTCacheProxy
+
+
+def fake_version(name, version):
+    records = mock.Mock(hashes=[f"MD5Sum:md5-{name}-{version}",
+                                f"SHA256:sha256-{name}-{version}"])
+    return mock.Mock(version=version, priority="optional",
+                     architecture="amd64", origins=[mock.Mock()],
+                     _records=records)
+
+
+def fake_package(name, installed, candidate):
+    versions = {v: fake_version(name, v) for v in (installed, candidate) if v}
+    pkg = mock.Mock(versions=versions,
+                    installed=versions.get(installed),
+                    candidate=versions.get(candidate),
+                    is_installed=bool(installed), is_upgradable=False,
+                    is_auto_installed=False, marked_install=False,
+                    marked_upgrade=False, marked_delete=False,
+                    section="misc")
+    # name is an argument of Mock()
+    pkg.name = name
+    return pkg
+
+
+class FakeCache(dict):
+
+    def __iter__(self):
+        return iter(self.values())
+
+
+def fake_rpcaptcache():
+    cache = RPCAPTCache.__new__(RPCAPTCache)
+    cache.cache = FakeCache()
+    for pkg in (fake_package("bash", "5.2", "5.2"),
+                fake_package("zsh", None, "5.9")):
+        cache.cache[pkg.name] = pkg
+    cache.generation = 0
+    cache.snapshots = {}
+    return cache
+
+
+class TestCachePool(unittest.TestCase):
+
+    # pylint: disable=protected-access
+
+    def setUp(self):
+        self.cache = RPCAPTCache.__new__(RPCAPTCache)
+        self.cache.cache = mock.Mock(install_count=0, delete_count=0)
+        self.cache.notifier = None
+        self.cache.refresh = mock.Mock(return_value=False)
+
+        st = os.stat("/")
+        self.cache.root_id = lambda: (st.st_dev, st.st_ino)
+        self.rfs = mock.Mock(path="/")
+        self.key = ("/", "amd64", "sources", False, True)
+
+        patcher = mock.patch.dict(rpcaptcache._pool, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reuse(self):
+        rpcaptcache._pool[self.key] = self.cache
+        self.assertIs(rpcaptcache._pooled(self.key, self.rfs, "notifier"),
+                      self.cache)
+        self.assertEqual(self.cache.notifier, "notifier")
+        self.cache.refresh.assert_called_once_with()
+        self.assertIn(self.key, rpcaptcache._pool)
+
+    def test_pending_changes(self):
+        # The marks of the former user are kept, it gets a new server
+        self.cache.cache.configure_mock(install_count=1)
+        rpcaptcache._pool[self.key] = self.cache
+        self.assertIsNone(rpcaptcache._pooled(self.key, self.rfs,
+                                              "notifier"))
+        self.assertIsNone(self.cache.notifier)
+        self.cache.refresh.assert_not_called()
+        self.cache.cache.clear.assert_not_called()
+        self.assertNotIn(self.key, rpcaptcache._pool)
+
+
+class CacheManager(BaseManager):
+    pass
+
+
+CacheManager.register("RPCAPTCache", fake_rpcaptcache, RPCAPTCacheProxy)
+
+
+class TestLazyHashes(unittest.TestCase):
+
+    def assertHashes(self, snap):
+        self.assertEqual([(p.name, p.installed_md5, p.candidate_sha256)
+                          for p in snap],
+                         [("bash", "md5-bash-5.2", "sha256-bash-5.2"),
+                          ("zsh", None, "sha256-zsh-5.9")])
+
+    def test_local(self):
+        cache = fake_rpcaptcache()
+        snap = cache.get_pkglist("all")
+        self.assertIsNone(snap.hashes)
+        self.assertHashes(snap)
+
+        # The cached snapshot is shared, but stays without hashes
+        self.assertIsNone(cache.get_pkglist("all", hashes=False)[0]
+                          .installed_md5)
+
+    def test_pickled(self):
+        snap = fake_rpcaptcache().get_installed_pkgs()
+        snap = pickle.loads(pickle.dumps(snap))
+        self.assertTrue(snap.lazy_hashes)
+        self.assertIsNone(snap.hash_source)
+        with self.assertRaises(RuntimeError):
+            _ = snap[0].installed_md5
+
+    def test_proxy(self):
+        with CacheManager() as mm:
+            # pylint: disable=no-member
+            cache = mm.RPCAPTCache()
+            self.assertEqual(cache.get_sections(), ["misc"])
+            snap = cache.get_pkglist("all")
+            self.assertIsNone(snap.hashes)
+            self.assertHashes(snap)
+            self.assertIsNone(cache.get_pkglist("all", False).hash_source)
@@ -0,0 +1,104 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import io
+import unittest
+
+from contextlib import redirect_stdout
+from threading import Lock
+from unittest import mock
+
+from elbepack.aptpkgutils import INSTALLED, NOTINSTALLED, PackageBase
+from elbepack.daemons.soap.datatypes import SoapPackage
+from elbepack.projectmanager import ProjectManager
+from elbepack.rpcaptcache import RPCAPTCache
+from elbepack.soapclient import ClientAction
+
+
+NAMES = ["libc6", "libc6-dev", "libssl3", "libssl-dev", "openssl", "bash"]
+
+
+def fake_aptpackage(pkg):
+    return PackageBase(pkg.name, pkg.installed_version, "2.0",
+                       None, None, None, None, None, None,
+                       INSTALLED if pkg.installed_version else NOTINSTALLED,
+                       False, None, "amd64")
+
+
+class FakeService:
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, pm):
+        self.pm = pm
+        self.calls = []
+
+    def search_packages(self, builddir, term, mode, limit):
+        # What the soap method does after opening builddir, the reply
+        # looks like the suds array
+        self.calls.append((builddir, term, mode, limit))
+        pkgs = [SoapPackage(p)
+                for p in self.pm.apt_get_pkgs("uid", term,
+                                              mode or "substring",
+                                              limit or None)]
+        return mock.Mock(SoapPackage=pkgs) if pkgs else ""
+
+
+class TestSearchPackages(unittest.TestCase):
+
+    def setUp(self):
+        cache = RPCAPTCache.__new__(RPCAPTCache)
+        cache.cache = {}
+        for name in NAMES:
+            cache.cache[name] = mock.Mock()
+            cache.cache[name].name = name
+            cache.cache[name].installed_version = \
+                "1.0" if name.startswith("lib") else None
+        cache.search_index = None
+
+        pm = ProjectManager.__new__(ProjectManager)
+        pm.lock = Lock()
+        self.client = mock.Mock(service=FakeService(pm))
+
+        for patcher in (mock.patch.object(ProjectManager,
+                                          "_get_current_project_apt_cache",
+                                          return_value=cache),
+                        mock.patch("elbepack.rpcaptcache.APTPackage",
+                                   fake_aptpackage)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def search(self, term, search_mode="substring", limit=None):
+        opt = mock.Mock(search_mode=search_mode, limit=limit)
+        out = io.StringIO()
+        with redirect_stdout(out):
+            ClientAction("search_packages").execute(self.client, opt,
+                                                    ["/var/cache/elbe/x",
+                                                     term])
+        self.assertEqual(self.client.service.calls[-1],
+                         ("/var/cache/elbe/x", term, search_mode, limit))
+        return out.getvalue().splitlines()
+
+    def test_substring(self):
+        self.assertEqual(self.search("ssl"),
+                         ["libssl-dev\t1.0\t2.0\tINSTALLED",
+                          "libssl3\t1.0\t2.0\tINSTALLED",
+                          "openssl\t-\t2.0\tNOT INSTALLED"])
+
+    def test_prefix_limit(self):
+        self.assertEqual(self.search("libc", "prefix", 1),
+                         ["libc6\t1.0\t2.0\tINSTALLED"])
+
+    def test_glob(self):
+        self.assertEqual(self.search("lib*-dev", "glob"),
+                         ["libc6-dev\t1.0\t2.0\tINSTALLED",
+                          "libssl-dev\t1.0\t2.0\tINSTALLED"])
+
+    def test_nothing_found(self):
+        self.assertEqual(self.search("zsh"), ["No packages found"])
+
+    def test_usage(self):
+        with self.assertRaises(SystemExit):
+            ClientAction("search_packages").execute(self.client, mock.Mock(),
+                                                    ["/var/cache/elbe/x"])
@@ -0,0 +1,72 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import os
+import subprocess
+import unittest
+
+from elbepack.filesystem import TmpdirFilesystem
+from elbepack.packers import packers
+from elbepack.seekzstd import (SeekableZstdFile, compress_frames,
+                               decompress_frame, write_seekable)
+
+FRAME = 64 * 1024
+
+
+class TestSeekableZstd(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = TmpdirFilesystem()
+        self.data = os.urandom(FRAME) + bytes(3 * FRAME) + b"end" * 1000
+        with self.tmp.open("img", "wb") as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        del self.tmp
+
+    def test_zstd_compatible(self):
+        write_seekable(self.tmp.fname("img"), self.tmp.fname("img.zst"),
+                       threads=2, frame_size=FRAME)
+        out = subprocess.run(["zstd", "-d", "-c", self.tmp.fname("img.zst")],
+                             check=True, stdout=subprocess.PIPE).stdout
+        self.assertEqual(out, self.data)
+
+    def test_compress_frames(self):
+        # Raw, RLE and compressed blocks, and frames of multiple blocks
+        chunks = [os.urandom(100), b"a" * 1000, b"end" * 1000,
+                  os.urandom(300 * 1024), b""]
+        frames = compress_frames(chunks)
+        self.assertEqual([decompress_frame(f) for f in frames], chunks)
+
+    def test_random_access(self):
+        write_seekable(self.tmp.fname("img"), self.tmp.fname("img.zst"),
+                       frame_size=FRAME)
+
+        with SeekableZstdFile(self.tmp.fname("img.zst")) as f:
+            self.assertEqual(f.size, len(self.data))
+            self.assertEqual(len(f.frames), 5)
+            self.assertIsNone(f.index())
+
+            for offset, size in ((0, 10), (FRAME - 5, 10),
+                                 (4 * FRAME + 2, 7), (len(self.data) - 3, 10)):
+                f.seek(offset)
+                self.assertEqual(f.read(size),
+                                 self.data[offset:offset + size])
+
+            f.seek(0)
+            self.assertEqual(f.read(), self.data)
+
+    def test_tar_member(self):
+        self.assertEqual(packers["tarseekzstd"].pack_file(self.tmp.path,
+                                                          "img", 2),
+                         "img.tar.zst")
+        self.assertFalse(self.tmp.exists("img"))
+        self.assertFalse(self.tmp.exists("img.tar"))
+
+        with SeekableZstdFile(self.tmp.fname("img.tar.zst")) as f:
+            self.assertEqual(list(f.index()), ["img"])
+            self.assertEqual(f.getmember("img").size, len(self.data))
+            self.assertEqual(f.extract("img"), self.data)
+            with self.assertRaises(KeyError):
+                f.extract("missing")
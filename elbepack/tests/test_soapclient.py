@@ -0,0 +1,65 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import binascii
+import unittest
+
+from suds import MethodNotFound
+
+from elbepack.filesystem import TmpdirFilesystem
+from elbepack.soapclient import ElbeSoapClient
+
+
+PART = 1024 * 1024 * 5
+
+
+class OldService:
+    """Service of a daemon without get_sparse_file"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def __getattr__(self, name):
+        raise MethodNotFound(name)
+
+    def get_file(self, _builddir, _filename, part):
+        if part * PART >= len(self.data):
+            return "EndOfFile"
+        return binascii.b2a_base64(
+            self.data[part * PART:(part + 1) * PART]).decode()
+
+
+class SparseService(OldService):
+
+    def get_sparse_file(self, builddir, filename, part):
+        ret = self.get_file(builddir, filename, part)
+        if ret != "EndOfFile" and \
+           not self.data[part * PART:(part + 1) * PART].strip(b"\0"):
+            return f"Hole {len(self.data[part * PART:(part + 1) * PART])}"
+        return ret
+
+
+class TestDownloadFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = TmpdirFilesystem()
+        self.data = b"x" * 100 + bytes(2 * PART) + b"y" * 100
+        self.client = ElbeSoapClient.__new__(ElbeSoapClient)
+
+    def tearDown(self):
+        del self.tmp
+
+    def download(self):
+        self.client.download_file("/var/cache/elbe/x", "img",
+                                  self.tmp.fname("img"))
+        with self.tmp.open("img", "rb") as f:
+            return f.read()
+
+    def test_sparse(self):
+        self.client.service = SparseService(self.data)
+        self.assertEqual(self.download(), self.data)
+
+    def test_old_daemon(self):
+        self.client.service = OldService(self.data)
+        self.assertEqual(self.download(), self.data)
@@ -0,0 +1,163 @@
+# ELBE - Debian Based Embedded Rootfilesystem Builder
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-FileCopyrightText: 2024 Linutronix GmbH
+
+import unittest
+from unittest import mock
+
+from elbepack.virtapt import VirtApt, lookup_uri
+
+
+MIRROR = "http://deb.debian.org/debian/"
+
+
+class FakeFile:
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, name, sha256):
+        self.name = name
+        self.sha256 = sha256
+
+
+class FakeVersion:
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, pkg, version):
+        self.parent_pkg = pkg
+        self.ver_str = version
+        self.file_list = [(None, FakeFile(f"pool/{pkg.name}_{version}.deb",
+                                          f"{pkg.name}-{version}"))]
+
+
+class FakePackage:
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, name):
+        self.name = name
+        self.provides_list = []
+        self.versions = {}
+        self.candidate = None
+
+    def add_version(self, version, provides=(), candidate=True):
+        ver = FakeVersion(self, version)
+        self.versions[version] = ver
+        self.provides_list += [(p, None, ver) for p in provides]
+        if candidate:
+            self.candidate = ver
+        return ver
+
+
+class FakeCache(dict):
+
+    @property
+    def packages(self):
+        return self.values()
+
+    def add(self, name):
+        return self.setdefault(name, FakePackage(name))
+
+
+class FakeDepCache:
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    @staticmethod
+    def get_candidate_ver(pkg):
+        return pkg.candidate
+
+
+class FakeRecords:
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.filename = None
+        self.hashes = None
+
+    def lookup(self, pkgfile):
+        self.filename = pkgfile[1].name
+        self.hashes = mock.Mock()
+        self.hashes.find.return_value = f"SHA256:{pkgfile[1].sha256}"
+
+
+class TestVirtApt(unittest.TestCase):
+
+    def setUp(self):
+        cache = FakeCache()
+        cache.add("libc6").add_version("2.36")
+        cache.add("mawk").add_version("1.3", provides=["awk"])
+        cache.add("gawk").add_version("5.2", provides=["awk"],
+                                      candidate=False)
+        cache.add("pinned").add_version("2.0", candidate=False)
+        cache.add("pinned").add_version("1.0")
+        cache.add("gone")
+        cache.add("newgone").add_version("1.0", provides=["gone"])
+
+        source = mock.Mock()
+        source.find_index.return_value.is_trusted = True
+        source.find_index.return_value.archive_uri = \
+            lambda fname: MIRROR + fname
+
+        self.v = VirtApt.__new__(VirtApt)
+        self.v.cache = cache
+        self.v.source = source
+        self.v.providers = None
+
+        patcher = mock.patch("elbepack.virtapt.apt_pkg.PackageRecords",
+                             FakeRecords)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_provider(self):
+        self.assertEqual(self.v.provider("awk"), "mawk")
+        self.assertEqual(self.v.provider("gone"), "newgone")
+        self.assertIsNone(self.v.provider("bash"))
+        self.assertIsNone(self.v.provider("missing"))
+
+        # The index is built once
+        del self.v.cache["newgone"]
+        self.assertEqual(self.v.provider("gone"), "newgone")
+
+    def test_candidate(self):
+        d = FakeDepCache(self.v.cache)
+
+        pkg, c = self.v.candidate(d, "pinned")
+        self.assertEqual(pkg.name, "pinned")
+        self.assertEqual(c.ver_str, "1.0")
+
+        # Virtual packages and packages without a candidate use the
+        # first provider
+        pkg, c = self.v.candidate(d, "awk")
+        self.assertEqual((pkg.name, c.ver_str), ("mawk", "1.3"))
+        pkg, c = self.v.candidate(d, "gone")
+        self.assertEqual((pkg.name, c.ver_str), ("newgone", "1.0"))
+
+        self.assertEqual(self.v.candidate(d, "missing"), (None, None))
+
+    def test_lookup_uri(self):
+        d = FakeDepCache(self.v.cache)
+
+        self.assertEqual(lookup_uri(self.v, d, "pinned"),
+                         ("pinned", f"{MIRROR}pool/pinned_1.0.deb",
+                          "pinned-1.0"))
+        self.assertEqual(lookup_uri(self.v, d, "missing"), ("", "", ""))
+
+        # Virtual packages resolve to the name of their provider
+        self.assertEqual(lookup_uri(self.v, d, "awk"),
+                         ("mawk", f"{MIRROR}pool/mawk_1.3.deb", "mawk-1.3"))
+        self.assertEqual(lookup_uri(self.v, d, "gone"),
+                         ("newgone", f"{MIRROR}pool/newgone_1.0.deb",
+                          "newgone-1.0"))
+
+    def test_lookup_uri_untrusted(self):
+        self.v.source.find_index.return_value.is_trusted = False
+        self.assertEqual(lookup_uri(self.v, FakeDepCache(self.v.cache),
+                                    "libc6"),
+                         ("libc6", f"{MIRROR}pool/libc6_2.36.deb", ""))
@@ -53,7 +53,7 @@ def gen_update_pkg(project, xml_filename, upd_filename,
 
         cache = project.get_rpcaptcache()
 
-        instpkgs = cache.get_installed_pkgs()
+        instpkgs = cache.get_installed_pkgs(hashes=False)
         instindex = {}
 
         for p in instpkgs:
@@ -14,6 +14,7 @@ import apt  # pylint: disable=unused-import
 import apt_pkg
 
 
+from elbepack.aptlists import ListsCache
 from elbepack.egpg import unarmor_openpgp_keyring
 from elbepack.shellhelper import system
 from elbepack.filesystem import TmpdirFilesystem
@@ -34,18 +35,8 @@ def getdeps(pkg):
 #            For generating host-sysroots there is no posibility to modify
 #            package priorities via elbe-xml.
 def lookup_uri(v, d, target_pkg):
-    try:
-        pkg = v.cache[target_pkg]
-        c = d.get_candidate_ver(pkg)
-    except KeyError:
-        pkg = None
-        c = None
-
+    pkg, c = v.candidate(d, target_pkg)
     if not c:
-        for pkg in v.cache.packages:
-            for x in pkg.provides_list:
-                if target_pkg == x[0]:
-                    return lookup_uri(v, d, x[2].parent_pkg.name)
         return "", "", ""
 
     x = v.source.find_index(c.file_list[0][0])
@@ -54,15 +45,20 @@ def lookup_uri(v, d, target_pkg):
     r.lookup(c.file_list[0])
     uri = x.archive_uri(r.filename)
 
+    # A virtual package resolves to its provider
     if not x.is_trusted:
-        return target_pkg, uri, ""
+        return pkg.name, uri, ""
 
     # pylint: disable=no-member
     hashval = str(r.hashes.find('SHA256')).split(':')[1]
 
-    return target_pkg, uri, hashval
+    return pkg.name, uri, hashval
+
 
 class VirtApt:
+
+    # pylint: disable=too-many-instance-attributes
+
     def __init__(self, xml):
 
         # pylint: disable=too-many-statements
@@ -114,19 +110,39 @@ class VirtApt:
 
         self.source = apt_pkg.SourceList()
         self.source.read_main_list()
+
+        try:
+            lists = ListsCache()
+        except OSError as e:
+            print(f"Lists cache not available: {e}")
+            lists = None
+
+        listsdir = self.basefs.fname("state/lists")
+        if lists is not None:
+            try:
+                lists.seed(listsdir, mirror)
+            except OSError as e:
+                print(f"Can not use the lists cache: {e}")
+
         self.cache = apt_pkg.Cache()
         try:
             self.cache.update(self, self.source)
         except BaseException as e:
             print(e)
 
+        if lists is not None:
+            try:
+                lists.collect(listsdir)
+            except OSError as e:
+                print(f"Can not add package lists to the lists cache: {e}")
+            lists.close()
+
+        # The lists are up to date now, only the cache has to be
+        # built again for the Default-Release
         apt_pkg.config.set("APT::Default-Release", suite)
 
         self.cache = apt_pkg.Cache()
-        try:
-            self.cache.update(self, self.source)
-        except BaseException as e:
-            print(e)
+        self.providers = None
 
         try:
             self.depcache = apt_pkg.DepCache(self.cache)
@@ -248,39 +264,37 @@ class VirtApt:
 
         return d.destfile
 
-    def get_uri(self, target_pkg, incl_deps=False):
+    def provider(self, name):
+        """Return the name of the first package providing name or None
 
-        d = apt_pkg.DepCache(self.cache)
+        The index of all provides is built on the first call, so a
+        lookup does not have to walk the whole cache.
+        """
+        if self.providers is None:
+            self.providers = {}
+            # pylint: disable=E1133
+            for pkg in self.cache.packages:
+                for x in pkg.provides_list:
+                    self.providers.setdefault(x[0], x[2].parent_pkg.name)
 
-        if not incl_deps:
-            return [lookup_uri(self, d, target_pkg)]
+        return self.providers.get(name)
 
-        deps = [lookup_uri(self, d, target_pkg)]
-        togo = [target_pkg]
-        while togo:
-            pp = togo.pop()
-            try:
-                pkg = self.cache[pp]
+    def candidate(self, d, pkgname):
+        """Return package and candidate version of pkgname
+
+        For a virtual package, the first provider is used.
+        """
+        try:
+            pkg = self.cache[pkgname]
+            c = d.get_candidate_ver(pkg)
+        except KeyError:
+            pkg = None
+            c = None
+
+        if not c:
+            provider = self.provider(pkgname)
+            if provider is not None:
+                pkg = self.cache[provider]
                 c = d.get_candidate_ver(pkg)
-            except KeyError:
-                pkg = None
-                c = None
-            if not c:
-                # pylint: disable=E1133
-                for p in self.cache.packages:
-                    for x in p.provides_list:
-                        if pp == x[0]:
-                            pkg = self.cache[x[2].parent_pkg.name]
-                            c = d.get_candidate_ver(pkg)
-            if not c:
-                print(f"couldnt get candidate: {pkg}")
-            else:
-                for p in getdeps(c):
-                    if [y for y in deps if y[0] == p]:
-                        continue
-                    if p != target_pkg and p == pp:
-                        continue
-                    deps.append(lookup_uri(self, d, p))
-                    togo.append(p)
-
-        return list(set(deps))
+
+        return pkg, c